@@ -1,15 +1,57 @@
-from flask import Flask, flash, redirect, render_template, request, jsonify
+from flask import (
+    Flask,
+    flash,
+    get_template_attribute,
+    redirect,
+    render_template,
+    request,
+    jsonify,
+    stream_with_context,
+)
 from flask_session import Session
+import sqlite3
 import traceback
-from werkzeug.security import check_password_hash, generate_password_hash
+from auth import (
+    LoginThrottle,
+    PasswordPoolBusy,
+    check_password,
+    find_login_user,
+    hash_password,
+)
 from google_calendar import *
 from help import *
+from schema import migrate_database
+from calendar_sync import CalendarSyncWorker
+from work_items import *
+from tree_cache import TreeCache
+from search import search
+from dashboard import BadPageRequest, project_page
+from sessions import SessionSweeper, SQLiteSessionInterface
+from changes import (
+    CHANGE_FEED_PAGE_SIZE,
+    ChangeLogCompactor,
+    feed_project,
+    latest_change_seq,
+    project_changes,
+)
+from validation import validate_task_changes
+from project_io import (
+    ImportProblem,
+    export_jsonl,
+    export_outline,
+    import_format,
+    import_projects,
+    text_lines,
+)
+import metrics
 import logging
+import math
+import os
+from datetime import date, datetime, timezone
 
 
 # NICE TO HAVE Changes
 # TODO: Let text area for a task grow and push everything below it downward.
-# TODO: Add sort buttons next to the column headers on the projects page *maybe*. Might be a better way of doing this.
 # TODO: Add a line connecting the parent task to all its children. e.g. :
 # parent
 #      |
@@ -23,6 +65,7 @@ import logging
 #   DONE: BUGFIX: When adding new tasks to a project, the top level task does not get assigned the correct parent ID.
 #   DONE: Fix the broken task saving function...
 #   DONE: added new test user
+#   DONE: Add sort buttons next to the column headers on the projects page.
 #   DONE: Added shadow to navbar text items, so they are distinguished from background.
 #   DONE: fix this bug: level 1 tasks' hour tracking are read only even when they have no subtasks.
 #   DONE: fix the "Description" text going over the input.
@@ -35,10 +78,34 @@ import logging
 # Configure application
 app = Flask(__name__)
 
-# Configure session to use filesystem (instead of signed cookies)
+# Per-request timings and counts, served at /metrics.
+metrics.init_app(app)
+
+migrate_database()
+
+# Sessions are kept in the database (see sessions.py) unless
+# LIFEMAP_SESSION_BACKEND names one of Flask-Session's, e.g. "filesystem".
 app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
+SESSION_BACKEND = os.environ.get("LIFEMAP_SESSION_BACKEND", "sqlite")
+if SESSION_BACKEND == "sqlite":
+    app.session_interface = SQLiteSessionInterface()
+    session_sweeper = SessionSweeper()
+    session_sweeper.start()
+else:
+    app.config["SESSION_TYPE"] = SESSION_BACKEND
+    Session(app)
+
+# Google Calendar changes are queued in calendar_outbox and sent from here.
+calendar_worker = CalendarSyncWorker()
+calendar_worker.start()
+
+# Compacts the change feed's log, see changes.py.
+change_log_compactor = ChangeLogCompactor()
+change_log_compactor.start()
+
+# Built task trees, see tree_cache.py.
+tree_cache = TreeCache()
+login_throttle = LoginThrottle()
 
 
 def task_to_dict(row):
@@ -69,18 +136,46 @@ def error_page(message, code=400):
     return render_template("error_page.html", code=code, message=message), code
 
 
+@app.errorhandler(PasswordPoolBusy)
+def password_pool_busy(e):
+    return error_page("The server is busy, please try again in a moment.", 503)
+
+
+@app.before_request
+def load_logged_in_user():
+    load_user()
+
+
 @app.teardown_appcontext
 def close_db(e=None):
-    lifemap_db = g.pop("lifemap_db", None)
-    if lifemap_db is not None:
-        lifemap_db.close()
+    release_db()
+
+
+# Static files are versioned by their modification time in the URL, so browsers
+# can keep them for a year and still pick up a new version straight away.
+app.config["SEND_FILE_MAX_AGE_DEFAULT"] = 365 * 24 * 60 * 60
+
+
+@app.url_defaults
+def static_version(endpoint, values):
+    if endpoint == "static" and "filename" in values:
+        path = os.path.join(app.static_folder, values["filename"])
+        if os.path.isfile(path):
+            values["v"] = int(os.path.getmtime(path))
 
 
 @app.after_request
 def after_request(response):
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Expires"] = 0
-    response.headers["Pragma"] = "no-cache"
+    if request.endpoint == "static":
+        response.cache_control.immutable = True
+    elif response.get_etag()[0] is not None or response.status_code == 304:
+        # Has a validator, so the browser may keep it but must check it first.
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    else:
+        response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+        response.headers["Expires"] = 0
+        response.headers["Pragma"] = "no-cache"
     return response
 
 
@@ -112,6 +207,7 @@ def change_username():
             (new_username, user_id),
         )
         conn.commit()
+        forget_user()
         flash("Username changed successfully!", "success")
         return redirect("/")
     except Exception as e:
@@ -141,20 +237,24 @@ def reset_password():
         return error_page("User not found.", 404)
     stored_hash = user_hash_record["password_hash"]
 
-    if check_password_hash(stored_hash, current_password):
-        if check_password_hash(stored_hash, new_password):
+    if check_password(stored_hash, current_password):
+        if check_password(stored_hash, new_password):
             return error_page(
                 "New password cannot be the same as current password.", 400
             )
-        new_hashed_password = generate_password_hash(
-            new_password, method="scrypt", salt_length=16
-        )
+        new_hashed_password = hash_password(new_password)
         try:
             cursor.execute(
                 """UPDATE users SET password_hash = ? WHERE user_id = ?""",
                 (new_hashed_password, user_id),
             )
+            # Whoever else was logged in with the old password is logged out.
+            if isinstance(app.session_interface, SQLiteSessionInterface):
+                app.session_interface.end_user_sessions(
+                    cursor, user_id, getattr(session, "session_id", None)
+                )
             conn.commit()
+            forget_user()
             flash("Password changed successfully!", "success")
             return redirect("/")
         except Exception as e:
@@ -176,23 +276,23 @@ def login():
         if not password:
             return error_page("must provide password", 403)
 
+        # Refused before the database or any hashing is touched.
+        address = request.remote_addr
+        wait = login_throttle.retry_after(login_input, address)
+        if wait:
+            return error_page(
+                f"Too many failed logins, try again in {math.ceil(wait / 60)} minutes.",
+                429,
+            )
+
         conn = get_db()
         cursor = conn.cursor()
-        cursor.execute(
-            """SELECT * FROM users WHERE username = ? OR email = ? LIMIT 1""",
-            (login_input, login_input),
-        )
-        row = cursor.fetchone()
-
-        if not row or not check_password_hash(row["password_hash"], password):
-            lowered = login_input.lower()
-            cursor.execute(
-                """SELECT * FROM users WHERE email = ? LIMIT 1""", (lowered,)
-            )
-            row = cursor.fetchone()
-            if not row or not check_password_hash(row["password_hash"], password):
-                return error_page("invalid username and/or password", 403)
+        row = find_login_user(cursor, login_input)
+        if not row or not check_password(row["password_hash"], password):
+            login_throttle.failed(login_input, address)
+            return error_page("invalid username and/or password", 403)
 
+        login_throttle.succeeded(login_input)
         session["user_id"] = row["user_id"]
         return redirect("/")
     else:
@@ -236,9 +336,7 @@ def register():
             cursor.execute("SELECT user_id FROM users WHERE username = ?", (username,))
             if cursor.fetchone():
                 return error_page("Username already taken.", 400)
-            hashed_password = generate_password_hash(
-                password, method="scrypt", salt_length=16
-            )
+            hashed_password = hash_password(password)
             cursor.execute(
                 """INSERT INTO users (username, email, password_hash) VALUES (?,?,?) """,
                 (username, email, hashed_password),
@@ -246,6 +344,8 @@ def register():
             conn.commit()
             flash("Registered successfully! Please log in.")
             return redirect("/login")
+        except PasswordPoolBusy:
+            raise
         except Exception as e:
             traceback.print_exc()
             conn.rollback()
@@ -339,7 +439,7 @@ def edit_project(project_id):
 
         try:
             cursor.execute(
-                "SELECT 1 FROM projects WHERE user_id = ? AND project_id = ?",
+                PROJECT_OWNER_SQL,
                 (user_id, project_id),
             )
             if not cursor.fetchone():
@@ -359,14 +459,12 @@ def edit_project(project_id):
             )
 
             cursor.execute(
-                """
-                UPDATE work_items SET name = ?, description = ?
-                WHERE project_id = ? AND parent_item_id IS NULL
-            """,
-                (new_title, new_description, project_id),
+                RENAME_PROJECT_ROOT_SQL, (new_title, new_description, project_id)
             )
+            bump_project_revision(cursor, project_id)
 
             conn.commit()
+            tree_cache.invalidate(project_id)
             flash("Project updated successfully!", "success")
             return redirect("/projects")
         except Exception as e:
@@ -386,7 +484,7 @@ def tasks(project_id):
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute(
-        """SELECT name, description FROM projects WHERE user_id = ? AND project_id = ?""",
+        """SELECT name, description, revision FROM projects WHERE user_id = ? AND project_id = ?""",
         (user_id, project_id),
     )
 
@@ -397,11 +495,13 @@ def tasks(project_id):
 
     project_name = project_details["name"]
 
-    cursor.execute("""SELECT * FROM work_items WHERE project_id = ?""", (project_id,))
-
-    tasks_flat_list = cursor.fetchall()
-
-    tree = build_task_tree(tasks_flat_list)
+    # Only the expanded branches, minimized tasks load their subtasks on demand.
+    tree = tree_cache.get_or_build(
+        project_id,
+        project_details["revision"],
+        lambda: build_task_tree(visible_task_rows(cursor, project_id)),
+        view="visible",
+    )
 
     return render_template(
         "tasks.html",
@@ -413,6 +513,122 @@ def tasks(project_id):
     )
 
 
+def _cached_tree(cursor, project_id, revision):
+    """The project's whole task tree, from tree_cache if it was built at this revision."""
+
+    def build():
+        cursor.execute(PROJECT_TASKS_SQL, (project_id,))
+        return build_task_tree(cursor.fetchall())
+
+    return tree_cache.get_or_build(project_id, revision, build)
+
+
+@app.route("/api/projects/<int:project_id>/tree")
+@login_required
+def project_tree(project_id):
+    """
+    The project's whole task tree as JSON. The project's revision is the
+    ETag, so an unchanged tree is answered with a 304 before it is built.
+    """
+    user_id = session["user_id"]
+    cursor = get_db().cursor()
+
+    # Read before the tree, so the tree is never older than the seq.
+    seq = latest_change_seq(cursor, project_id)
+    project = project_revision(cursor, user_id, project_id)
+    if project is None:
+        return jsonify({"error": "Project not found or not owned by user."}), 404
+
+    etag = f"{project_id}-{project['revision']}"
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    response = jsonify(
+        {
+            "project_id": project_id,
+            "revision": project["revision"],
+            "seq": seq,
+            "tasks": _cached_tree(cursor, project_id, project["revision"]),
+        }
+    )
+    response.set_etag(etag)
+    if project["modified_at"]:
+        response.last_modified = datetime.strptime(
+            project["modified_at"], "%Y-%m-%d %H:%M:%S"
+        ).replace(tzinfo=timezone.utc)
+    return response.make_conditional(request)
+
+
+@app.route("/api/projects/<int:project_id>/changes")
+@login_required
+def project_change_feed(project_id):
+    """
+    What changed in the project after the change numbered `since`, for a
+    client catching up without loading the whole tree again: the current
+    state of each task changed since, oldest change first, and the project's
+    fields if they changed. Once `since` is older than the project's snapshot
+    (see changes.py), or if it is left out, the whole tree is sent instead
+    with "snapshot" set. Either way "seq" is the `since` to ask with next.
+    """
+    user_id = session["user_id"]
+    cursor = get_db().cursor()
+
+    since = request.args.get("since", type=int)
+    limit = request.args.get("limit", CHANGE_FEED_PAGE_SIZE, type=int)
+    if not 0 < limit <= CHANGE_FEED_PAGE_SIZE:
+        return jsonify({"error": "Invalid limit."}), 400
+
+    # Read before the project and its tree, so neither is older than the seq.
+    seq = latest_change_seq(cursor, project_id)
+    project = feed_project(cursor, user_id, project_id)
+    if project is None:
+        return jsonify({"error": "Project not found or not owned by user."}), 404
+    fields = {
+        key: project[key]
+        for key in project.keys()
+        if key not in ("snapshot_seq", "modified_at")
+    }
+
+    if since is None or since < project["snapshot_seq"]:
+        return jsonify(
+            {
+                "project_id": project_id,
+                "seq": seq,
+                "snapshot": True,
+                "project": fields,
+                "tasks": _cached_tree(cursor, project_id, project["revision"]),
+                "has_more": False,
+            }
+        )
+
+    changes, has_more = project_changes(cursor, project_id, since, limit)
+    items = []
+    project_changed = False
+    for change_seq, item_id, kind, row in changes:
+        if item_id is None:
+            project_changed = True
+            continue
+        task = None
+        if row is not None:
+            task = task_row_to_dict(row)
+            del task["subtasks"]
+        items.append(
+            {"seq": change_seq, "item_id": item_id, "change": kind, "task": task}
+        )
+    return jsonify(
+        {
+            "project_id": project_id,
+            "seq": changes[-1][0] if changes else since,
+            "snapshot": False,
+            "project": fields if project_changed else None,
+            "changes": items,
+            "has_more": has_more,
+        }
+    )
+
+
 @app.route("/projects/<int:project_id>/delete", methods=["POST"])
 @login_required
 def delete_project(project_id):
@@ -440,17 +656,14 @@ def delete_project(project_id):
         ]
 
         for event_id in event_ids_to_delete:
-            try:
-                delete_google_event(event_id)
-            except Exception as e:
-                print(
-                    f"Warning: Failed to delete Google Calendar event {event_id}: {e}"
-                )
+            enqueue_event_delete(cursor, event_id)
 
         cursor.execute("DELETE FROM work_items WHERE project_id = ?", (project_id,))
         cursor.execute("DELETE FROM projects WHERE project_id = ?", (project_id,))
 
         conn.commit()
+        tree_cache.invalidate(project_id)
+        calendar_worker.notify()
         flash("Project deleted successfully!", "success")
         return redirect("/projects")
 
@@ -467,24 +680,49 @@ def delete_project(project_id):
 @login_required
 def calendar():
     user_id = session["user_id"]
-    conn = get_db()
-    cursor = conn.cursor()
-
-    cursor.execute(
-        """
-        SELECT name, description, due_date, google_calendar_event_id
-        FROM work_items
-        WHERE project_id IN (SELECT project_id FROM projects WHERE user_id = ?)
-        AND due_date IS NOT NULL
-        ORDER BY due_date
-    """,
-        (user_id,),
+    # The events are fetched by FullCalendar from /api/calendar/events, one visible range at a time.
+    return render_template(
+        "calendar.html",
+        project_id=request.args.get("project_id", type=int),
+        username=get_username(user_id),
     )
 
-    tasks_with_due_dates = cursor.fetchall()
+
+def _feed_date(value):
+    """FullCalendar sends ISO datetimes like 2026-09-28T00:00:00+01:00, only the date is used."""
+    try:
+        return date.fromisoformat((value or "")[:10]).isoformat()
+    except ValueError:
+        return None
+
+
+@app.route("/api/calendar/events")
+@login_required
+def calendar_events():
+    """The user's dated tasks between start and end, in FullCalendar's event format."""
+    user_id = session["user_id"]
+    start = _feed_date(request.args.get("start"))
+    end = _feed_date(request.args.get("end"))
+    if start is None or end is None or start >= end:
+        return jsonify({"error": "start and end must be ISO dates, start first."}), 400
+
+    limit = request.args.get("limit", CALENDAR_EVENT_LIMIT, type=int)
+    if not 0 < limit <= 2000:
+        return jsonify({"error": "Invalid limit."}), 400
+
+    cursor = get_db().cursor()
+    # One extra row tells us whether the range had more events than the limit.
+    tasks_with_due_dates = dated_items_between(
+        cursor,
+        user_id,
+        start,
+        end,
+        project_id=request.args.get("project_id", type=int),
+        limit=limit + 1,
+    )
 
     events_for_calendar = []
-    for task in tasks_with_due_dates:
+    for task in tasks_with_due_dates[:limit]:
         # FullCalendar expects events in a specific format.
         # title is the event's title
         # start is the event's start date/time
@@ -499,37 +737,178 @@ def calendar():
                 "id": task[
                     "google_calendar_event_id"
                 ],  # Use the Google Calendar event ID if available
+                "extendedProps": {
+                    "item_id": task["item_id"],
+                    "project_id": task["project_id"],
+                    "is_completed": bool(task["is_completed"]),
+                },
             }
         )
 
-    return render_template(
-        "calendar.html", events=events_for_calendar, username=get_username(user_id)
+    response = jsonify(events_for_calendar)
+    response.headers["X-Events-Truncated"] = (
+        "true" if len(tasks_with_due_dates) > limit else "false"
     )
+    return response
 
 
 @app.route("/projects", methods=["GET", "POST"])
 @login_required
 def projects_list():
     if request.method == "GET":
-        conn = get_db()
-        cursor = conn.cursor()
-        user_id = session["user_id"]
-
-        cursor.execute(
-            """SELECT * FROM projects WHERE user_id = ? ORDER BY end_date ASC""",
-            (user_id,),
-        )
-        rows = [dict(row) for row in cursor.fetchall()]
+        try:
+            sort, descending, filter_name, rows, next_token = _projects_page()
+        except BadPageRequest as e:
+            return error_page(str(e), 400)
         for row in rows:
             row["readable_due_date"] = format_date_difference(row["end_date"])
 
         return render_template(
-            "projects.html", projects=rows, username=get_username(user_id)
+            "projects.html",
+            projects=rows,
+            sort=sort,
+            descending=descending,
+            filter_name=filter_name,
+            next_token=next_token,
+            username=get_username(session["user_id"]),
         )
     else:
         return error_page("Request Error, Only GET requests accepted.", 403)
 
 
+def _projects_page():
+    sort = request.args.get("sort", "due")
+    descending = request.args.get("order") == "desc"
+    filter_name = request.args.get("filter") or None
+    rows, next_token = project_page(
+        get_db().cursor(),
+        session["user_id"],
+        sort,
+        descending,
+        filter_name,
+        after=request.args.get("after"),
+    )
+    return sort, descending, filter_name, rows, next_token
+
+
+@app.route("/api/projects")
+@login_required
+def projects_api():
+    """
+    One page of the user's projects, as on the projects page. Takes sort (due,
+    name, start or progress), order=desc, filter (overdue, this_week or
+    completed) and after, the next_page token of the page before.
+    """
+    try:
+        sort, descending, filter_name, rows, next_token = _projects_page()
+    except BadPageRequest as e:
+        return jsonify({"error": str(e)}), 400
+    for row in rows:
+        row.pop("sort_key")
+        row["due_this_week"] = bool(row["due_this_week"])
+    return jsonify({"projects": rows, "next_page": next_token})
+
+
+EXPORT_FORMATS = {
+    "jsonl": (export_jsonl, "application/x-ndjson", "jsonl"),
+    "outline": (export_outline, "text/plain; charset=utf-8", "txt"),
+}
+
+
+@app.route("/projects/export")
+@app.route("/projects/<int:project_id>/export")
+@login_required
+def export_projects(project_id=None):
+    """
+    Downloads one project, or all of the user's, as JSON Lines or an outline
+    (?format=outline). The file is streamed as it is read from the database.
+    """
+    user_id = session["user_id"]
+    export_format = request.args.get("format", "jsonl")
+    if export_format not in EXPORT_FORMATS:
+        return error_page("Unknown export format.", 400)
+
+    cursor = get_db().cursor()
+    if project_id is not None:
+        cursor.execute(
+            PROJECT_OWNER_SQL,
+            (user_id, project_id),
+        )
+        if not cursor.fetchone():
+            return error_page("Project not found or you are not authorized.", 404)
+
+    export, mimetype, extension = EXPORT_FORMATS[export_format]
+    response = app.response_class(
+        stream_with_context(export(cursor, user_id, project_id)), mimetype=mimetype
+    )
+    filename = f"lifemap-{project_id or 'projects'}-{date.today().isoformat()}"
+    response.headers["Content-Disposition"] = (
+        f'attachment; filename="{filename}.{extension}"'
+    )
+    return response
+
+
+@app.route("/projects/import", methods=["POST"])
+@login_required
+def import_projects_form():
+    """Creates projects from a file uploaded on the projects page."""
+    upload = request.files.get("file")
+    if upload is None or not upload.filename:
+        return error_page("No file chosen to import.", 400)
+
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        project_ids, task_count = import_projects(
+            cursor,
+            session["user_id"],
+            text_lines(upload.stream),
+            import_format(upload.filename),
+        )
+        conn.commit()
+    except ImportProblem as e:
+        conn.rollback()
+        return error_page(f"Couldn't import {upload.filename}. {e}", 400)
+    except Exception as e:
+        traceback.print_exc()
+        conn.rollback()
+        return error_page(f"Error importing projects: {e}")
+
+    calendar_worker.notify()
+    flash(f"Imported {len(project_ids)} project(s) with {task_count} tasks.")
+    return redirect("/projects")
+
+
+@app.route("/api/projects/import", methods=["POST"])
+@login_required
+def import_projects_api():
+    """
+    Creates projects from the request body, an export in the format given by
+    ?format= ("jsonl" by default or "outline"), read as it arrives.
+    """
+    import_format_name = request.args.get("format", "jsonl")
+    if import_format_name not in EXPORT_FORMATS:
+        return jsonify({"error": "Unknown import format."}), 400
+
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        project_ids, task_count = import_projects(
+            cursor, session["user_id"], text_lines(request.stream), import_format_name
+        )
+        conn.commit()
+    except ImportProblem as e:
+        conn.rollback()
+        return jsonify({"error": str(e), "line": e.line_number}), 400
+    except Exception as e:
+        conn.rollback()
+        traceback.print_exc()
+        return jsonify({"error": "Internal server error", "details": str(e)}), 500
+
+    calendar_worker.notify()
+    return jsonify({"project_ids": project_ids, "task_count": task_count}), 201
+
+
 @app.route("/save-tasks", methods=["POST"])
 @login_required
 @log_calls
@@ -539,58 +918,98 @@ def save_tasks():
     cursor = conn.cursor()
 
     try:
-        # Get data from the POST request
+        # Only the changed items are sent, see collectChangedTasks in tasks.js.
         data = request.get_json()
         project_id = data.get("project_id")
-        tasks_data = data.get("tasks", [])
+        changes = data.get("changes", [])
         deleted_item_ids = data.get("deleted_item_ids", [])
 
         cursor.execute(
-            "SELECT item_id, google_calendar_event_id FROM work_items WHERE project_id = ?",
-            (project_id,),
-        )
-
-        existing_google_events = {
-            row["item_id"]: row["google_calendar_event_id"] for row in cursor.fetchall()
-        }
-
-        cursor.execute(
-            "SELECT 1 FROM projects WHERE user_id = ? AND project_id = ?",
+            PROJECT_OWNER_SQL,
             (user_id, project_id),
         )
         if not cursor.fetchone():
             return jsonify({"error": "Project not found or not owned by user."}), 403
 
-        if deleted_item_ids:
-            clean_ids = [int(i) for i in deleted_item_ids if str(i).isdigit()]
-            if clean_ids:
-                placeholders = ",".join(["?"] * len(clean_ids))
-
-                cursor.execute(
-                    f"SELECT item_id, google_calendar_event_id FROM work_items WHERE item_id IN ({placeholders})",
-                    clean_ids,
+        # Deleting the root would take the whole tree with it, as in delete_item.
+        clean_ids = [int(i) for i in deleted_item_ids if str(i).isdigit()]
+        if clean_ids:
+            cursor.execute(
+                """SELECT item_id FROM work_items WHERE project_id = ? AND parent_item_id IS NULL""",
+                (project_id,),
+            )
+            root = cursor.fetchone()
+            if root is not None and root["item_id"] in clean_ids:
+                return (
+                    jsonify({"error": "The project's root task can't be deleted."}),
+                    400,
                 )
-                items_to_delete = cursor.fetchall()
 
-                for item in items_to_delete:
-                    if item["google_calendar_event_id"]:
-                        delete_google_event(item["google_calendar_event_id"])
+        # Takes SQLite's write lock straight away, so no other save can get
+        # in between the checks below and the writes.
+        conn.execute("BEGIN IMMEDIATE")
 
-                cursor.execute(
-                    f"DELETE FROM work_items WHERE item_id IN ({placeholders}) AND project_id = ?",
-                    clean_ids + [project_id],
-                )
-
-        id_map = {}
+        # Tasks edited elsewhere since this page loaded them are reported
+        # rather than overwritten, nothing is saved.
+        conflicts = version_conflicts(cursor, project_id, changes)
+        if conflicts:
+            conn.rollback()
+            return (
+                jsonify(
+                    {
+                        "error": "Some tasks were changed elsewhere since this page was loaded.",
+                        "conflicts": conflicts,
+                    }
+                ),
+                409,
+            )
 
-        # Start the process with the top-level tasks from the request
-        process_task_list(
-            tasks_data, cursor, id_map, project_id, existing_google_events
+        # Checked before anything is written, so a bad save changes nothing.
+        violations = validate_task_changes(
+            cursor, project_id, changes, deleted_item_ids
         )
+        if violations:
+            conn.rollback()
+            return (
+                jsonify(
+                    {
+                        "error": "The changes break the rules of the task tree.",
+                        "violations": violations,
+                    }
+                ),
+                400,
+            )
+
+        if clean_ids:
+            delete_subtrees(cursor, project_id, clean_ids)
+
+        id_map, versions = apply_task_changes(changes, cursor, project_id)
+
+        # The written rows as they are now, so the page can update in place.
+        items = []
+        if versions:
+            items = [
+                task_row_to_dict(row)
+                for row in task_rows(cursor, project_id, list(versions))
+            ]
+        revision = project_revision(cursor, user_id, project_id)["revision"]
 
         conn.commit()
+        tree_cache.invalidate(project_id)
+        calendar_worker.notify()
         return (
-            jsonify({"message": "Tasks saved successfully!", "new_ids_map": id_map}),
+            jsonify(
+                {
+                    "message": "Tasks saved successfully!",
+                    "new_ids_map": id_map,
+                    "versions": versions,
+                    "items": [
+                        {key: value for key, value in item.items() if key != "subtasks"}
+                        for item in items
+                    ],
+                    "revision": revision,
+                }
+            ),
             200,
         )
 
@@ -602,5 +1021,295 @@ def save_tasks():
         return jsonify({"error": "Internal server error", "details": str(e)}), 500
 
 
+@app.route("/api/items/<int:item_id>/complete", methods=["POST"])
+@login_required
+def complete_item(item_id):
+    """Completes a task and its whole subtree, or un-completes it and its parents."""
+    user_id = session["user_id"]
+    conn = get_db()
+    cursor = conn.cursor()
+
+    item = get_owned_item(cursor, user_id, item_id)
+    if item is None:
+        return jsonify({"error": "Task not found or not owned by user."}), 404
+
+    data = request.get_json(silent=True) or {}
+    try:
+        if data.get("is_completed", True):
+            changed = complete_subtree(cursor, item["project_id"], item_id)
+        else:
+            changed = uncomplete_with_ancestors(cursor, item["project_id"], item_id)
+        conn.commit()
+        tree_cache.invalidate(item["project_id"])
+        return jsonify({"message": "Task updated.", "changed": changed}), 200
+    except sqlite3.Error as e:
+        conn.rollback()
+        traceback.print_exc()
+        return jsonify({"error": "Internal server error", "details": str(e)}), 500
+
+
+@app.route("/api/items/<int:item_id>/delete", methods=["POST"])
+@login_required
+def delete_item(item_id):
+    """Deletes a task and all of its subtasks."""
+    user_id = session["user_id"]
+    conn = get_db()
+    cursor = conn.cursor()
+
+    item = get_owned_item(cursor, user_id, item_id)
+    if item is None:
+        return jsonify({"error": "Task not found or not owned by user."}), 404
+    if item["parent_item_id"] is None:
+        return jsonify({"error": "The project's root task can't be deleted."}), 400
+
+    try:
+        event_ids = delete_subtrees(cursor, item["project_id"], [item_id])
+        conn.commit()
+        tree_cache.invalidate(item["project_id"])
+        calendar_worker.notify()
+        return (
+            jsonify({"message": "Task deleted.", "deleted_event_ids": event_ids}),
+            200,
+        )
+    except sqlite3.Error as e:
+        conn.rollback()
+        traceback.print_exc()
+        return jsonify({"error": "Internal server error", "details": str(e)}), 500
+
+
+@app.route("/api/items/<int:item_id>/move", methods=["POST"])
+@login_required
+def move_item(item_id):
+    """
+    Moves a task under parent_item_id, just in front of before_item_id or
+    just behind after_item_id, or to the end if neither is given. Only the
+    task's own row and the roll-ups above it are written. With a version, a
+    task changed elsewhere since then isn't moved.
+    """
+    user_id = session["user_id"]
+    conn = get_db()
+    cursor = conn.cursor()
+
+    item = get_owned_item(cursor, user_id, item_id)
+    if item is None:
+        return jsonify({"error": "Task not found or not owned by user."}), 404
+    if item["parent_item_id"] is None:
+        return jsonify({"error": "The project's root task can't be moved."}), 400
+
+    data = request.get_json(silent=True) or {}
+    sibling_ids = {}
+    for key in ("parent_item_id", "before_item_id", "after_item_id"):
+        value = data.get(key)
+        if value is not None and not str(value).isdigit():
+            return jsonify({"error": f"Invalid {key}."}), 400
+        sibling_ids[key] = int(value) if value is not None else None
+    parent_id = sibling_ids.pop("parent_item_id")
+    if parent_id is None:
+        return jsonify({"error": "parent_item_id is required."}), 400
+    project_id = item["project_id"]
+
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        if "version" in data:
+            conflicts = version_conflicts(
+                cursor,
+                project_id,
+                [
+                    {
+                        "item_id": item_id,
+                        "name": item["name"],
+                        "version": data["version"],
+                    }
+                ],
+            )
+            if conflicts:
+                conn.rollback()
+                return (
+                    jsonify(
+                        {
+                            "error": "The task was changed elsewhere since this page was loaded.",
+                            "conflicts": conflicts,
+                        }
+                    ),
+                    409,
+                )
+
+        # The same rules as a save, for this one task in its new place.
+        violations = validate_task_changes(
+            cursor,
+            project_id,
+            [
+                {
+                    "item_id": item_id,
+                    "parent_item_id": parent_id,
+                    "name": item["name"],
+                    "due_date": item["due_date"],
+                }
+            ],
+        )
+        if violations:
+            conn.rollback()
+            return (
+                jsonify(
+                    {
+                        "error": "The move breaks the rules of the task tree.",
+                        "violations": violations,
+                    }
+                ),
+                400,
+            )
+
+        sort_key, version = move_task(
+            cursor,
+            project_id,
+            item_id,
+            parent_id,
+            sibling_ids["before_item_id"],
+            sibling_ids["after_item_id"],
+        )
+        revision = project_revision(cursor, user_id, project_id)["revision"]
+        conn.commit()
+        tree_cache.invalidate(project_id)
+        return jsonify(
+            {
+                "message": "Task moved.",
+                "item_id": item_id,
+                "parent_item_id": parent_id,
+                "sort_key": sort_key,
+                "version": version,
+                "revision": revision,
+            }
+        )
+    except ValueError as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 400
+    except sqlite3.Error as e:
+        conn.rollback()
+        traceback.print_exc()
+        return jsonify({"error": "Internal server error", "details": str(e)}), 500
+
+
+@app.route("/api/items/<int:item_id>/children")
+@login_required
+def item_children(item_id):
+    """One page of a task's subtasks, as data and as rendered cards for the task page."""
+    user_id = session["user_id"]
+    cursor = get_db().cursor()
+
+    item = get_owned_item(cursor, user_id, item_id)
+    if item is None:
+        return jsonify({"error": "Task not found or not owned by user."}), 404
+
+    offset = request.args.get("offset", 0, type=int)
+    limit = request.args.get("limit", CHILDREN_PAGE_SIZE, type=int)
+    if offset < 0 or not 0 < limit <= 500:
+        return jsonify({"error": "Invalid offset or limit."}), 400
+
+    # One extra row tells us whether there is another page.
+    rows = child_task_rows(cursor, item["project_id"], item_id, offset, limit + 1)
+    children = [task_row_to_dict(row) for row in rows[:limit]]
+    level = item_level(cursor, item["project_id"], item_id) + 1
+    render_task_item = get_template_attribute("task_item.html", "render_task_item")
+
+    return jsonify(
+        {
+            "item_id": item_id,
+            "children": [
+                {key: value for key, value in child.items() if key != "subtasks"}
+                for child in children
+            ],
+            "html": "".join(str(render_task_item(child, level)) for child in children),
+            "next_offset": offset + limit if len(rows) > limit else None,
+        }
+    )
+
+
+@app.route("/api/items/<int:item_id>/hours")
+@login_required
+def item_hours(item_id):
+    """Rolled-up planned and remaining hours for a task's subtree."""
+    user_id = session["user_id"]
+    cursor = get_db().cursor()
+
+    item = get_owned_item(cursor, user_id, item_id)
+    if item is None:
+        return jsonify({"error": "Task not found or not owned by user."}), 404
+
+    total, remaining = subtree_hours(cursor, item["project_id"], item_id)
+    return jsonify(
+        {"item_id": item_id, "planned_hours": total, "remaining_hours": remaining}
+    )
+
+
+def _search_results():
+    text = request.args.get("q", "").strip()
+    page = max(request.args.get("page", 1, type=int), 1)
+    hits, has_more = search(get_db().cursor(), session["user_id"], text, page)
+    return text, page, hits, has_more
+
+
+@app.route("/search")
+@login_required
+def search_page():
+    """Search results for the user's projects and tasks."""
+    text, page, hits, has_more = _search_results()
+    return render_template(
+        "search.html",
+        query=text,
+        page=page,
+        hits=hits,
+        has_more=has_more,
+        username=get_username(session["user_id"]),
+    )
+
+
+@app.route("/api/search")
+@login_required
+def search_api():
+    """The same results as /search, as JSON. Snippets are HTML with the matches in <mark> tags."""
+    text, page, hits, has_more = _search_results()
+    return jsonify(
+        {
+            "query": text,
+            "page": page,
+            "hits": [dict(hit, snippet=str(hit["snippet"])) for hit in hits],
+            "next_page": page + 1 if has_more else None,
+        }
+    )
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """
+    Request, SQL, template and calendar totals in Prometheus' text format,
+    for logged-in users and for scrapers with the metrics token.
+    """
+    if session.get("user_id") is None and not metrics.scraper_authorized():
+        return redirect("/login")
+    cache = tree_cache.stats()
+    extra = [
+        ("lifemap_tree_cache_trees", "gauge", "Task trees cached.", cache["trees"]),
+        (
+            "lifemap_tree_cache_bytes",
+            "gauge",
+            "Approximate size of the cached trees.",
+            cache["bytes"],
+        ),
+    ] + [
+        (
+            f"lifemap_tree_cache_{name}_total",
+            "counter",
+            f"Task tree cache {name}.",
+            cache[name],
+        )
+        for name in ("hits", "misses", "evictions", "invalidations")
+    ]
+    return app.response_class(
+        metrics.prometheus_text(extra), mimetype="text/plain; version=0.0.4"
+    )
+
+
 if __name__ == "__main__":
+    # Shows the per-request JSON lines from metrics.py.
+    logging.basicConfig(level=logging.INFO)
     app.run(debug=True)
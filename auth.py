@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Password hashing and login throttling. scrypt is slow and takes 32 MB of
+# memory per hash on purpose, so it runs on a small pool of threads: a burst
+# of logins waits its turn there instead of every request thread hashing at
+# once and starving the rest of the app. Bursts against one account or from
+# one address are turned away by LoginThrottle before any hashing at all.
+
+PASSWORD_WORKERS = int(os.environ.get("LIFEMAP_PASSWORD_WORKERS", "2"))
+# Hashes allowed to wait for a worker before more are turned away.
+PASSWORD_QUEUE_LIMIT = 32
+
+_password_pool = ThreadPoolExecutor(
+    max_workers=PASSWORD_WORKERS, thread_name_prefix="password"
+)
+_password_slots = threading.BoundedSemaphore(PASSWORD_WORKERS + PASSWORD_QUEUE_LIMIT)
+
+
+class PasswordPoolBusy(Exception):
+    """Raised when too many password hashes are already waiting to run."""
+
+
+def _run_in_pool(function, *args, **kwargs):
+    if not _password_slots.acquire(blocking=False):
+        raise PasswordPoolBusy()
+    try:
+        return _password_pool.submit(function, *args, **kwargs).result()
+    finally:
+        _password_slots.release()
+
+
+def check_password(password_hash, password):
+    """check_password_hash, run on the password pool."""
+    return _run_in_pool(check_password_hash, password_hash, password)
+
+
+def hash_password(password):
+    """The hash stored for a new password, made on the password pool."""
+    return _run_in_pool(
+        generate_password_hash, password, method="scrypt", salt_length=16
+    )
+
+
+LOGIN_USER_SQL = """
+    SELECT * FROM (
+        SELECT *, 0 AS preference FROM users WHERE username = ?
+        UNION ALL
+        SELECT *, 1 AS preference FROM users WHERE lower(email) = ?
+    )
+    ORDER BY preference LIMIT 1
+"""
+
+
+def find_login_user(cursor, login_input):
+    """
+    The user a login form's "username or e-mail" refers to, or None. A
+    username has to match exactly, an e-mail address in any case, and a
+    username wins over someone else's matching e-mail address. Both are
+    looked up through an index in one query.
+    """
+    cursor.execute(LOGIN_USER_SQL, (login_input, login_input.strip().lower()))
+    return cursor.fetchone()
+
+
+LOGIN_WINDOW_SECONDS = 15 * 60
+LOGIN_FAILURES_PER_ACCOUNT = 5
+LOGIN_FAILURES_PER_ADDRESS = 20
+# Keys forgotten first once this many are tracked, the longest unused first.
+LOGIN_THROTTLE_MAX_KEYS = 10000
+
+
+class LoginThrottle:
+    """
+    Counts failed logins per account and per client address over a sliding
+    window, in memory. Once either has failed too often, further attempts
+    are refused until the oldest failure leaves the window.
+    """
+
+    def __init__(
+        self,
+        window=LOGIN_WINDOW_SECONDS,
+        per_account=LOGIN_FAILURES_PER_ACCOUNT,
+        per_address=LOGIN_FAILURES_PER_ADDRESS,
+        max_keys=LOGIN_THROTTLE_MAX_KEYS,
+    ):
+        self.window = window
+        self.limits = {"account": per_account, "address": per_address}
+        self.max_keys = max_keys
+        self._failures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _keys(self, login_input, address):
+        return [
+            ("account", (login_input or "").strip().lower()),
+            ("address", address),
+        ]
+
+    def retry_after(self, login_input, address):
+        """Seconds until another attempt is allowed, or 0 if it is allowed now."""
+        now = time.monotonic()
+        wait = 0
+        with self._lock:
+            for key in self._keys(login_input, address):
+                failures = self._failures.get(key)
+                if not failures:
+                    continue
+                while failures and failures[0] <= now - self.window:
+                    failures.popleft()
+                if len(failures) >= self.limits[key[0]]:
+                    wait = max(wait, failures[0] + self.window - now)
+        return wait
+
+    def failed(self, login_input, address):
+        now = time.monotonic()
+        with self._lock:
+            for key in self._keys(login_input, address):
+                failures = self._failures.pop(key, None) or deque()
+                failures.append(now)
+                # Only the newest failures up to the limit matter.
+                while len(failures) > self.limits[key[0]]:
+                    failures.popleft()
+                self._failures[key] = failures
+            while len(self._failures) > self.max_keys:
+                self._failures.popitem(last=False)
+
+    def succeeded(self, login_input):
+        with self._lock:
+            self._failures.pop(self._keys(login_input, None)[0], None)
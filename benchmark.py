@@ -0,0 +1,363 @@
+"""
+Load test for LifeMap. Generates a synthetic database of users, projects and
+task trees, then drives the main pages through Flask's test client with the
+Google Calendar client replaced by FakeCalendarClient, and saves latency,
+query and write counts as JSON so runs can be compared across versions.
+
+    python benchmark.py --items 2000 --depth 6 --due-density 0.3 --output bench.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+MAX_DEPTH = 6
+
+
+def generate_synthetic_data(
+    db_path,
+    users=3,
+    projects_per_user=5,
+    items_per_project=500,
+    max_depth=MAX_DEPTH,
+    due_date_density=0.3,
+    seed=0,
+):
+    """
+    Fills a fresh database with synthetic users, projects and work item trees.
+    Subtasks are never due after their parent, as the app requires.
+    Returns the ids of the users and projects that were created.
+    """
+    from database import connect
+    from schema import migrate_database
+    from work_items import rebuild_rollups
+    from werkzeug.security import generate_password_hash
+
+    max_depth = min(max_depth, MAX_DEPTH)
+    rng = random.Random(seed)
+    migrate_database(db_path)
+    conn = connect(db_path)
+    cursor = conn.cursor()
+    # One hash for everyone, scrypt is far too slow to run per synthetic user.
+    password_hash = generate_password_hash("Benchmark1", method="scrypt")
+    user_ids = []
+    project_ids = []
+
+    for user_number in range(users):
+        cursor.execute(
+            """INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)""",
+            (
+                f"bench_user_{user_number}",
+                f"bench_{user_number}@example.com",
+                password_hash,
+            ),
+        )
+        user_id = cursor.lastrowid
+        user_ids.append(user_id)
+
+        for project_number in range(projects_per_user):
+            start = date(2026, 1, 1) + timedelta(days=rng.randint(0, 365))
+            end = start + timedelta(days=rng.randint(30, 720))
+            name = f"Project {user_number}-{project_number}"
+            cursor.execute(
+                """INSERT INTO projects (user_id, name, description, start_date, end_date) VALUES (?, ?, ?, ?, ?)""",
+                (
+                    user_id,
+                    name,
+                    "Synthetic project",
+                    start.isoformat(),
+                    end.isoformat(),
+                ),
+            )
+            project_id = cursor.lastrowid
+            project_ids.append(project_id)
+            cursor.execute(
+                """INSERT INTO work_items (project_id, parent_item_id, name, description) VALUES (?, ?, ?, ?)""",
+                (project_id, None, name, "Synthetic project"),
+            )
+            _generate_tree(
+                cursor,
+                rng,
+                project_id,
+                cursor.lastrowid,
+                start,
+                end,
+                items_per_project,
+                max_depth,
+                due_date_density,
+            )
+
+    rebuild_rollups(cursor)
+    conn.commit()
+    conn.close()
+    return user_ids, project_ids
+
+
+def _generate_tree(
+    cursor, rng, project_id, root_id, start, end, count, max_depth, due_date_density
+):
+    from ordering import ordinal_key
+
+    # (item_id, depth, due_date) of every item that can still take subtasks.
+    parents = [(root_id, 0, end)]
+    child_counts = {}
+    for number in range(count):
+        parent_id, depth, parent_due = rng.choice(parents)
+        due_date = None
+        if rng.random() < due_date_density:
+            latest = parent_due or end
+            due_date = start + timedelta(
+                days=rng.randint(0, max((latest - start).days, 0))
+            )
+        sibling_number = child_counts.get(parent_id, 0)
+        child_counts[parent_id] = sibling_number + 1
+        cursor.execute(
+            """
+            INSERT INTO work_items (project_id, parent_item_id, name, description, due_date, is_completed, sort_key, planned_hours)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+            (
+                project_id,
+                parent_id,
+                f"Task {number}",
+                "Synthetic task",
+                due_date.isoformat() if due_date else None,
+                1 if rng.random() < 0.2 else 0,
+                ordinal_key(sibling_number),
+                round(rng.uniform(0.5, 8), 1),
+            ),
+        )
+        if depth + 1 < max_depth:
+            parents.append((cursor.lastrowid, depth + 1, due_date or parent_due))
+
+
+class StatementCounter:
+    """Counts the SQL statements and rows written on every connection the app opens."""
+
+    def __init__(self):
+        self.statements = 0
+        self.connections = []
+
+    def __call__(self, conn):
+        self.connections.append(conn)
+        conn.set_trace_callback(self._count)
+
+    def _count(self, statement):
+        self.statements += 1
+
+    def rows_written(self):
+        total = 0
+        for conn in self.connections:
+            try:
+                total += conn.total_changes
+            except sqlite3.ProgrammingError:
+                # Closed, e.g. one of the worker's short lived connections.
+                pass
+        return total
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _summarise(samples):
+    latencies = [s["ms"] for s in samples]
+    return {
+        "requests": len(samples),
+        "p50_ms": round(_percentile(latencies, 50), 3),
+        "p95_ms": round(_percentile(latencies, 95), 3),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "queries_per_request": round(
+            sum(s["queries"] for s in samples) / len(samples), 2
+        ),
+        "rows_written_per_request": round(
+            sum(s["rows_written"] for s in samples) / len(samples), 2
+        ),
+    }
+
+
+def run_benchmark(db_path, project_ids, requests=50, edits_per_save=5, seed=0):
+    """
+    Drives the main routes through the Flask test client and returns a summary
+    per route. LIFEMAP_DATABASE must already point at db_path when this runs.
+    """
+    import database
+
+    if database.DATABASE != db_path:
+        raise RuntimeError("Set LIFEMAP_DATABASE before importing the app modules.")
+    from calendar_sync import FakeCalendarClient
+
+    import app as lifemap
+
+    counter = StatementCounter()
+    database.on_connect.append(counter)
+    lifemap.calendar_worker.stop()
+    lifemap.calendar_worker.client = FakeCalendarClient()
+
+    rng = random.Random(seed)
+    conn = database.connect(db_path, readonly=True)
+    owners = {
+        row["project_id"]: row["user_id"]
+        for row in conn.execute("SELECT project_id, user_id FROM projects")
+    }
+    client = lifemap.app.test_client()
+    samples = {
+        "/details": [],
+        "/save-tasks": [],
+        "/calendar": [],
+        "/api/calendar/events": [],
+        "/projects": [],
+    }
+
+    def timed(route, user_id, send):
+        with client.session_transaction() as session:
+            session["user_id"] = user_id
+        statements_before = counter.statements
+        rows_before = counter.rows_written()
+        started = time.perf_counter()
+        response = send()
+        elapsed = (time.perf_counter() - started) * 1000
+        if response.status_code >= 400:
+            raise RuntimeError(f"{route} returned {response.status_code}")
+        samples[route].append(
+            {
+                "ms": elapsed,
+                "queries": counter.statements - statements_before,
+                "rows_written": counter.rows_written() - rows_before,
+            }
+        )
+
+    for _ in range(requests):
+        project_id = rng.choice(project_ids)
+        user_id = owners[project_id]
+        timed("/details", user_id, lambda: client.get(f"/details/{project_id}"))
+        timed("/calendar", user_id, lambda: client.get("/calendar"))
+        month = date(2026, 1, 1) + timedelta(days=31 * rng.randint(0, 23))
+        month = month.replace(day=1)
+        timed(
+            "/api/calendar/events",
+            user_id,
+            lambda: client.get(
+                "/api/calendar/events",
+                query_string={
+                    "start": month.isoformat(),
+                    "end": (month + timedelta(days=42)).isoformat(),
+                },
+            ),
+        )
+        timed("/projects", user_id, lambda: client.get("/projects"))
+
+        rows = conn.execute(
+            """SELECT * FROM work_items WHERE project_id = ? AND parent_item_id IS NOT NULL""",
+            (project_id,),
+        ).fetchall()
+        changes = [
+            {
+                "item_id": str(row["item_id"]),
+                "parent_item_id": str(row["parent_item_id"]),
+                "version": row["version"],
+                "name": row["name"] + " (edited)",
+                "description": row["description"],
+                "due_date": row["due_date"],
+                "is_completed": bool(row["is_completed"]),
+                "is_minimized": bool(row["is_minimized"]),
+                "planned_hours": row["planned_hours"],
+            }
+            for row in rng.sample(rows, min(edits_per_save, len(rows)))
+        ]
+        timed(
+            "/save-tasks",
+            user_id,
+            lambda: client.post(
+                "/save-tasks",
+                json={
+                    "project_id": project_id,
+                    "changes": changes,
+                    "deleted_item_ids": [],
+                },
+            ),
+        )
+
+    conn.close()
+    database.on_connect.remove(counter)
+    return {
+        route: _summarise(route_samples) for route, route_samples in samples.items()
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=3)
+    parser.add_argument("--projects", type=int, default=5, help="projects per user")
+    parser.add_argument("--items", type=int, default=500, help="tasks per project")
+    parser.add_argument("--depth", type=int, default=MAX_DEPTH)
+    parser.add_argument("--due-density", type=float, default=0.3)
+    parser.add_argument("--requests", type=int, default=50, help="requests per route")
+    parser.add_argument("--edits", type=int, default=5, help="tasks edited per save")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database", help="where to build the synthetic database")
+    parser.add_argument("--output", default="bench_output.json")
+    args = parser.parse_args()
+
+    db_path = args.database or os.path.join(tempfile.mkdtemp(), "LifeMapBench.db")
+    # The app reads this when it is imported, so it never touches LifeMap.db.
+    os.environ["LIFEMAP_DATABASE"] = db_path
+    print(f"Generating synthetic data in {db_path}...")
+    _, project_ids = generate_synthetic_data(
+        db_path,
+        users=args.users,
+        projects_per_user=args.projects,
+        items_per_project=args.items,
+        max_depth=args.depth,
+        due_date_density=args.due_density,
+        seed=args.seed,
+    )
+
+    print("Running requests...")
+    results = run_benchmark(
+        db_path,
+        project_ids,
+        requests=args.requests,
+        edits_per_save=args.edits,
+        seed=args.seed,
+    )
+    report = {
+        "revision": _git_revision(),
+        "run_at": datetime.now().isoformat(timespec="seconds"),
+        "config": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+
+    for route, summary in results.items():
+        print(
+            f"{route:21} p50 {summary['p50_ms']:8.2f} ms   p95 {summary['p95_ms']:8.2f} ms   "
+            f"{summary['queries_per_request']:7.1f} queries   {summary['rows_written_per_request']:7.1f} rows written"
+        )
+    print(f"Saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
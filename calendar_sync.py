@@ -0,0 +1,329 @@
+import hashlib
+import json
+import threading
+import time
+import traceback
+from database import DATABASE, connect
+
+# Calendar changes are written to the calendar_outbox table in the same
+# transaction as the work_items change, and CalendarSyncWorker sends them to
+# Google in the background, so saving never waits on the Calendar API.
+
+SYNC_ITEM = "sync"
+DELETE_EVENT = "delete"
+
+MAX_ATTEMPTS = 8
+BACKOFF_BASE_SECONDS = 2
+BACKOFF_MAX_SECONDS = 300
+CLAIM_SECONDS = 120
+# Calls per Google Calendar batch request.
+BATCH_LIMIT = 50
+
+
+# Shared with HOT_QUERIES in schema.py, whose query plans are checked.
+ENQUEUE_ITEM_SYNC_SQL = """
+    INSERT INTO calendar_outbox (action, item_id, next_attempt_at)
+    SELECT ?, ?, ?
+    WHERE NOT EXISTS (
+        SELECT 1 FROM calendar_outbox
+        WHERE action = ? AND item_id = ? AND status = 'pending' AND claimed_until IS NULL
+    )
+"""
+DUE_ROWS_SQL = """
+    SELECT * FROM calendar_outbox
+    WHERE status = 'pending' AND next_attempt_at <= ?
+    AND (claimed_until IS NULL OR claimed_until < ?)
+    ORDER BY outbox_id LIMIT ?
+"""
+
+
+def enqueue_item_sync(cursor, item_id):
+    """Queues the calendar event of a work item to be brought in line with the row."""
+    enqueue_item_syncs(cursor, [item_id])
+
+
+def enqueue_item_syncs(cursor, item_ids):
+    """enqueue_item_sync for many work items in one executemany."""
+    now = time.time()
+    cursor.executemany(
+        ENQUEUE_ITEM_SYNC_SQL,
+        [(SYNC_ITEM, item_id, now, SYNC_ITEM, item_id) for item_id in item_ids],
+    )
+
+
+def enqueue_event_delete(cursor, event_id):
+    """Queues a Google Calendar event to be deleted."""
+    if not event_id:
+        return
+    cursor.execute(
+        """INSERT INTO calendar_outbox (action, event_id, next_attempt_at) VALUES (?, ?, ?)""",
+        (DELETE_EVENT, event_id, time.time()),
+    )
+
+
+class EventNotFound(Exception):
+    """Raised by a calendar client when the event no longer exists on Google's side."""
+
+
+def event_data_for(item):
+    return {
+        "summary": item["name"],
+        "description": item["description"] or "No description provided.",
+        "start": {"date": item["due_date"]},
+        "end": {"date": item["due_date"]},
+    }
+
+
+def event_fingerprint(name, description, due_date):
+    """
+    Hash of the fields that end up in the calendar event. Stored per work item
+    when it is synced, so unchanged tasks never cause a calendar call.
+    """
+    if not due_date:
+        return None
+    event_data = event_data_for(
+        {"name": name, "description": description, "due_date": due_date}
+    )
+    return hashlib.sha1(
+        json.dumps(event_data, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+class FakeCalendarClient:
+    """
+    In-memory stand-in for GoogleCalendarClient, so the worker can be run
+    without network access or Google credentials.
+    """
+
+    def __init__(self):
+        self.events = {}
+        self.calls = []
+        self._next_id = 0
+
+    def insert_event(self, event_data):
+        self._next_id += 1
+        event_id = f"fake-{self._next_id}"
+        self.events[event_id] = dict(event_data, id=event_id)
+        self.calls.append(("insert", event_id))
+        return self.events[event_id]
+
+    def patch_event(self, event_id, event_data):
+        self.calls.append(("patch", event_id))
+        if event_id not in self.events:
+            raise EventNotFound(event_id)
+        self.events[event_id].update(event_data)
+        return self.events[event_id]
+
+    def delete_event(self, event_id):
+        self.events.pop(event_id, None)
+        self.calls.append(("delete", event_id))
+
+    def execute_batch(self, operations):
+        self.calls.append(("batch", len(operations)))
+        results = []
+        for action, event_id, event_data in operations:
+            try:
+                if action == "insert":
+                    results.append((self.insert_event(event_data), None))
+                elif action == "patch":
+                    results.append((self.patch_event(event_id, event_data), None))
+                else:
+                    results.append((self.delete_event(event_id), None))
+            except Exception as e:
+                results.append((None, e))
+        return results
+
+
+class CalendarSyncWorker(threading.Thread):
+    """
+    Background thread that drains calendar_outbox with retries and
+    exponential backoff. Rows are claimed with a lease before being worked
+    on, so more than one worker (or process) can share the same database.
+    """
+
+    def __init__(self, client=None, db_path=DATABASE, poll_interval=5):
+        super().__init__(name="calendar-sync", daemon=True)
+        if client is None:
+            from google_calendar import GoogleCalendarClient
+
+            client = GoogleCalendarClient()
+        self.client = client
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+    def notify(self):
+        """Wakes the worker up early, e.g. straight after a save commits."""
+        self._wake.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                self.drain_once()
+            except Exception:
+                traceback.print_exc()
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _connect(self):
+        return connect(self.db_path)
+
+    def drain_once(self, limit=BATCH_LIMIT):
+        """
+        Processes every outbox row that is due, `limit` rows per batch request.
+        Returns how many succeeded.
+        """
+        conn = self._connect()
+        processed = 0
+        try:
+            while True:
+                rows = self._claim_due_rows(conn, limit)
+                if not rows:
+                    return processed
+                processed += self._process_batch(conn, rows)
+        finally:
+            conn.close()
+
+    def _claim_due_rows(self, conn, limit):
+        now = time.time()
+        cursor = conn.execute(DUE_ROWS_SQL, (now, now, limit))
+        claimed = []
+        for row in cursor.fetchall():
+            updated = conn.execute(
+                """
+                UPDATE calendar_outbox SET claimed_until = ?
+                WHERE outbox_id = ? AND (claimed_until IS NULL OR claimed_until < ?)
+            """,
+                (now + CLAIM_SECONDS, row["outbox_id"], now),
+            )
+            if updated.rowcount:
+                claimed.append(row)
+        conn.commit()
+        return claimed
+
+    def _record_failure(self, conn, row, error):
+        attempts = row["attempts"] + 1
+        delay = min(BACKOFF_BASE_SECONDS * 2**attempts, BACKOFF_MAX_SECONDS)
+        status = "failed" if attempts >= MAX_ATTEMPTS else "pending"
+        print(
+            f"Warning: calendar sync {row['action']} (outbox {row['outbox_id']}) failed, attempt {attempts}: {error}"
+        )
+        conn.execute(
+            """
+            UPDATE calendar_outbox
+            SET attempts = ?, next_attempt_at = ?, claimed_until = NULL, last_error = ?, status = ?
+            WHERE outbox_id = ?
+        """,
+            (attempts, time.time() + delay, str(error), status, row["outbox_id"]),
+        )
+
+    def _process_batch(self, conn, rows):
+        """
+        Works out one calendar call per outbox row, sends them all in one
+        batch and then applies the per-item results.
+        """
+        item_ids = [row["item_id"] for row in rows if row["action"] == SYNC_ITEM]
+        items = {}
+        if item_ids:
+            placeholders = ",".join(["?"] * len(item_ids))
+            cursor = conn.execute(
+                f"""SELECT item_id, name, description, due_date, google_calendar_event_id, google_calendar_fingerprint FROM work_items WHERE item_id IN ({placeholders})""",
+                item_ids,
+            )
+            items = {item["item_id"]: item for item in cursor.fetchall()}
+
+        plans = []
+        for row in rows:
+            if row["action"] == DELETE_EVENT:
+                plans.append((row, ("delete", row["event_id"], None), None))
+            else:
+                item = items.get(row["item_id"])
+                plans.append((row, self._plan_sync(item), item))
+
+        operations = [operation for _, operation, _ in plans if operation]
+        responses = []
+        missing = RuntimeError("The batch response had no result for this call.")
+        if operations:
+            try:
+                responses = self.client.execute_batch(operations)
+            except Exception as e:
+                # The whole request failed, e.g. no network or expired
+                # credentials, so every call in it failed with it.
+                missing = e
+        results = iter(responses)
+
+        processed = 0
+        for row, operation, item in plans:
+            if operation:
+                # GoogleCalendarClient leaves None for a call that got no callback.
+                response, error = next(results, None) or (None, missing)
+                if isinstance(error, EventNotFound) and operation[0] == "patch":
+                    # Removed on Google's side, forget it so the next pass inserts it again.
+                    self._store_event(conn, item["item_id"], None, None, operation[1])
+                    conn.execute(
+                        "UPDATE calendar_outbox SET claimed_until = NULL WHERE outbox_id = ?",
+                        (row["outbox_id"],),
+                    )
+                    continue
+                if error is not None:
+                    self._record_failure(conn, row, error)
+                    continue
+                if item is not None:
+                    self._apply_sync_result(conn, item, operation, response)
+
+            conn.execute(
+                "DELETE FROM calendar_outbox WHERE outbox_id = ?", (row["outbox_id"],)
+            )
+            processed += 1
+
+        conn.commit()
+        return processed
+
+    def _plan_sync(self, item):
+        """Returns the calendar call that brings an item's event up to date, if any."""
+        if item is None:
+            # Deleted since it was queued, its event delete was queued with it.
+            return None
+
+        event_id = item["google_calendar_event_id"]
+        if not item["due_date"]:
+            return ("delete", event_id, None) if event_id else None
+
+        fingerprint = event_fingerprint(
+            item["name"], item["description"], item["due_date"]
+        )
+        if event_id and fingerprint == item["google_calendar_fingerprint"]:
+            return None
+        if event_id:
+            return ("patch", event_id, event_data_for(item))
+        return ("insert", None, event_data_for(item))
+
+    def _apply_sync_result(self, conn, item, operation, response):
+        action, event_id, _ = operation
+        fingerprint = event_fingerprint(
+            item["name"], item["description"], item["due_date"]
+        )
+        if action == "delete":
+            self._store_event(conn, item["item_id"], None, None, event_id)
+        elif action == "patch":
+            self._store_event(conn, item["item_id"], event_id, fingerprint, event_id)
+        elif not self._store_event(
+            conn, item["item_id"], response.get("id"), fingerprint, None
+        ):
+            # The task was deleted or synced elsewhere while the event was being created.
+            enqueue_event_delete(conn, response.get("id"))
+
+    def _store_event(self, conn, item_id, event_id, fingerprint, previous_event_id):
+        updated = conn.execute(
+            """
+            UPDATE work_items SET google_calendar_event_id = ?, google_calendar_fingerprint = ?
+            WHERE item_id = ? AND google_calendar_event_id IS ?
+        """,
+            (event_id, fingerprint, item_id, previous_event_id),
+        )
+        return updated.rowcount > 0
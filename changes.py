@@ -0,0 +1,153 @@
+import threading
+import traceback
+
+from database import DATABASE, connect
+from work_items import task_rows
+
+# The change feed: every insert, edit, move and delete of a project's tasks,
+# and every edit of the project itself, is appended to change_log by triggers
+# (migration 11 in schema.py) with an ever increasing seq. A client that has
+# the tree as of some seq asks for what came after it and gets the current
+# state of just the tasks that changed since, one entry per task however many
+# times it was written.
+#
+# The log is compacted from time to time. Older entries for a task that has a
+# newer one are dropped, since the feed only ever sends the newest. Entries
+# older than CHANGE_LOG_RETENTION_SECONDS are folded into the project's
+# snapshot: its snapshot_seq moves up past them, and a client that is still
+# behind snapshot_seq is sent the whole tree again instead.
+
+CHANGE_FEED_PAGE_SIZE = 500
+CHANGE_LOG_RETENTION_SECONDS = 2 * 24 * 60 * 60
+COMPACT_INTERVAL_SECONDS = 60 * 60
+
+LATEST_CHANGE_SQL = """
+    SELECT MAX(snapshot_seq, IFNULL((SELECT MAX(seq) FROM change_log WHERE project_id = ?), 0))
+    FROM projects WHERE project_id = ?
+"""
+
+# The newest entry of each task changed after a seq. SQLite takes `kind`
+# from the row with the MAX(seq).
+CHANGE_FEED_SQL = """
+    SELECT item_id, MAX(seq) AS seq, kind FROM change_log
+    WHERE project_id = ? AND seq > ?
+    GROUP BY item_id ORDER BY seq LIMIT ?
+"""
+
+
+def latest_change_seq(cursor, project_id):
+    """The seq a client holding the project's tree as of now should ask for changes after."""
+    cursor.execute(LATEST_CHANGE_SQL, (project_id, project_id))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def feed_project(cursor, user_id, project_id):
+    """The fields of one of the user's projects that the feed sends, or None if it isn't theirs."""
+    cursor.execute(
+        """
+        SELECT project_id, name, description, start_date, end_date, planned_hours,
+            task_count, completed_task_count, progress, revision, modified_at, snapshot_seq
+        FROM projects WHERE user_id = ? AND project_id = ?
+    """,
+        (user_id, project_id),
+    )
+    return cursor.fetchone()
+
+
+def project_changes(cursor, project_id, since, limit=CHANGE_FEED_PAGE_SIZE):
+    """
+    What changed in the project after `since`, oldest first and at most
+    `limit` of them. Returns (a list of (seq, item_id, kind, row), whether
+    there are more). item_id is None for a change to the project itself, and
+    row is the task's current work_items row, or None once it is deleted.
+    """
+    # One extra entry tells us whether there are more.
+    cursor.execute(CHANGE_FEED_SQL, (project_id, since, limit + 1))
+    entries = cursor.fetchall()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    item_ids = [
+        entry["item_id"]
+        for entry in entries
+        if entry["item_id"] is not None and entry["kind"] != "delete"
+    ]
+    rows = {}
+    if item_ids:
+        rows = {row["item_id"]: row for row in task_rows(cursor, project_id, item_ids)}
+    changes = []
+    for entry in entries:
+        row = rows.get(entry["item_id"])
+        # Deleted since the log was read.
+        kind = (
+            entry["kind"] if row is not None or entry["item_id"] is None else "delete"
+        )
+        changes.append((entry["seq"], entry["item_id"], kind, row))
+    return changes, has_more
+
+
+def compact_change_log(conn, keep_seconds=CHANGE_LOG_RETENTION_SECONDS):
+    """
+    Drops the entries the feed no longer needs, see above, and those of
+    projects that are gone. Returns how many were dropped.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        DELETE FROM change_log WHERE seq NOT IN (
+            SELECT MAX(seq) FROM change_log GROUP BY project_id, item_id
+        )
+    """
+    )
+    dropped = cursor.rowcount
+    cursor.execute(
+        """DELETE FROM change_log WHERE project_id NOT IN (SELECT project_id FROM projects)"""
+    )
+    dropped += cursor.rowcount
+
+    cursor.execute(
+        """
+        SELECT project_id, MAX(seq) FROM change_log
+        WHERE changed_at < datetime('now', ?) GROUP BY project_id
+    """,
+        (f"-{int(keep_seconds)} seconds",),
+    )
+    snapshots = cursor.fetchall()
+    cursor.executemany(
+        """UPDATE projects SET snapshot_seq = MAX(snapshot_seq, ?) WHERE project_id = ?""",
+        [(seq, project_id) for project_id, seq in snapshots],
+    )
+    for project_id, seq in snapshots:
+        cursor.execute(
+            """DELETE FROM change_log WHERE project_id = ? AND seq <= ?""",
+            (project_id, seq),
+        )
+        dropped += cursor.rowcount
+    conn.commit()
+    return dropped
+
+
+class ChangeLogCompactor(threading.Thread):
+    """Background thread that compacts change_log every `interval` seconds."""
+
+    def __init__(self, db_path=DATABASE, interval=COMPACT_INTERVAL_SECONDS):
+        super().__init__(name="change-log-compactor", daemon=True)
+        self.db_path = db_path
+        self.interval = interval
+        self._stopping = threading.Event()
+
+    def stop(self):
+        self._stopping.set()
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                conn = connect(self.db_path)
+                try:
+                    compact_change_log(conn)
+                finally:
+                    conn.close()
+            except Exception:
+                traceback.print_exc()
+            self._stopping.wait(self.interval)
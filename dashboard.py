@@ -0,0 +1,121 @@
+import base64
+import json
+from datetime import date, timedelta
+
+# The projects page: one page of a user's projects at a time, in any of
+# PROJECT_SORTS and narrowed down by one of PROJECT_FILTERS. Pages are
+# keyset-paginated, each one starts after the sort key and project_id of the
+# last row of the one before, so every page costs the same however deep it is.
+#
+# Each sort has an index on (user_id, sort key) from migration 9 in schema.py,
+# with project_id (the rowid) breaking ties. Projects without a date sort
+# after the ones that have one.
+
+DASHBOARD_PAGE_SIZE = 25
+
+# Sort name -> the expression ordered by. Has to match the indexes exactly.
+PROJECT_SORTS = {
+    "due": "IFNULL(NULLIF(end_date, ''), '9999-12-31')",
+    "name": "name COLLATE NOCASE",
+    "start": "IFNULL(NULLIF(start_date, ''), '9999-12-31')",
+    "progress": "progress",
+}
+
+_DUE = PROJECT_SORTS["due"]
+
+# Filter name -> a condition on projects, given today's date and the
+# Monday and Sunday of this week.
+PROJECT_FILTERS = {
+    "overdue": f"{_DUE} < :today AND progress < 1",
+    "this_week": f"{_DUE} BETWEEN :monday AND :sunday",
+    "completed": "progress >= 1",
+}
+
+
+class BadPageRequest(ValueError):
+    """An unknown sort or filter, or a page token that wasn't made by next_page_token."""
+
+
+def next_page_token(row):
+    """The token for the page after `row`, the last one on a page."""
+    value = json.dumps([row["sort_key"], row["project_id"]])
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip("=")
+
+
+def _read_page_token(token):
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        sort_key, project_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise BadPageRequest("Invalid page token.")
+    if not isinstance(project_id, int) or not isinstance(sort_key, (str, int, float)):
+        raise BadPageRequest("Invalid page token.")
+    return sort_key, project_id
+
+
+def project_page_query(
+    sort="due", descending=False, filter_name=None, after=None, today=None
+):
+    """
+    The SQL and named parameters for one page of a user's projects. The
+    parameters still need :user_id and :limit.
+    """
+    if sort not in PROJECT_SORTS:
+        raise BadPageRequest(f'Unknown sort "{sort}".')
+    if filter_name and filter_name not in PROJECT_FILTERS:
+        raise BadPageRequest(f'Unknown filter "{filter_name}".')
+    key = PROJECT_SORTS[sort]
+    today = today or date.today()
+    monday = today - timedelta(days=today.weekday())
+    params = {
+        "today": today.isoformat(),
+        "monday": monday.isoformat(),
+        "sunday": (monday + timedelta(days=6)).isoformat(),
+    }
+
+    conditions = ["user_id = :user_id"]
+    if filter_name:
+        conditions.append(PROJECT_FILTERS[filter_name])
+    if after:
+        params["after_key"], params["after_id"] = _read_page_token(after)
+        # Written so the first comparison can start the index range.
+        before, strictly = ("<=", "<") if descending else (">=", ">")
+        conditions.append(
+            f"{key} {before} :after_key AND ({key} {strictly} :after_key OR project_id {strictly} :after_id)"
+        )
+    direction = "DESC" if descending else "ASC"
+    sql = f"""
+        SELECT project_id, name, description, start_date, end_date, planned_hours,
+            task_count, completed_task_count, progress,
+            {_DUE} BETWEEN :monday AND :sunday AS due_this_week,
+            {key.replace(" COLLATE NOCASE", "")} AS sort_key
+        FROM projects
+        WHERE {" AND ".join(conditions)}
+        ORDER BY {key} {direction}, project_id {direction}
+        LIMIT :limit
+    """
+    return sql, params
+
+
+def project_page(
+    cursor,
+    user_id,
+    sort="due",
+    descending=False,
+    filter_name=None,
+    after=None,
+    page_size=DASHBOARD_PAGE_SIZE,
+):
+    """
+    One page of the user's projects. Returns (rows as dicts, the token for the
+    next page or None if this is the last one).
+    """
+    sql, params = project_page_query(sort, descending, filter_name, after)
+    params.update(user_id=user_id, limit=page_size + 1)
+    cursor.execute(sql, params)
+    # One extra row tells us whether there is another page.
+    rows = [dict(row) for row in cursor.fetchall()]
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, next_page_token(rows[-1])
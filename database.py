@@ -0,0 +1,157 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+# LIFEMAP_DATABASE lets the benchmarks (or a deployment) point at another file.
+DATABASE = os.environ.get("LIFEMAP_DATABASE", "LifeMap.db")
+
+# Applied to every connection. WAL journaling itself is persistent and is
+# switched on once by migrate_database.
+PRAGMAS = [
+    # Off by default in SQLite, without it the ON DELETE CASCADE clauses do nothing.
+    "PRAGMA foreign_keys = ON",
+    # Safe with WAL, only the last commits can be lost on power failure, never corrupted.
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+    "PRAGMA temp_store = MEMORY",
+]
+
+BUSY_TIMEOUT_SECONDS = 10
+
+# Called with every new connection, e.g. to trace its statements.
+on_connect = []
+
+# Called as callback(statements, seconds, rows_read, rows_written) after every
+# statement and fetch on a LifeMap connection, see metrics.py.
+on_statement = []
+
+
+def _observe(statements, started, rows_read=0, rows_written=0):
+    seconds = time.perf_counter() - started
+    for callback in on_statement:
+        callback(statements, seconds, rows_read, rows_written)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """A cursor that reports the time, rows read and rows written of what it runs."""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _observe(1, started, rows_written=max(self.rowcount, 0))
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _observe(1, started, rows_written=max(self.rowcount, 0))
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        _observe(0, started, rows_read=int(row is not None))
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        _observe(0, started, rows_read=len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        _observe(0, started, rows_read=len(rows))
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        row = super().__next__()
+        _observe(0, started, rows_read=1)
+        return row
+
+
+class TimedConnection(sqlite3.Connection):
+    """Hands out TimedCursors, including for the execute() shortcuts."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connect(db_path=DATABASE, readonly=False, **kwargs):
+    """Opens a connection with the settings every LifeMap connection needs."""
+    kwargs.setdefault("timeout", BUSY_TIMEOUT_SECONDS)
+    kwargs.setdefault("factory", TimedConnection)
+    if readonly:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, **kwargs)
+    else:
+        conn = sqlite3.connect(db_path, **kwargs)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    if readonly:
+        conn.execute("PRAGMA query_only = ON")
+    for callback in on_connect:
+        callback(conn)
+    return conn
+
+
+class ConnectionPool:
+    """
+    Keeps up to `size` idle connections open for reuse, so a request doesn't
+    pay for opening the database and re-applying the pragmas. Each connection
+    is only used by one thread at a time, between acquire and release.
+    """
+
+    def __init__(self, db_path=DATABASE, size=8, readonly=False):
+        self.db_path = db_path
+        self.readonly = readonly
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return connect(
+                self.db_path, readonly=self.readonly, check_same_thread=False
+            )
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path=DATABASE, readonly=False):
+    """The shared pool of read-write or read-only connections for a database file."""
+    with _pools_lock:
+        key = (db_path, readonly)
+        if key not in _pools:
+            _pools[key] = ConnectionPool(db_path, readonly=readonly)
+        return _pools[key]
@@ -1,33 +1,57 @@
 import os.path
+import threading
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from metrics import calendar_call
 
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
 
 
+# token.json is read once per process and the Calendar service is built once
+# per thread (httplib2 connections are not thread safe), rather than on every call.
+_credentials = None
+_credentials_lock = threading.Lock()
+_services = threading.local()
+
+
 def _get_credentials():
-    creds = None
-    if os.path.exists("token.json"):
-        creds = Credentials.from_authorized_user_file("token.json", SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open("token.json", "w") as token:
-            token.write(creds.to_json())
-    return creds
+    global _credentials
+    with _credentials_lock:
+        creds = _credentials
+        if creds is None and os.path.exists("token.json"):
+            creds = Credentials.from_authorized_user_file("token.json", SCOPES)
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                creds.refresh(Request())
+            else:
+                flow = InstalledAppFlow.from_client_secrets_file(
+                    "credentials.json", SCOPES
+                )
+                creds = flow.run_local_server(port=0)
+            with open("token.json", "w") as token:
+                token.write(creds.to_json())
+        _credentials = creds
+        return creds
+
+
+def _get_service():
+    creds = _get_credentials()
+    if getattr(_services, "credentials", None) is not creds:
+        _services.service = build("calendar", "v3", credentials=creds)
+        _services.credentials = creds
+    return _services.service
 
 
 def pushOutgoingEvents(event_data):
     try:
-        creds = _get_credentials()
-        service = build("calendar", "v3", credentials=creds)
-        event = service.events().insert(calendarId="primary", body=event_data).execute()
+        service = _get_service()
+        with calendar_call():
+            event = (
+                service.events().insert(calendarId="primary", body=event_data).execute()
+            )
         print(f"Event created successfully! View it here: {event.get('htmlLink')}")
         return event
     except HttpError as error:
@@ -44,10 +68,9 @@ def delete_google_event(event_id):
         return
 
     try:
-        creds = _get_credentials()
-        service = build("calendar", "v3", credentials=creds)
-
-        service.events().delete(calendarId="primary", eventId=event_id).execute()
+        service = _get_service()
+        with calendar_call():
+            service.events().delete(calendarId="primary", eventId=event_id).execute()
         print(f"Event with ID: {event_id} deleted successfully.\n")
 
     except HttpError as error:
@@ -56,3 +79,93 @@ def delete_google_event(event_id):
             print(f"Event with ID: {event_id} was already deleted or not found.\n")
         else:
             print(f"An error occurred while deleting event {event_id}: {error}")
+
+
+class GoogleCalendarClient:
+    """
+    Calendar client used by the background sync worker. Unlike the functions
+    above it raises on failure, so the worker can retry with backoff.
+    """
+
+    def _service(self):
+        return _get_service()
+
+    def insert_event(self, event_data):
+        with calendar_call():
+            return (
+                self._service()
+                .events()
+                .insert(calendarId="primary", body=event_data)
+                .execute()
+            )
+
+    def patch_event(self, event_id, event_data):
+        from calendar_sync import EventNotFound
+
+        try:
+            with calendar_call():
+                return (
+                    self._service()
+                    .events()
+                    .patch(calendarId="primary", eventId=event_id, body=event_data)
+                    .execute()
+                )
+        except HttpError as error:
+            if error.resp.status in [404, 410]:
+                raise EventNotFound(event_id) from error
+            raise
+
+    def delete_event(self, event_id):
+        try:
+            with calendar_call():
+                self._service().events().delete(
+                    calendarId="primary", eventId=event_id
+                ).execute()
+        except HttpError as error:
+            # If the event is already gone there is nothing left to do.
+            if error.resp.status not in [404, 410]:
+                raise
+
+    def execute_batch(self, operations):
+        """
+        Sends (action, event_id, event_data) operations, where action is
+        "insert", "patch" or "delete", as HTTP batch requests of up to
+        BATCH_LIMIT calls each. Returns a (response, error) pair per operation,
+        in the same order.
+        """
+        from calendar_sync import BATCH_LIMIT, EventNotFound
+
+        service = self._service()
+        results = [None] * len(operations)
+
+        def callback(request_id, response, exception):
+            index = int(request_id)
+            action, event_id, _ = operations[index]
+            if isinstance(exception, HttpError) and exception.resp.status in [404, 410]:
+                if action == "delete":
+                    exception = None
+                else:
+                    exception = EventNotFound(event_id)
+            results[index] = (response, exception)
+
+        for start in range(0, len(operations), BATCH_LIMIT):
+            batch = service.new_batch_http_request(callback=callback)
+            for index in range(start, min(start + BATCH_LIMIT, len(operations))):
+                action, event_id, event_data = operations[index]
+                if action == "insert":
+                    request = service.events().insert(
+                        calendarId="primary", body=event_data
+                    )
+                elif action == "patch":
+                    request = service.events().patch(
+                        calendarId="primary", eventId=event_id, body=event_data
+                    )
+                else:
+                    request = service.events().delete(
+                        calendarId="primary", eventId=event_id
+                    )
+                batch.add(request, request_id=str(index))
+            with calendar_call(operations=min(BATCH_LIMIT, len(operations) - start)):
+                batch.execute()
+
+        return results
@@ -3,6 +3,7 @@ from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+from database import DATABASE, get_pool
 from help import get_db
 
 # For if / when this becomes a web app for other people, it just works on my comuputer for now!
@@ -15,7 +16,7 @@ def get_credentials_for_user(user_id):
     """Gets and refreshes Google API credentials for a given user from the DB."""
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute("SELECT google_token FROM users WHERE id = ?", (user_id,))
+    cursor.execute("SELECT google_token FROM users WHERE user_id = ?", (user_id,))
     user_row = cursor.fetchone()
 
     if not user_row or not user_row["google_token"]:
@@ -30,11 +31,18 @@ def get_credentials_for_user(user_id):
         from google.auth.transport.requests import Request
 
         creds.refresh(Request())
-        # Save the new credentials back to the database
-        cursor.execute(
-            "UPDATE users SET google_token = ? WHERE id = ?", (creds.to_json(), user_id)
-        )
-        conn.commit()
+        # Save the new credentials back to the database. GET requests only
+        # have a read-only connection (see get_db), so this borrows its own.
+        pool = get_pool(DATABASE)
+        write_conn = pool.acquire()
+        try:
+            write_conn.execute(
+                "UPDATE users SET google_token = ? WHERE user_id = ?",
+                (creds.to_json(), user_id),
+            )
+            write_conn.commit()
+        finally:
+            pool.release(write_conn)
 
     return creds
 
@@ -1,18 +1,39 @@
-import sqlite3
-from flask import g, session, redirect
+from flask import g, session, redirect, request
 from datetime import date
 from dateutil.relativedelta import relativedelta
 from functools import wraps
 from google_calendar import *
-
-
-def get_db():
+from calendar_sync import enqueue_item_syncs, event_fingerprint
+from work_items import (
+    bump_project_revision,
+    complete_subtree,
+    refresh_rollups,
+    respace_children,
+    sort_key_bounds,
+)
+from ordering import MAX_SORT_KEY_LENGTH, keys_between
+from database import DATABASE, get_pool
+
+
+def get_db(readonly=None):
+    """
+    The request's database connection, borrowed from a pool. GET requests get
+    a read-only connection unless they ask otherwise.
+    """
     if "lifemap_db" not in g:
-        g.lifemap_db = sqlite3.connect("LifeMap.db")
-        g.lifemap_db.row_factory = sqlite3.Row
+        if readonly is None:
+            readonly = request.method in ("GET", "HEAD")
+        g.lifemap_db_pool = get_pool(DATABASE, readonly=readonly)
+        g.lifemap_db = g.lifemap_db_pool.acquire()
     return g.lifemap_db
 
 
+def release_db():
+    lifemap_db = g.pop("lifemap_db", None)
+    if lifemap_db is not None:
+        g.pop("lifemap_db_pool").release(lifemap_db)
+
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -29,17 +50,7 @@ def build_task_tree(tasks_flat_list):
     """
     task_map = {}
     for task_row in tasks_flat_list:
-        task_dict = dict(task_row)
-
-        # Match keys to schema for consistency
-        task_dict["item_id"] = task_dict["item_id"]
-        task_dict["parent_item_id"] = task_dict["parent_item_id"]
-        task_dict["is_completed"] = bool(task_dict["is_completed"])
-
-        # Handle the is_minimized state
-        task_dict["is_minimized"] = bool(task_dict["is_minimized"])
-        task_dict["subtasks"] = []
-        task_dict["planned_hours"] = task_dict["planned_hours"]
+        task_dict = task_row_to_dict(task_row)
         task_map[task_dict["item_id"]] = task_dict
 
     tree = []
@@ -49,30 +60,71 @@ def build_task_tree(tasks_flat_list):
         elif not task["parent_item_id"]:
             tree.append(task)
 
-    def calculate_rolled_up_hours(task):
-        if not task["subtasks"]:
-            task["calculated_planned_hours"] = task.get("planned_hours") or 0.0
-            return task["calculated_planned_hours"]
-
-        total_hours = 0.0
-        for subtask in task["subtasks"]:
-            total_hours += calculate_rolled_up_hours(subtask)
-
-        task["calculated_planned_hours"] = total_hours
-        return total_hours
-
-    def sort_and_calculate_recursive(tasks_list):
-        tasks_list.sort(key=lambda t: t.get("display_order", t["item_id"]))
+    def sort_recursive(tasks_list):
+        tasks_list.sort(key=lambda t: (t.get("sort_key") or "", t["item_id"]))
         for t in tasks_list:
             if t["subtasks"]:
-                sort_and_calculate_recursive(t["subtasks"])
-            calculate_rolled_up_hours(t)
+                sort_recursive(t["subtasks"])
 
-    sort_and_calculate_recursive(tree)
+    sort_recursive(tree)
     return tree
 
 
+def task_row_to_dict(task_row):
+    """A work_items row as the task templates and the JSON API use it."""
+    task_dict = dict(task_row)
+
+    # Match keys to schema for consistency
+    task_dict["item_id"] = task_dict["item_id"]
+    task_dict["parent_item_id"] = task_dict["parent_item_id"]
+    task_dict["is_completed"] = bool(task_dict["is_completed"])
+
+    # Handle the is_minimized state
+    task_dict["is_minimized"] = bool(task_dict["is_minimized"])
+    task_dict["subtasks"] = []
+    task_dict["planned_hours"] = task_dict["planned_hours"]
+    # Roll-ups are stored on the row and kept up to date on every write.
+    task_dict["calculated_planned_hours"] = task_dict["rolled_up_hours"]
+    task_dict.setdefault("child_count", 0)
+    # The calendar worker writes these without bumping the project's revision,
+    # so they would go stale in cached trees, and the page doesn't use them.
+    task_dict.pop("google_calendar_event_id", None)
+    task_dict.pop("google_calendar_fingerprint", None)
+    return task_dict
+
+
+def load_user():
+    """
+    Puts the logged-in user's profile, {"user_id", "username", "email"}, in
+    g.user for the rest of the request, or None if nobody is logged in. The
+    SQLite session store reads it along with the session, other session
+    backends cost one query here.
+    """
+    user_id = session.get("user_id")
+    user = getattr(session, "user", None)
+    if user_id is not None and (user is None or user["user_id"] != user_id):
+        cursor = get_db().cursor()
+        cursor.execute(
+            """SELECT user_id, username, email FROM users WHERE user_id = ?""",
+            (user_id,),
+        )
+        row = cursor.fetchone()
+        user = dict(row) if row else None
+    g.user = user if user_id is not None else None
+
+
+def forget_user():
+    """Drops the cached profile after the user's row changes, so it is read again."""
+    g.pop("user", None)
+    if hasattr(session, "user"):
+        session.user = None
+
+
 def get_username(user_id):
+    if "user" not in g:
+        load_user()
+    if g.user is not None and g.user["user_id"] == user_id:
+        return g.user["username"]
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute("""SELECT username FROM users WHERE user_id = ?""", (user_id,))
@@ -98,112 +150,315 @@ def format_date_difference(target_date_str: str) -> str:
     return " ".join(parts) or "Today"
 
 
-def process_task_list(
-    task_list, cursor, id_map, project_id, existing_google_events, parent_db_id=None
-):
-    """
-    Recursively processes a list of tasks to save them to the database.
-    """
-    for task in task_list:
-        client_id = task.get("item_id")
-        name = task.get("name")
-        description = task.get("description")
-        due_date = task.get("due_date") or None
-        is_completed = 1 if task.get("is_completed", False) else 0
-        is_minimized = 1 if task.get("is_minimized", False) else 0
-        display_order = task.get("display_order", 0)
-        planned_hours = task.get("planned_hours")
-        actual_parent_id = task.get("parent_item_id")
-
-        if isinstance(actual_parent_id, str) and actual_parent_id.startswith("new-"):
-            actual_parent_id = id_map.get(actual_parent_id)
-
-        current_db_id = None
-
-        if isinstance(client_id, str) and client_id.startswith("new-"):
-            # New tasks are inserted using the corrected parent ID.
-            cursor.execute(
-                """
-                INSERT INTO work_items (project_id, parent_item_id, name, description, due_date, is_completed, is_minimized, display_order, planned_hours)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-                (
-                    project_id,
-                    actual_parent_id,
-                    name,
-                    description,
-                    due_date,
-                    is_completed,
-                    is_minimized,
-                    display_order,
-                    planned_hours,
-                ),
-            )
+def _is_new_id(item_id):
+    return isinstance(item_id, str) and item_id.startswith("new-")
 
-            current_db_id = cursor.lastrowid
-            id_map[client_id] = current_db_id
-
-        elif str(client_id).isdigit():
-            # Existing tasks are updated using the corrected parent ID.
-            current_db_id = int(client_id)
-            cursor.execute(
-                """
-                UPDATE work_items
-                SET name = ?, description = ?, due_date = ?, is_completed = ?, is_minimized = ?, display_order = ?, planned_hours = ?, parent_item_id = ?
-                WHERE item_id = ? AND project_id = ?
-            """,
-                (
-                    name,
-                    description,
-                    due_date,
-                    is_completed,
-                    is_minimized,
-                    display_order,
-                    planned_hours,
-                    actual_parent_id,
-                    current_db_id,
-                    project_id,
-                ),
-            )
 
-        # If the task has subtasks, process them recursively.
-        if current_db_id and task.get("subtasks"):
-            # Pass the existing_google_events dictionary down to the recursion
-            process_task_list(
-                task["subtasks"],
-                cursor,
-                id_map,
-                project_id,
-                existing_google_events,
-                current_db_id,
+def version_conflicts(cursor, project_id, changes):
+    """
+    The saved tasks in a change-set that were changed or deleted since the
+    page loaded them, going by the version each task was sent with. Returns
+    a list of {"item_id", "name", "version", "current_version"}, with a
+    current_version of None for a task that no longer exists.
+    """
+    sent = {int(t["item_id"]): t for t in changes if str(t.get("item_id")).isdigit()}
+    if not sent:
+        return []
+    placeholders = ",".join(["?"] * len(sent))
+    cursor.execute(
+        f"""SELECT item_id, name, version FROM work_items WHERE project_id = ? AND item_id IN ({placeholders})""",
+        [project_id] + list(sent),
+    )
+    current = {row["item_id"]: row for row in cursor.fetchall()}
+
+    conflicts = []
+    for item_id, task in sent.items():
+        row = current.get(item_id)
+        if row is None or row["version"] != task.get("version"):
+            conflicts.append(
+                {
+                    "item_id": item_id,
+                    "name": row["name"] if row is not None else task.get("name"),
+                    "version": task.get("version"),
+                    "current_version": row["version"] if row is not None else None,
+                }
             )
+    return conflicts
+
+
+def apply_task_changes(changes, cursor, project_id):
+    """
+    Saves a change-set from the task page. Only the items that were inserted,
+    edited or moved are in `changes`, so the number of rows written depends on
+    the size of the edit rather than the size of the project.
 
-        if str(client_id).isdigit():
-            old_event_id = existing_google_events.get(current_db_id)
-            if old_event_id:
-                delete_google_event(old_event_id)
-
-        # If the task has a due date, create a new event.
-        if due_date:
-            event_data = {
-                "summary": name,
-                "description": description or "No description provided.",
-                "start": {"date": due_date},
-                "end": {"date": due_date},
-            }
-            created_event = pushOutgoingEvents(event_data)
-
-            if created_event and current_db_id:
-                event_id = created_event.get("id")
-                cursor.execute(
-                    "UPDATE work_items SET google_calendar_event_id = ? WHERE item_id = ?",
-                    (event_id, current_db_id),
+    New items use "new-N" client ids, their parents may be new as well. Returns
+    (id_map, versions): client id -> database id for the inserted rows, and
+    database id -> version for every row that was written.
+    """
+    existing_ids = [
+        int(t["item_id"]) for t in changes if str(t.get("item_id")).isdigit()
+    ]
+    existing_rows = {}
+    if existing_ids:
+        placeholders = ",".join(["?"] * len(existing_ids))
+        cursor.execute(
+            f"""SELECT item_id, parent_item_id, is_completed, planned_hours, google_calendar_event_id, google_calendar_fingerprint, version FROM work_items
+            WHERE project_id = ? AND item_id IN ({placeholders})""",
+            [project_id] + existing_ids,
+        )
+        existing_rows = {row["item_id"]: row for row in cursor.fetchall()}
+
+    # Tasks only get a new sort key if the page placed them somewhere.
+    sort_keys = _placed_sort_keys(cursor, project_id, changes)
+    changes = [
+        dict(task, sort_key=sort_keys.get(str(task.get("item_id")))) for task in changes
+    ]
+
+    id_map = {}
+    versions = {}
+
+    # New items go in first, so that moved items can then be given a new
+    # parent as easily as an existing one.
+    sync_ids = insert_new_tasks(cursor, project_id, changes, id_map)
+    for item_id in id_map.values():
+        versions[item_id] = 0
+
+    # Roll-ups only depend on planned hours, completion and where a task
+    # sits, so a rename or a new description leaves them alone.
+    rollup_ids = list(id_map.values())
+    updates = []
+    for task in changes:
+        if not str(task.get("item_id")).isdigit():
+            continue
+        item_id = int(task["item_id"])
+        existing_row = existing_rows.get(item_id)
+        if existing_row is None:
+            # Not part of this project, never write it.
+            continue
+        values = _task_values(task)
+        parent_id = _parent_db_id(task, id_map)
+        updates.append(values + (parent_id, item_id, project_id))
+        versions[item_id] = existing_row["version"] + 1
+        planned_hours, is_completed = values[6], values[3]
+        # complete_subtree below refreshes the tasks completed by this save.
+        newly_completed = is_completed and not existing_row["is_completed"]
+        if str(parent_id) != str(existing_row["parent_item_id"]):
+            rollup_ids += [item_id, existing_row["parent_item_id"]]
+        elif not newly_completed and (
+            is_completed != existing_row["is_completed"]
+            or not _same_hours(planned_hours, existing_row["planned_hours"])
+        ):
+            rollup_ids.append(item_id)
+
+        # The calendar event is created, patched or removed by the sync worker
+        # once this transaction commits, but only if what it shows has changed.
+        name, description, due_date = values[:3]
+        if event_fingerprint(name, description, due_date) != existing_row[
+            "google_calendar_fingerprint"
+        ] or bool(due_date) != bool(existing_row["google_calendar_event_id"]):
+            sync_ids.append(item_id)
+
+    if updates:
+        cursor.executemany(
+            """
+            UPDATE work_items
+            SET name = ?, description = ?, due_date = ?, is_completed = ?, is_minimized = ?, sort_key = COALESCE(?, sort_key), planned_hours = ?, parent_item_id = ?, version = version + 1
+            WHERE item_id = ? AND project_id = ?
+        """,
+            updates,
+        )
+    enqueue_item_syncs(cursor, sync_ids)
+
+    # The page only has the subtasks of expanded tasks, so completing a task
+    # completes the rest of its subtree here.
+    completed_subtree = False
+    for task in changes:
+        if not task.get("is_completed") or not str(task.get("item_id")).isdigit():
+            continue
+        row = existing_rows.get(int(task["item_id"]))
+        if row is not None and not row["is_completed"]:
+            complete_subtree(cursor, project_id, row["item_id"])
+            completed_subtree = True
+
+    # That bumps the version of any task below again, including ones this
+    # save wrote as not completed, so the versions are read back.
+    if completed_subtree and versions:
+        placeholders = ",".join(["?"] * len(versions))
+        cursor.execute(
+            f"""SELECT item_id, version FROM work_items WHERE project_id = ? AND item_id IN ({placeholders})""",
+            [project_id] + list(versions),
+        )
+        versions = dict(cursor.fetchall())
+
+    # Inserted items, items whose hours or completion changed, and moved
+    # items with the parents they were moved away from. An edit that touches
+    # none of those only needs the project's revision bumped.
+    if rollup_ids:
+        refresh_rollups(cursor, rollup_ids)
+    elif updates:
+        bump_project_revision(cursor, project_id)
+    return id_map, versions
+
+
+def _same_hours(hours, stored_hours):
+    """Whether planned hours from the page are the ones stored, "3" and 3.0 alike."""
+    try:
+        return float(hours) == float(stored_hours)
+    except (TypeError, ValueError):
+        return hours == stored_hours
+
+
+def insert_new_tasks(cursor, project_id, tasks, id_map):
+    """
+    Inserts the tasks with "new-N" client ids, whose parents may be existing
+    items, new tasks from an earlier call (found in `id_map`) or other new
+    tasks in `tasks`, with one executemany per level of the tree. Each task
+    needs its "sort_key", see ordering.py. Adds client
+    id -> database id to `id_map` and returns the ids of the inserted tasks
+    that have a due date and so need a calendar event.
+    """
+    sync_ids = []
+    for level in _new_task_levels(tasks, id_map):
+        rows = [
+            (project_id, _parent_db_id(task, id_map)) + _task_values(task)
+            for task in level
+        ]
+        cursor.executemany(
+            """
+            INSERT INTO work_items (project_id, parent_item_id, name, description, due_date, is_completed, is_minimized, sort_key, planned_hours)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+            rows,
+        )
+        # AUTOINCREMENT hands out ids in order and the transaction holds the
+        # write lock, so the rows of one executemany have consecutive ids.
+        cursor.execute("SELECT last_insert_rowid()")
+        first_id = cursor.fetchone()[0] - len(rows) + 1
+        for offset, task in enumerate(level):
+            item_id = first_id + offset
+            id_map[task["item_id"]] = item_id
+            if task.get("due_date"):
+                sync_ids.append(item_id)
+    return sync_ids
+
+
+def _new_task_levels(changes, id_map):
+    """
+    The new items of a change-set grouped by depth: first those under an
+    existing item, then their children and so on, in the order they were sent.
+    """
+    pending = [task for task in changes if _is_new_id(task.get("item_id"))]
+    placed = set(id_map)
+    levels = []
+    while pending:
+        level = []
+        deferred = []
+        for task in pending:
+            parent_id = task.get("parent_item_id")
+            if _is_new_id(parent_id) and parent_id not in placed:
+                deferred.append(task)
+            else:
+                level.append(task)
+
+        if not level:
+            raise ValueError("Some new tasks reference a parent that does not exist.")
+        placed.update(task["item_id"] for task in level)
+        levels.append(level)
+        pending = deferred
+    return levels
+
+
+def _parent_db_id(task, id_map):
+    parent_id = task.get("parent_item_id")
+    if _is_new_id(parent_id):
+        return id_map.get(parent_id)
+    return parent_id
+
+
+def _task_values(task):
+    """(name, description, due_date, is_completed, is_minimized, sort_key, planned_hours) of a task from the page."""
+    return (
+        task.get("name"),
+        task.get("description"),
+        task.get("due_date") or None,
+        1 if task.get("is_completed", False) else 0,
+        1 if task.get("is_minimized", False) else 0,
+        task.get("sort_key"),
+        task.get("planned_hours"),
+    )
+
+
+def _placed_sort_keys(cursor, project_id, changes):
+    """
+    Client id -> sort key for the tasks of a change-set the page placed
+    somewhere: every new task, and any moved task sent with a before_item_id.
+    Each goes in front of the sibling named by its before_item_id, or after
+    the last one for None. Placed tasks queued up in front of the same stored
+    sibling, in the order they were sent, share the gap between it and the
+    sibling before it.
+    """
+    placed = {
+        str(task["item_id"]): task
+        for task in changes
+        if _is_new_id(task.get("item_id")) or "before_item_id" in task
+    }
+    if not placed:
+        return {}
+    moved_ids = [int(item_id) for item_id in placed if item_id.isdigit()]
+
+    def anchor(task):
+        """The stored sibling at the end of the queue `task` is in, or None."""
+        parent_id = str(task.get("parent_item_id"))
+        seen = set()
+        while True:
+            before = task.get("before_item_id")
+            if before is None:
+                return None
+            before = str(before)
+            if before not in placed:
+                return int(before) if before.isdigit() else None
+            task = placed[before]
+            if before in seen or str(task.get("parent_item_id")) != parent_id:
+                return None
+            seen.add(before)
+
+    anchors = {item_id: anchor(task) for item_id, task in placed.items()}
+    stored_parents = {}
+    anchor_ids = {before for before in anchors.values() if before is not None}
+    if anchor_ids:
+        placeholders = ",".join(["?"] * len(anchor_ids))
+        cursor.execute(
+            f"""SELECT item_id, parent_item_id FROM work_items WHERE project_id = ? AND item_id IN ({placeholders})""",
+            [project_id] + list(anchor_ids),
+        )
+        stored_parents = dict(cursor.fetchall())
+
+    queues = {}
+    for item_id, task in placed.items():
+        parent_id = str(task.get("parent_item_id"))
+        before = anchors[item_id]
+        # Going in front of a task that isn't a sibling, e.g. one under a new
+        # parent or moved elsewhere meanwhile, puts it at the end instead.
+        if str(stored_parents.get(before)) != parent_id:
+            before = None
+        queues.setdefault((parent_id, before), []).append(item_id)
+
+    sort_keys = {}
+    for (parent_id, before), item_ids in queues.items():
+        if not parent_id.isdigit():
+            keys = keys_between(None, None, len(item_ids))
+        else:
+            for attempt in range(2):
+                bounds = sort_key_bounds(
+                    cursor, project_id, int(parent_id), before, None, moved_ids
                 )
-        elif str(client_id).isdigit():
-            cursor.execute(
-                "UPDATE work_items SET google_calendar_event_id = NULL WHERE item_id = ?",
-                (current_db_id,),
-            )
+                keys = keys_between(*bounds, len(item_ids))
+                if max(len(key) for key in keys) <= MAX_SORT_KEY_LENGTH:
+                    break
+                respace_children(cursor, project_id, int(parent_id))
+        sort_keys.update(zip(item_ids, keys))
+    return sort_keys
 
 
 def gap_print(a, b):
@@ -0,0 +1,313 @@
+import cProfile
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import (
+    before_render_template,
+    g,
+    has_request_context,
+    request,
+    template_rendered,
+)
+
+import database
+
+# Per-request measurements: wall time, SQL statements and their time, rows
+# read and written, template rendering and Google Calendar calls. Each request
+# is logged as one JSON line on the "lifemap.requests" logger and added to the
+# totals served in Prometheus' text format at /metrics.
+#
+# Set LIFEMAP_PROFILE_SLOW_MS to profile requests with cProfile and keep the
+# profile of any that take longer than that, in LIFEMAP_PROFILE_DIR.
+#
+# /metrics is only served to logged-in users, or to a scraper that sends
+# LIFEMAP_METRICS_TOKEN as "Authorization: Bearer <token>".
+
+logger = logging.getLogger("lifemap.requests")
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+PROFILE_SLOW_MS = os.environ.get("LIFEMAP_PROFILE_SLOW_MS")
+PROFILE_DIR = os.environ.get("LIFEMAP_PROFILE_DIR", "profiles")
+METRICS_TOKEN = os.environ.get("LIFEMAP_METRICS_TOKEN")
+
+# The fields of a RequestMetrics that are added up per endpoint.
+TOTALS = {
+    "sql_statements": ("lifemap_sql_statements_total", "SQL statements run."),
+    "sql_seconds": ("lifemap_sql_seconds_total", "Time spent in SQLite."),
+    "rows_read": ("lifemap_rows_read_total", "Rows fetched from SQLite."),
+    "rows_written": ("lifemap_rows_written_total", "Rows changed in SQLite."),
+    "template_seconds": (
+        "lifemap_template_seconds_total",
+        "Time spent rendering templates.",
+    ),
+    "calendar_calls": (
+        "lifemap_request_calendar_calls_total",
+        "Google Calendar API calls made while handling requests.",
+    ),
+    "calendar_seconds": (
+        "lifemap_request_calendar_seconds_total",
+        "Time spent on Google Calendar API calls while handling requests.",
+    ),
+}
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.rows_read = 0
+        self.rows_written = 0
+        self.template_seconds = 0.0
+        self.calendar_calls = 0
+        self.calendar_seconds = 0.0
+
+
+class _EndpointTotals:
+    def __init__(self):
+        self.requests = {}
+        self.bucket_counts = [0] * len(DURATION_BUCKETS)
+        self.seconds = 0.0
+        self.count = 0
+        self.totals = dict.fromkeys(TOTALS, 0)
+
+
+_lock = threading.Lock()
+_endpoints = {}
+# Calls from anywhere, including the calendar sync worker's thread.
+_calendar = {"calls": 0, "operations": 0, "seconds": 0.0, "errors": 0}
+
+
+def _current():
+    if has_request_context():
+        return g.get("request_metrics")
+    return None
+
+
+def _on_statement(statements, seconds, rows_read, rows_written):
+    current = _current()
+    if current is not None:
+        current.sql_statements += statements
+        current.sql_seconds += seconds
+        current.rows_read += rows_read
+        current.rows_written += rows_written
+
+
+@contextmanager
+def calendar_call(operations=1):
+    """Wrap each round trip to the Google Calendar API in this."""
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except Exception:
+        failed = True
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        with _lock:
+            _calendar["calls"] += 1
+            _calendar["operations"] += operations
+            _calendar["seconds"] += seconds
+            _calendar["errors"] += failed
+        current = _current()
+        if current is not None:
+            current.calendar_calls += 1
+            current.calendar_seconds += seconds
+
+
+def _before_render(sender, template, context, **extra):
+    current = _current()
+    if current is not None:
+        current.template_started = time.perf_counter()
+
+
+def _after_render(sender, template, context, **extra):
+    current = _current()
+    if current is not None and hasattr(current, "template_started"):
+        current.template_seconds += time.perf_counter() - current.template_started
+        del current.template_started
+
+
+_profile_lock = threading.Lock()
+
+
+def _start_request():
+    g.request_metrics = RequestMetrics()
+    # Only one profiler can be active at a time, so concurrent requests go unprofiled.
+    if PROFILE_SLOW_MS and _profile_lock.acquire(blocking=False):
+        g.request_profile = cProfile.Profile()
+        g.request_profile.enable()
+
+
+def _finish_request(response):
+    current = g.pop("request_metrics", None)
+    if current is None:
+        return response
+    seconds = time.perf_counter() - current.started
+    endpoint = request.endpoint or "unknown"
+
+    profile = g.pop("request_profile", None)
+    if profile is not None:
+        profile.disable()
+        _profile_lock.release()
+        if seconds * 1000 >= float(PROFILE_SLOW_MS):
+            _dump_profile(profile, endpoint, seconds)
+
+    record = {
+        "method": request.method,
+        "path": request.path,
+        "endpoint": endpoint,
+        "status": response.status_code,
+        "ms": round(seconds * 1000, 2),
+    }
+    for field in TOTALS:
+        value = getattr(current, field)
+        if field.endswith("_seconds"):
+            record[field.replace("_seconds", "_ms")] = round(value * 1000, 2)
+        else:
+            record[field] = value
+    logger.info(json.dumps(record))
+
+    with _lock:
+        totals = _endpoints.setdefault(endpoint, _EndpointTotals())
+        key = (request.method, response.status_code)
+        totals.requests[key] = totals.requests.get(key, 0) + 1
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if seconds <= bound:
+                totals.bucket_counts[index] += 1
+        totals.seconds += seconds
+        totals.count += 1
+        for field in TOTALS:
+            totals.totals[field] += getattr(current, field)
+    return response
+
+
+def _stop_profile(exception=None):
+    # For requests that never reached _finish_request.
+    if g.pop("request_profile", None) is not None:
+        _profile_lock.release()
+
+
+def _dump_profile(profile, endpoint, seconds):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(
+        PROFILE_DIR,
+        f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint}-{int(seconds * 1000)}ms.prof",
+    )
+    profile.dump_stats(path)
+    logger.warning(f"Slow request profile saved to {path}")
+
+
+def init_app(app):
+    """Starts measuring every request the app handles."""
+    database.on_statement.append(_on_statement)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_stop_profile)
+
+
+def _labels(**labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def scraper_authorized():
+    """Whether the request carries METRICS_TOKEN as a bearer token. Never, if it isn't set."""
+    if not METRICS_TOKEN:
+        return False
+    return hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"
+    )
+
+
+def prometheus_text(extra=()):
+    """
+    Everything measured so far in Prometheus' text exposition format. `extra`
+    is a list of (name, type, help, value) for numbers kept elsewhere.
+    """
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+
+    with _lock:
+        endpoints = sorted(_endpoints.items())
+        metric(
+            "lifemap_requests_total",
+            "counter",
+            "Requests handled.",
+            [
+                (_labels(endpoint=endpoint, method=method, status=status), count)
+                for endpoint, totals in endpoints
+                for (method, status), count in sorted(totals.requests.items())
+            ],
+        )
+
+        duration = []
+        for endpoint, totals in endpoints:
+            for bound, count in zip(DURATION_BUCKETS, totals.bucket_counts):
+                duration.append((_labels(endpoint=endpoint, le=bound), count))
+            duration.append((_labels(endpoint=endpoint, le="+Inf"), totals.count))
+        lines.append("# HELP lifemap_request_duration_seconds Request wall time.")
+        lines.append("# TYPE lifemap_request_duration_seconds histogram")
+        for labels, count in duration:
+            lines.append(f"lifemap_request_duration_seconds_bucket{{{labels}}} {count}")
+        for endpoint, totals in endpoints:
+            labels = _labels(endpoint=endpoint)
+            lines.append(
+                f"lifemap_request_duration_seconds_sum{{{labels}}} {totals.seconds}"
+            )
+            lines.append(
+                f"lifemap_request_duration_seconds_count{{{labels}}} {totals.count}"
+            )
+
+        for field, (name, help_text) in TOTALS.items():
+            metric(
+                name,
+                "counter",
+                help_text,
+                [
+                    (_labels(endpoint=endpoint), totals.totals[field])
+                    for endpoint, totals in endpoints
+                ],
+            )
+
+        calendar = dict(_calendar)
+
+    metric(
+        "lifemap_calendar_calls_total",
+        "counter",
+        "Google Calendar API round trips, including the sync worker's.",
+        [("", calendar["calls"])],
+    )
+    metric(
+        "lifemap_calendar_operations_total",
+        "counter",
+        "Google Calendar operations sent, a batch request carries several.",
+        [("", calendar["operations"])],
+    )
+    metric(
+        "lifemap_calendar_seconds_total",
+        "counter",
+        "Time spent on Google Calendar API round trips.",
+        [("", calendar["seconds"])],
+    )
+    metric(
+        "lifemap_calendar_errors_total",
+        "counter",
+        "Google Calendar API round trips that raised.",
+        [("", calendar["errors"])],
+    )
+    for name, kind, help_text, value in extra:
+        metric(name, kind, help_text, [("", value)])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,78 @@
+# Sort keys for the subtasks of a task. A task's place among its siblings is
+# its sort_key, a string of base-62 digits compared as text, so a task can
+# always be given a key between any two others and moving it only rewrites
+# its own row. Read as the digits of a fraction between 0 and 1, a key never
+# ends in "0", which leaves room below every key.
+#
+# Keys get longer when tasks keep landing in the same gap. Once one would be
+# longer than MAX_SORT_KEY_LENGTH, the siblings are given evenly spread keys
+# again (see respace_children in work_items.py).
+
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+MAX_SORT_KEY_LENGTH = 24
+# ordinal_key numbers siblings from 1 in this many digits, so it has keys for
+# the first 62 ** 4 - 1 of them.
+ORDINAL_KEY_WIDTH = 4
+
+
+def _midpoint(low, high):
+    """A key between `low` ("" for the start) and `high` (None for the end)."""
+    if high is not None:
+        # Any common prefix stays, reading missing digits of `low` as "0".
+        shared = 0
+        while shared < len(high) and (low[shared : shared + 1] or "0") == high[shared]:
+            shared += 1
+        if shared:
+            return high[:shared] + _midpoint(low[shared:], high[shared:])
+    low_digit = DIGITS.index(low[0]) if low else 0
+    high_digit = DIGITS.index(high[0]) if high is not None else len(DIGITS)
+    if high_digit - low_digit > 1:
+        return DIGITS[(low_digit + high_digit) // 2]
+    # Neighbouring digits, the key has to be longer than the first one.
+    if high is not None and len(high) > 1:
+        return high[0]
+    return DIGITS[low_digit] + _midpoint(low[1:], None)
+
+
+def key_between(before, after):
+    """
+    A sort key after `before` and before `after`. Either may be None for the
+    start or the end of the list, and `before` may also be "", which sorts
+    first. Nothing sorts before "", so it can't be `after`.
+    """
+    if after == "":
+        raise ValueError("No sort key comes before an empty one.")
+    if before is not None and after is not None and not before < after:
+        raise ValueError(f"Sort key {before!r} isn't before {after!r}.")
+    return _midpoint(before or "", after)
+
+
+def keys_between(before, after, count):
+    """
+    `count` sort keys in order between `before` and `after`, spread out so
+    that they stay short however many there are.
+    """
+    if count <= 0:
+        return []
+    middle = key_between(before, after)
+    below = count // 2
+    return (
+        keys_between(before, middle, below)
+        + [middle]
+        + keys_between(middle, after, count - below - 1)
+    )
+
+
+def ordinal_key(index):
+    """
+    The sort key of the `index`th sibling of a list written in order, e.g. by
+    an import, without knowing how long the list will get.
+    """
+    number = index + 1
+    if not 0 < number < len(DIGITS) ** ORDINAL_KEY_WIDTH:
+        raise ValueError(f"No ordinal sort key for sibling {index}.")
+    digits = ""
+    for _ in range(ORDINAL_KEY_WIDTH):
+        number, digit = divmod(number, len(DIGITS))
+        digits = DIGITS[digit] + digits
+    return digits.rstrip("0")
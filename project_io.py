@@ -0,0 +1,426 @@
+import json
+import re
+from datetime import date
+
+from calendar_sync import enqueue_item_syncs
+from help import insert_new_tasks
+from ordering import DIGITS, ORDINAL_KEY_WIDTH, ordinal_key
+from work_items import MAX_TASK_LEVEL, outline_task_rows, rebuild_rollups
+
+# Moving projects in and out of LifeMap as files, in one of two formats.
+#
+# JSON Lines: a {"type": "project", ...} line for each project, followed by a
+# {"type": "task", ...} line for each of its tasks, every task after its parent.
+#
+# Outline: a "# " line for each project, then a "- [ ] " line for each task,
+# indented two spaces for each level below the top. "> " lines hold the
+# description of the project or task above them. Which tasks are minimized
+# is left out.
+#
+#   # Kitchen @start(2026-01-01) @end(2026-06-30)
+#   > Redo the kitchen
+#   - [ ] Buy tiles @due(2026-03-01) @hours(2)
+#     > White, ceramic
+#     - [x] Compare shops
+#
+# Exports are written row by row from a cursor and imports are read line by
+# line, keeping only the current task's parents and one batch of tasks in
+# memory, so projects of any size can be moved.
+
+IMPORT_BATCH_SIZE = 1000
+# As many as ordinal_key has sort keys for.
+MAX_IMPORTED_SIBLINGS = len(DIGITS) ** ORDINAL_KEY_WIDTH - 1
+OUTLINE_INDENT = "  "
+
+_TAG = re.compile(r"\s+@(start|end|due|hours)\(([^)]*)\)$")
+# A name with something in it that reads like a tag has its @ escaped.
+_TAG_IN_NAME = re.compile(r"(\s)@(start|end|due|hours)\(")
+_ESCAPED_TAG = re.compile(r"(\s)\\@(start|end|due|hours)\(")
+_OUTLINE_TASK = re.compile(r"- \[([ xX])\] (.*)$")
+
+
+class ImportProblem(ValueError):
+    """Something wrong with a file being imported, and the line it's on."""
+
+    def __init__(self, line_number, message):
+        super().__init__(f"Line {line_number}: {message}")
+        self.line_number = line_number
+
+
+def _user_projects(cursor, user_id, project_id=None):
+    only_project = "" if project_id is None else "AND project_id = ?"
+    params = (user_id,) if project_id is None else (user_id, project_id)
+    cursor.execute(
+        f"""SELECT project_id, name, description, start_date, end_date FROM projects
+        WHERE user_id = ? {only_project} ORDER BY project_id""",
+        params,
+    )
+    return cursor.fetchall()
+
+
+def _json_line(record):
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def export_jsonl(cursor, user_id, project_id=None):
+    """Yields the lines of a JSON Lines export of one of the user's projects, or all of them."""
+    for project in _user_projects(cursor, user_id, project_id):
+        yield _json_line(
+            {
+                "type": "project",
+                "id": project["project_id"],
+                "name": project["name"],
+                "description": project["description"],
+                "start_date": project["start_date"],
+                "end_date": project["end_date"],
+            }
+        )
+        for row in outline_task_rows(cursor, project["project_id"]):
+            yield _json_line(
+                {
+                    "type": "task",
+                    "id": row["item_id"],
+                    # The root item isn't exported, the project stands for it.
+                    "parent": row["parent_item_id"] if row["level"] > 1 else None,
+                    "name": row["name"],
+                    "description": row["description"],
+                    "due_date": row["due_date"],
+                    "planned_hours": row["planned_hours"],
+                    "is_completed": bool(row["is_completed"]),
+                    "is_minimized": bool(row["is_minimized"]),
+                }
+            )
+
+
+def _outline_entry(marker, name, tags, description, indent):
+    tag_text = "".join(
+        f" @{tag}({value})" for tag, value in tags.items() if value not in (None, "")
+    )
+    name = _TAG_IN_NAME.sub(r"\1\\@\2(", " ".join((name or "").split()))
+    lines = [f"{indent}{marker}{name}{tag_text}\n"]
+    if description:
+        indent += OUTLINE_INDENT if marker != "# " else ""
+        lines += [f"{indent}> {line}\n" for line in description.splitlines()]
+    return "".join(lines)
+
+
+def export_outline(cursor, user_id, project_id=None):
+    """Yields the lines of an outline export of one of the user's projects, or all of them."""
+    for index, project in enumerate(_user_projects(cursor, user_id, project_id)):
+        if index:
+            yield "\n"
+        yield _outline_entry(
+            "# ",
+            project["name"],
+            {"start": project["start_date"], "end": project["end_date"]},
+            project["description"],
+            "",
+        )
+        for row in outline_task_rows(cursor, project["project_id"]):
+            hours = row["planned_hours"]
+            yield _outline_entry(
+                "- [x] " if row["is_completed"] else "- [ ] ",
+                row["name"],
+                {
+                    "due": row["due_date"],
+                    "hours": None if hours is None else f"{hours:g}",
+                },
+                row["description"],
+                OUTLINE_INDENT * (row["level"] - 1),
+            )
+
+
+def import_format(filename):
+    """The format of an uploaded file, going by its extension."""
+    if filename.lower().endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    return "outline"
+
+
+def text_lines(stream):
+    """The lines of an uploaded file, read one at a time from its binary stream."""
+    for line_number, line in enumerate(stream, 1):
+        try:
+            yield line.decode("utf-8").lstrip("\ufeff")
+        except UnicodeDecodeError:
+            raise ImportProblem(line_number, "The file isn't UTF-8 text.")
+
+
+def _jsonl_records(lines):
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise ImportProblem(line_number, "This line isn't valid JSON.")
+        if not isinstance(record, dict) or record.get("type") not in (
+            "project",
+            "task",
+        ):
+            raise ImportProblem(
+                line_number, 'Each line needs a "type" of "project" or "task".'
+            )
+        # Tasks are placed by their "parent", see _ProjectImporter.add_task.
+        record.pop("level", None)
+        yield line_number, record
+
+
+def _split_tags(text):
+    tags = {}
+    match = _TAG.search(text)
+    while match:
+        tags[match.group(1)] = match.group(2).strip()
+        text = text[: match.start()]
+        match = _TAG.search(text)
+    return _ESCAPED_TAG.sub(r"\1@\2(", text.strip()), tags
+
+
+def _outline_records(lines):
+    # A record is only handed on once the line after it shows that its
+    # description, if it has one, is complete.
+    record = None
+    description = []
+    for line_number, line in enumerate(lines, 1):
+        line = line.rstrip("\r\n")
+        stripped = line.strip()
+        if not stripped:
+            continue
+
+        if stripped.startswith(">"):
+            if record is None:
+                raise ImportProblem(
+                    line_number, "A description has to follow a project or task."
+                )
+            text = stripped[1:]
+            description.append(text[1:] if text.startswith(" ") else text)
+            continue
+
+        if record is not None:
+            record[1]["description"] = "\n".join(description) or None
+            yield record
+        description = []
+
+        if line.startswith("# "):
+            name, tags = _split_tags(line[2:])
+            record = (
+                line_number,
+                {
+                    "type": "project",
+                    "name": name,
+                    "start_date": tags.get("start"),
+                    "end_date": tags.get("end"),
+                },
+            )
+            continue
+
+        body = line.lstrip(" ")
+        indent = len(line) - len(body)
+        match = _OUTLINE_TASK.match(body)
+        if not match or indent % len(OUTLINE_INDENT):
+            raise ImportProblem(
+                line_number,
+                'Tasks are written as "- [ ] Name", indented two spaces for each level.',
+            )
+        name, tags = _split_tags(match.group(2))
+        record = (
+            line_number,
+            {
+                "type": "task",
+                "level": indent // len(OUTLINE_INDENT) + 1,
+                "name": name,
+                "is_completed": match.group(1) != " ",
+                "due_date": tags.get("due"),
+                "planned_hours": tags.get("hours"),
+            },
+        )
+
+    if record is not None:
+        record[1]["description"] = "\n".join(description) or None
+        yield record
+
+
+def _check_date(line_number, value):
+    if value in (None, ""):
+        return None
+    try:
+        return date.fromisoformat(value).isoformat()
+    except (TypeError, ValueError):
+        raise ImportProblem(
+            line_number, f'"{value}" isn\'t a date, dates are written YYYY-MM-DD.'
+        )
+
+
+def _check_hours(line_number, value):
+    if value in (None, ""):
+        return None
+    try:
+        hours = float(value)
+    except (TypeError, ValueError):
+        hours = -1
+    if hours < 0 or isinstance(value, bool):
+        raise ImportProblem(
+            line_number, f'"{value}" isn\'t a number of hours that can be planned.'
+        )
+    return hours
+
+
+class _ProjectImporter:
+    """
+    Creates projects and their tasks from the records of an import, checking
+    each one as it comes. Tasks are collected into batches for
+    insert_new_tasks, the parents of the current task are all that is kept
+    from earlier batches.
+    """
+
+    def __init__(self, cursor, user_id):
+        self.cursor = cursor
+        self.user_id = user_id
+        self.project_ids = []
+        self.task_count = 0
+        self.project_id = None
+
+    def add_project(self, line_number, record):
+        self.finish_project()
+        name = (record.get("name") or "").strip()
+        if not name:
+            raise ImportProblem(line_number, "A project needs a name.")
+        start_date = _check_date(line_number, record.get("start_date"))
+        end_date = _check_date(line_number, record.get("end_date"))
+        description = record.get("description")
+
+        self.cursor.execute(
+            """SELECT project_id FROM projects WHERE user_id = ? AND name = ?""",
+            (self.user_id, name),
+        )
+        if self.cursor.fetchone():
+            raise ImportProblem(
+                line_number, f'You already have a project called "{name}".'
+            )
+
+        self.cursor.execute(
+            """INSERT INTO projects (user_id, name, description, end_date, start_date) VALUES (?, ?, ?, ?, ?)""",
+            (self.user_id, name, description, end_date, start_date),
+        )
+        self.project_id = self.cursor.lastrowid
+        self.cursor.execute(
+            """INSERT INTO work_items (project_id, parent_item_id, name, description, planned_hours) VALUES (?, ?, ?, ?, ?)""",
+            (self.project_id, None, name, description, None),
+        )
+        self.root = {"item_id": self.cursor.lastrowid, "children": 0}
+        # The current task's parents, top first: stack[0] is at level 1.
+        self.stack = []
+        self.batch = []
+        self.id_map = {}
+        self.project_ids.append(self.project_id)
+
+    def add_task(self, line_number, record):
+        if self.project_id is None:
+            raise ImportProblem(line_number, "A task has to come after a project.")
+
+        if "level" in record:
+            level = record["level"]
+            if level > len(self.stack) + 1:
+                raise ImportProblem(
+                    line_number,
+                    "A task can only be indented one level more than the task above it.",
+                )
+        elif record.get("parent") is None:
+            level = 1
+        else:
+            # Every task comes after its parent, so the parent is one of the
+            # tasks above the one before it.
+            keys = [entry["key"] for entry in self.stack]
+            if record["parent"] not in keys:
+                raise ImportProblem(
+                    line_number,
+                    f"Task {record['parent']} has to come before its subtasks.",
+                )
+            level = len(keys) - keys[::-1].index(record["parent"]) + 1
+        if level > MAX_TASK_LEVEL:
+            raise ImportProblem(
+                line_number,
+                f"Tasks can only be nested {MAX_TASK_LEVEL} levels deep.",
+            )
+
+        name = (record.get("name") or "").strip()
+        if not name:
+            raise ImportProblem(line_number, "A task needs a name.")
+        due_date = _check_date(line_number, record.get("due_date"))
+        planned_hours = _check_hours(line_number, record.get("planned_hours"))
+
+        del self.stack[level - 1 :]
+        parent = self.stack[-1] if self.stack else self.root
+        if due_date and parent.get("due_date") and due_date > parent["due_date"]:
+            raise ImportProblem(
+                line_number, f'"{name}" is due after the task it is under.'
+            )
+
+        if parent["children"] >= MAX_IMPORTED_SIBLINGS:
+            raise ImportProblem(
+                line_number,
+                f"A task can only have {MAX_IMPORTED_SIBLINGS} subtasks in an import.",
+            )
+
+        if len(self.batch) >= IMPORT_BATCH_SIZE:
+            self._insert_batch()
+        self.task_count += 1
+        task = {
+            "item_id": f"new-{self.task_count}",
+            "parent_item_id": parent["item_id"],
+            "name": name,
+            "description": record.get("description"),
+            "due_date": due_date,
+            "planned_hours": planned_hours,
+            "is_completed": bool(record.get("is_completed")),
+            "is_minimized": bool(record.get("is_minimized")),
+            "sort_key": ordinal_key(parent["children"]),
+        }
+        parent["children"] += 1
+        self.batch.append(task)
+        self.stack.append(
+            {
+                "key": record.get("id"),
+                "item_id": task["item_id"],
+                "due_date": due_date,
+                "children": 0,
+            }
+        )
+
+    def _insert_batch(self):
+        enqueue_item_syncs(
+            self.cursor,
+            insert_new_tasks(self.cursor, self.project_id, self.batch, self.id_map),
+        )
+        # Later batches only need the database ids of the current parents.
+        for entry in self.stack:
+            entry["item_id"] = self.id_map.get(entry["item_id"], entry["item_id"])
+        self.batch = []
+        self.id_map = {}
+
+    def finish_project(self):
+        if self.project_id is None:
+            return
+        self._insert_batch()
+        rebuild_rollups(self.cursor, self.project_id)
+        self.project_id = None
+
+
+def import_projects(cursor, user_id, lines, format="jsonl"):
+    """
+    Creates the projects in an export, read one line at a time from `lines`,
+    in the "jsonl" or "outline" format. Returns (project ids, number of tasks).
+    Raises ImportProblem at the first thing wrong with the file, after which
+    the transaction should be rolled back.
+    """
+    records = _outline_records(lines) if format == "outline" else _jsonl_records(lines)
+    importer = _ProjectImporter(cursor, user_id)
+    for line_number, record in records:
+        if record["type"] == "project":
+            importer.add_project(line_number, record)
+        else:
+            importer.add_task(line_number, record)
+    importer.finish_project()
+    if not importer.project_ids:
+        raise ImportProblem(1, "The file doesn't contain any projects.")
+    return importer.project_ids, importer.task_count
@@ -0,0 +1,556 @@
+import sqlite3
+import sys
+from database import DATABASE, connect
+from auth import LOGIN_USER_SQL
+from calendar_sync import DUE_ROWS_SQL, ENQUEUE_ITEM_SYNC_SQL
+from search import TASK_MATCH_COUNT_SQL, task_hits_sql
+from sessions import OPEN_SESSION_SQL, SWEEP_SESSIONS_SQL
+from work_items import (
+    CHILD_PAGE_SQL,
+    PROJECT_OWNER_SQL,
+    PROJECT_TASKS_SQL,
+    RENAME_PROJECT_ROOT_SQL,
+    _ancestor_ids,
+    _subtree_ids,
+    dated_items_sql,
+    rebuild_rollups,
+    sort_key_bound_sql,
+)
+from dashboard import PROJECT_SORTS, next_page_token, project_page_query
+from ordering import keys_between
+from changes import CHANGE_FEED_SQL, LATEST_CHANGE_SQL
+
+# Schema changes are numbered migrations. The number of the last one applied
+# is kept in the database's PRAGMA user_version, so each runs exactly once.
+
+
+def _column_names(cursor, table_name):
+    cursor.execute(f"PRAGMA table_info({table_name})")
+    return {row[1] for row in cursor.fetchall()}
+
+
+def _add_column(cursor, table_name, column_name, definition):
+    """Adds a column unless it is already there (older versions added some of these on start up)."""
+    if column_name in _column_names(cursor, table_name):
+        return False
+    cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {definition}")
+    return True
+
+
+def _create_base_tables(cursor):
+    """The original tables the migrations build on, for a brand new database file."""
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            email TEXT UNIQUE,
+            password_hash TEXT NOT NULL,
+            google_token TEXT
+        )
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS projects (
+            project_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            description TEXT,
+            start_date TEXT,
+            end_date TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS work_items (
+            item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            project_id INTEGER NOT NULL,
+            parent_item_id INTEGER,
+            name TEXT NOT NULL,
+            description TEXT,
+            due_date DATE,
+            is_completed INTEGER DEFAULT 0,
+            priority INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'To Do',
+            assigned_to_user_id INTEGER,
+            display_order INTEGER DEFAULT 0,
+            planned_hours REAL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            is_minimized INTEGER DEFAULT 0,
+            google_calendar_event_id TEXT,
+            FOREIGN KEY (project_id) REFERENCES projects(project_id) ON DELETE CASCADE,
+            FOREIGN KEY (parent_item_id) REFERENCES work_items(item_id) ON DELETE CASCADE,
+            FOREIGN KEY (assigned_to_user_id) REFERENCES users(user_id) ON DELETE SET NULL
+        )
+    """
+    )
+
+
+def _migration_1_sync_and_rollups(cursor):
+    """Item versions, the calendar outbox and stored roll-ups."""
+    _add_column(cursor, "work_items", "version", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(cursor, "work_items", "google_calendar_fingerprint", "TEXT")
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS calendar_outbox (
+            outbox_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            action TEXT NOT NULL,
+            item_id INTEGER,
+            event_id TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            claimed_until REAL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            last_error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+    )
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_calendar_outbox_due ON calendar_outbox (status, next_attempt_at)"""
+    )
+
+    added = [
+        _add_column(cursor, "work_items", "rolled_up_hours", "REAL NOT NULL DEFAULT 0"),
+        _add_column(
+            cursor, "work_items", "descendant_count", "INTEGER NOT NULL DEFAULT 0"
+        ),
+        _add_column(
+            cursor,
+            "work_items",
+            "completed_descendant_count",
+            "INTEGER NOT NULL DEFAULT 0",
+        ),
+        _add_column(cursor, "projects", "planned_hours", "REAL NOT NULL DEFAULT 0"),
+        _add_column(cursor, "projects", "task_count", "INTEGER NOT NULL DEFAULT 0"),
+        _add_column(
+            cursor, "projects", "completed_task_count", "INTEGER NOT NULL DEFAULT 0"
+        ),
+    ]
+    return any(added)
+
+
+def _migration_2_indexes_and_orphans(cursor):
+    """
+    Indexes for the work_items and projects access paths, and removal of the
+    subtasks left behind by deletes from before foreign keys were switched on.
+    """
+    orphaned = """
+        WITH RECURSIVE orphaned(item_id) AS (
+            SELECT item_id FROM work_items
+            WHERE project_id NOT IN (SELECT project_id FROM projects)
+            OR (parent_item_id IS NOT NULL AND parent_item_id NOT IN (SELECT item_id FROM work_items))
+            UNION
+            SELECT w.item_id FROM work_items w JOIN orphaned o ON w.parent_item_id = o.item_id
+        )
+        SELECT item_id FROM orphaned
+    """
+    cursor.execute(
+        f"""
+        INSERT INTO calendar_outbox (action, event_id, next_attempt_at)
+        SELECT 'delete', google_calendar_event_id, 0 FROM work_items
+        WHERE item_id IN ({orphaned}) AND google_calendar_event_id IS NOT NULL
+    """
+    )
+    cursor.execute(f"""DELETE FROM work_items WHERE item_id IN ({orphaned})""")
+
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_work_items_project_parent_order ON work_items (project_id, parent_item_id, display_order)"""
+    )
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_work_items_parent ON work_items (parent_item_id)"""
+    )
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_work_items_project_due_date ON work_items (project_id, due_date) WHERE due_date IS NOT NULL"""
+    )
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_projects_user_end_date ON projects (user_id, end_date)"""
+    )
+
+
+def _migration_3_remaining_hours(cursor):
+    """Stored remaining hours, so a collapsed branch's totals are known without loading it."""
+    return _add_column(
+        cursor, "work_items", "remaining_hours", "REAL NOT NULL DEFAULT 0"
+    )
+
+
+def _migration_4_project_revisions(cursor):
+    """A revision number on each project, bumped whenever it changes, for ETags."""
+    _add_column(cursor, "projects", "revision", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(cursor, "projects", "modified_at", "DATETIME")
+
+
+def _fts_table(cursor, fts_table, table, key):
+    """
+    An FTS5 index over a table's name and description that stores no text of
+    its own, kept up to date by triggers on the table.
+    """
+    cursor.execute(
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(name, description, content='{table}', content_rowid='{key}')"""
+    )
+    cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts_table} (rowid, name, description) VALUES (new.{key}, new.name, new.description);
+        END
+    """
+    )
+    cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts_table} ({fts_table}, rowid, name, description) VALUES ('delete', old.{key}, old.name, old.description);
+        END
+    """
+    )
+    cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_update AFTER UPDATE OF name, description ON {table} BEGIN
+            INSERT INTO {fts_table} ({fts_table}, rowid, name, description) VALUES ('delete', old.{key}, old.name, old.description);
+            INSERT INTO {fts_table} (rowid, name, description) VALUES (new.{key}, new.name, new.description);
+        END
+    """
+    )
+    cursor.execute(f"""INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')""")
+
+
+def _migration_5_search(cursor):
+    """Full-text search over the names and descriptions of projects and tasks."""
+    _fts_table(cursor, "work_items_fts", "work_items", "item_id")
+    _fts_table(cursor, "projects_fts", "projects", "project_id")
+
+
+def _migration_6_outbox_item_index(cursor):
+    """
+    An index for the check enqueue_item_sync makes for a pending entry of the
+    same item, which scanned every pending entry and made large imports slow.
+    """
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_calendar_outbox_item ON calendar_outbox (item_id, action, status)"""
+    )
+
+
+def _migration_7_login_index(cursor):
+    """An index on lowercased e-mail addresses, so logging in by e-mail is one indexed lookup."""
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_users_email_lower ON users (lower(email))"""
+    )
+
+
+def _migration_8_sessions(cursor):
+    """Server-side sessions, see sessions.py, with indexes for expiry and logging a user out everywhere."""
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE,
+            data TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """
+    )
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at)"""
+    )
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions (user_id)"""
+    )
+
+
+def _migration_9_project_sorts(cursor):
+    """
+    Each project's share of tasks completed, and an index for every way the
+    projects page can be sorted, see dashboard.py.
+    """
+    added = _add_column(cursor, "projects", "progress", "REAL NOT NULL DEFAULT 0")
+    cursor.execute("""DROP INDEX IF EXISTS idx_projects_user_end_date""")
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_projects_user_due ON projects (user_id, IFNULL(NULLIF(end_date, ''), '9999-12-31'))"""
+    )
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_projects_user_start ON projects (user_id, IFNULL(NULLIF(start_date, ''), '9999-12-31'))"""
+    )
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_projects_user_name ON projects (user_id, name COLLATE NOCASE)"""
+    )
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_projects_user_progress ON projects (user_id, progress)"""
+    )
+    return added
+
+
+def _migration_10_sort_keys(cursor):
+    """
+    Text sort keys for the order of subtasks, see ordering.py, given out in
+    the order display_order had them. display_order is no longer used.
+    """
+    _add_column(cursor, "work_items", "sort_key", "TEXT NOT NULL DEFAULT ''")
+    cursor.execute(
+        """
+        SELECT item_id, parent_item_id FROM work_items WHERE parent_item_id IS NOT NULL
+        ORDER BY parent_item_id, display_order, item_id
+    """
+    )
+    siblings = {}
+    for item_id, parent_item_id in cursor.fetchall():
+        siblings.setdefault(parent_item_id, []).append(item_id)
+    cursor.executemany(
+        """UPDATE work_items SET sort_key = ? WHERE item_id = ?""",
+        (
+            (sort_key, item_id)
+            for item_ids in siblings.values()
+            for sort_key, item_id in zip(
+                keys_between(None, None, len(item_ids)), item_ids
+            )
+        ),
+    )
+    cursor.execute("""DROP INDEX IF EXISTS idx_work_items_project_parent_order""")
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_work_items_project_parent_sort ON work_items (project_id, parent_item_id, sort_key)"""
+    )
+
+
+def _changed(columns):
+    """A trigger's WHEN condition for an UPDATE that changed any of `columns`."""
+    return " OR ".join(f"old.{column} IS NOT new.{column}" for column in columns)
+
+
+def _migration_11_change_log(cursor):
+    """
+    An append-only log of the changes to each project and its tasks, written
+    by triggers, and each project's snapshot_seq, the point its log has been
+    compacted up to. See changes.py.
+    """
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            project_id INTEGER NOT NULL,
+            item_id INTEGER,
+            kind TEXT NOT NULL,
+            changed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+    )
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_change_log_project_seq ON change_log (project_id, seq)"""
+    )
+    _add_column(cursor, "projects", "snapshot_seq", "INTEGER NOT NULL DEFAULT 0")
+
+    # Only the columns the task page shows, so writes nobody sees, like the
+    # calendar worker storing an event id, aren't sent to every client.
+    moved = _changed(["parent_item_id", "sort_key"])
+    edited = _changed(
+        [
+            "name",
+            "description",
+            "due_date",
+            "is_completed",
+            "is_minimized",
+            "planned_hours",
+            "version",
+            "rolled_up_hours",
+            "remaining_hours",
+            "descendant_count",
+            "completed_descendant_count",
+        ]
+    )
+    project_edited = _changed(
+        [
+            "name",
+            "description",
+            "start_date",
+            "end_date",
+            "planned_hours",
+            "task_count",
+            "completed_task_count",
+        ]
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS work_items_log_insert AFTER INSERT ON work_items BEGIN
+            INSERT INTO change_log (project_id, item_id, kind) VALUES (new.project_id, new.item_id, 'insert');
+        END
+    """
+    )
+    cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS work_items_log_move AFTER UPDATE ON work_items WHEN {moved} BEGIN
+            INSERT INTO change_log (project_id, item_id, kind) VALUES (new.project_id, new.item_id, 'move');
+        END
+    """
+    )
+    cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS work_items_log_update AFTER UPDATE ON work_items WHEN NOT ({moved}) AND ({edited}) BEGIN
+            INSERT INTO change_log (project_id, item_id, kind) VALUES (new.project_id, new.item_id, 'update');
+        END
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS work_items_log_delete AFTER DELETE ON work_items BEGIN
+            INSERT INTO change_log (project_id, item_id, kind) VALUES (old.project_id, old.item_id, 'delete');
+        END
+    """
+    )
+    cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS projects_log_update AFTER UPDATE ON projects WHEN {project_edited} BEGIN
+            INSERT INTO change_log (project_id, item_id, kind) VALUES (new.project_id, NULL, 'update');
+        END
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS projects_log_delete AFTER DELETE ON projects BEGIN
+            DELETE FROM change_log WHERE project_id = old.project_id;
+        END
+    """
+    )
+
+
+# A migration that has been released is never edited, databases past it
+# would never see the change. Schema changes always go in a new one at the
+# end, see tests/test_migrations.py.
+MIGRATIONS = [
+    _migration_1_sync_and_rollups,
+    _migration_2_indexes_and_orphans,
+    _migration_3_remaining_hours,
+    _migration_4_project_revisions,
+    _migration_5_search,
+    _migration_6_outbox_item_index,
+    _migration_7_login_index,
+    _migration_8_sessions,
+    _migration_9_project_sorts,
+    _migration_10_sort_keys,
+    _migration_11_change_log,
+]
+
+
+def migrate_database(db_path=DATABASE):
+    """
+    Applies every migration the database hasn't had yet, all in one
+    transaction. A migration returns True if it added stored roll-up columns,
+    they are filled in once the whole schema is in place.
+    """
+    conn = connect(db_path, isolation_level=None)
+    try:
+        # Lets readers carry on while a save is being written. Stored in the file.
+        conn.execute("PRAGMA journal_mode = WAL")
+        current_version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if current_version == len(MIGRATIONS):
+            return
+        conn.execute("BEGIN")
+        number = current_version
+        try:
+            cursor = conn.cursor()
+            if current_version == 0:
+                _create_base_tables(cursor)
+            needs_rebuild = False
+            for number, migration in enumerate(MIGRATIONS, start=1):
+                if number > current_version:
+                    needs_rebuild = migration(cursor) or needs_rebuild
+            if needs_rebuild:
+                rebuild_rollups(cursor)
+            conn.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            conn.execute("ROLLBACK")
+            print(f"Database error in migration {number}: {e}")
+            raise
+    finally:
+        conn.close()
+
+
+# The queries behind the task page, saving, the calendar and the projects page,
+# the same SQL the code runs. check_query_plans fails if any of them has to
+# scan a whole table, see tests/test_query_plans.py.
+HOT_QUERIES = {
+    "tasks": (PROJECT_TASKS_SQL, (1,)),
+    "child page": (CHILD_PAGE_SQL, (1, 1, 100, 0)),
+    "sort key bounds": (sort_key_bound_sql("before", 1), (1, 1, "V", 2)),
+    "subtree": (
+        f"""SELECT item_id FROM work_items WHERE item_id IN ({_subtree_ids([1])})""",
+        (1, 1),
+    ),
+    "ancestors": (
+        f"""SELECT item_id FROM work_items WHERE item_id IN ({_ancestor_ids()})""",
+        (1, 1),
+    ),
+    "rename project root": (RENAME_PROJECT_ROOT_SQL, ("P", "", 1)),
+    "save owner check": (PROJECT_OWNER_SQL, (1, 1)),
+    "calendar": (dated_items_sql(), (1, "2026-01-01", "2026-02-01", 500)),
+    "project calendar": (
+        dated_items_sql(one_project=True),
+        (1, "2026-01-01", "2026-02-01", 1, 500),
+    ),
+    "login": (LOGIN_USER_SQL, ("bob", "bob@example.com")),
+    "session": (OPEN_SESSION_SQL, ("abc", 0)),
+    "session sweep": (SWEEP_SESSIONS_SQL, (0,)),
+    "latest change": (LATEST_CHANGE_SQL, (1, 1)),
+    "change feed": (CHANGE_FEED_SQL, (1, 0, 501)),
+    "search match count": (TASK_MATCH_COUNT_SQL, ('"task"*', 1, 5001)),
+    "search": (task_hits_sql(), ('"task"*', 1, 21, 0)),
+    "search newest first": (task_hits_sql(ranked=False), ('"task"*', 1, 21, 0)),
+    "calendar outbox entry": (
+        ENQUEUE_ITEM_SYNC_SQL,
+        ("sync", 1, 0, "sync", 1),
+    ),
+    "calendar outbox": (DUE_ROWS_SQL, (0, 0, 50)),
+}
+
+
+def _projects_page(sort):
+    sql, params = project_page_query(
+        sort, after=next_page_token({"sort_key": "", "project_id": 1})
+    )
+    return sql, dict(params, user_id=1, limit=26)
+
+
+HOT_QUERIES.update(
+    {f"projects page by {sort}": _projects_page(sort) for sort in PROJECT_SORTS}
+)
+
+TABLES = {
+    "users",
+    "projects",
+    "work_items",
+    "calendar_outbox",
+    "sessions",
+    "change_log",
+}
+
+
+def check_query_plans(db_path=DATABASE):
+    """
+    Runs EXPLAIN QUERY PLAN on every hot query and returns a list of
+    (query name, plan line) for each full table scan found.
+    """
+    conn = connect(db_path)
+    problems = []
+    try:
+        for name, (sql, params) in HOT_QUERIES.items():
+            for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params):
+                words = row["detail"].split()
+                if words[0] == "SCAN" and words[1] in TABLES:
+                    problems.append((name, row["detail"]))
+    finally:
+        conn.close()
+    return problems
+
+
+if __name__ == "__main__":
+    # python schema.py [path]: migrate the database, then check the hot query plans.
+    database_file = sys.argv[1] if len(sys.argv) > 1 else DATABASE
+    migrate_database(database_file)
+    problems = check_query_plans(database_file)
+    for name, detail in problems:
+        print(f"{name}: {detail}")
+    if problems:
+        sys.exit(1)
+    print("No full table scans in the hot queries.")
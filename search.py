@@ -0,0 +1,159 @@
+from markupsafe import Markup, escape
+
+# Searching uses the FTS5 tables created by migration 5 in schema.py, which
+# triggers keep in step with the projects and work_items tables.
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_RANK_LIMIT = 5000
+
+# Unlikely to be typed, so the snippet can be escaped before they become <mark>s.
+_MATCH_START = "\x02"
+_MATCH_END = "\x03"
+_SNIPPET = f"'{_MATCH_START}', '{_MATCH_END}', '...', 12"
+
+
+def fts_query(text):
+    """
+    Turns what the user typed into an FTS5 query that matches every word as a
+    prefix, so punctuation or stray quotes can never make it a syntax error.
+    Returns None if there is nothing to search for.
+    """
+    words = [word.replace('"', '""') for word in text.split()]
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def highlight(snippet):
+    """An FTS5 snippet as safe HTML, with the matched words in <mark> tags."""
+    return Markup(
+        str(escape(snippet))
+        .replace(_MATCH_START, "<mark>")
+        .replace(_MATCH_END, "</mark>")
+    )
+
+
+def search(cursor, user_id, text, page=1, page_size=SEARCH_PAGE_SIZE):
+    """
+    The user's projects and tasks matching `text`: projects first, then tasks,
+    each best first. Returns (hits, has_more). Each task hit carries the names
+    of the tasks above it.
+    """
+    query = fts_query(text)
+    if query is None:
+        return [], False
+
+    first = (page - 1) * page_size
+    # One extra row tells us whether there is another page.
+    wanted = page_size + 1
+    # A user has few enough projects to always rank all of their matches.
+    hits = _project_hits(cursor, user_id, query)[first : first + wanted]
+    if len(hits) < wanted:
+        hits += _task_hits(
+            cursor,
+            user_id,
+            query,
+            limit=wanted - len(hits),
+            offset=max(first - _project_match_count(cursor, user_id, query), 0),
+        )
+    has_more = len(hits) > page_size
+    hits = hits[:page_size]
+
+    item_ids = [hit["item_id"] for hit in hits if hit["kind"] == "task"]
+    paths = _ancestor_names(cursor, item_ids)
+    for hit in hits:
+        hit["path"] = paths.get(hit["item_id"], [])
+        hit["snippet"] = highlight(hit["snippet"])
+    return hits, has_more
+
+
+def _project_hits(cursor, user_id, query):
+    cursor.execute(
+        f"""
+        SELECT 'project' AS kind, p.project_id, NULL AS item_id, p.name, p.name AS project_name,
+               snippet(projects_fts, -1, {_SNIPPET}) AS snippet
+        FROM projects_fts JOIN projects p ON p.project_id = projects_fts.rowid
+        WHERE projects_fts MATCH ? AND p.user_id = ?
+        ORDER BY projects_fts.rank
+    """,
+        (query, user_id),
+    )
+    return [dict(row) for row in cursor.fetchall()]
+
+
+def _project_match_count(cursor, user_id, query):
+    cursor.execute(
+        """
+        SELECT COUNT(*) FROM projects_fts JOIN projects p ON p.project_id = projects_fts.rowid
+        WHERE projects_fts MATCH ? AND p.user_id = ?
+    """,
+        (query, user_id),
+    )
+    return cursor.fetchone()[0]
+
+
+def _task_hits(cursor, user_id, query, limit, offset):
+    # bm25 has to score every match before the best can be picked, which gets
+    # slow for a word in most tasks. Past SEARCH_RANK_LIMIT matches a ranking
+    # says little anyway, so the newest tasks are shown first instead, which
+    # FTS5 can read in order and stop after one page.
+    cursor.execute(TASK_MATCH_COUNT_SQL, (query, user_id, SEARCH_RANK_LIMIT + 1))
+    ranked = cursor.fetchone()[0] <= SEARCH_RANK_LIMIT
+    cursor.execute(task_hits_sql(ranked), (query, user_id, limit, offset))
+    return [dict(row) for row in cursor.fetchall()]
+
+
+# The user's task matches, counted up to a limit. Shared with HOT_QUERIES in
+# schema.py, whose query plans are checked.
+TASK_MATCH_COUNT_SQL = """
+    SELECT COUNT(*) FROM (
+        SELECT work_items_fts.rowid FROM work_items_fts
+        JOIN work_items w ON w.item_id = work_items_fts.rowid
+        JOIN projects p ON p.project_id = w.project_id
+        WHERE work_items_fts MATCH ? AND p.user_id = ? AND w.parent_item_id IS NOT NULL
+        LIMIT ?
+    )
+"""
+
+
+def task_hits_sql(ranked=True):
+    """The query for a page of task hits, best first or, if not `ranked`, newest first."""
+    order = "work_items_fts.rank" if ranked else "work_items_fts.rowid DESC"
+    # The project's root item repeats the project's name and description, so
+    # it is left to the project's own hit.
+    return f"""
+        SELECT 'task' AS kind, w.project_id, w.item_id, w.name, p.name AS project_name,
+               snippet(work_items_fts, -1, {_SNIPPET}) AS snippet
+        FROM work_items_fts
+        JOIN work_items w ON w.item_id = work_items_fts.rowid
+        JOIN projects p ON p.project_id = w.project_id
+        WHERE work_items_fts MATCH ? AND p.user_id = ? AND w.parent_item_id IS NOT NULL
+        ORDER BY {order}
+        LIMIT ? OFFSET ?
+    """
+
+
+def _ancestor_names(cursor, item_ids):
+    """item id -> names of the tasks above it, top first, not counting the project's root."""
+    if not item_ids:
+        return {}
+    placeholders = ",".join(["?"] * len(item_ids))
+    cursor.execute(
+        f"""
+        WITH RECURSIVE path(hit_id, parent_item_id, depth) AS (
+            SELECT item_id, parent_item_id, 0 FROM work_items WHERE item_id IN ({placeholders})
+            UNION ALL
+            SELECT p.hit_id, w.parent_item_id, p.depth + 1
+            FROM path p JOIN work_items w ON w.item_id = p.parent_item_id
+            WHERE w.parent_item_id IS NOT NULL
+        )
+        SELECT p.hit_id, w.name FROM path p JOIN work_items w ON w.item_id = p.parent_item_id
+        WHERE w.parent_item_id IS NOT NULL
+        ORDER BY p.hit_id, p.depth DESC
+    """,
+        item_ids,
+    )
+    paths = {}
+    for row in cursor.fetchall():
+        paths.setdefault(row["hit_id"], []).append(row["name"])
+    return paths
@@ -0,0 +1,175 @@
+import secrets
+import threading
+import time
+import traceback
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from werkzeug.datastructures import CallbackDict
+
+from database import DATABASE, connect, get_pool
+
+# Sessions kept in the sessions table of the LifeMap database, so every worker
+# on every host sees the same ones. Only a random session id goes in the
+# cookie. A session expires once it has gone unused for PERMANENT_SESSION_LIFETIME
+# (31 days by default), and SessionSweeper deletes expired rows through the
+# index on expires_at.
+#
+# The logged-in user's profile is read with the session in the same query, see
+# load_user in help.py.
+
+SWEEP_INTERVAL_SECONDS = 15 * 60
+
+OPEN_SESSION_SQL = """
+    SELECT s.data, s.expires_at, u.user_id, u.username, u.email
+    FROM sessions s LEFT JOIN users u ON u.user_id = s.user_id
+    WHERE s.session_id = ? AND s.expires_at > ?
+"""
+SWEEP_SESSIONS_SQL = """DELETE FROM sessions WHERE expires_at <= ?"""
+
+
+class SQLiteSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, session_id=None, expires_at=None, user=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.session_id = session_id
+        self.expires_at = expires_at
+        # {"user_id", "username", "email"} of the session's user when it was loaded.
+        self.user = user
+        self.modified = False
+        # Set by clear(), e.g. on login and logout, so the next contents get a
+        # new id and an old id someone else may know is never logged in.
+        self.regenerate = False
+
+    def clear(self):
+        super().clear()
+        self.regenerate = True
+
+
+class SQLiteSessionInterface(SessionInterface):
+    serializer = session_json_serializer
+
+    def __init__(self, db_path=DATABASE):
+        self.db_path = db_path
+
+    def open_session(self, app, request):
+        session_id = request.cookies.get(self.get_cookie_name(app))
+        if not session_id:
+            return SQLiteSession()
+        pool = get_pool(self.db_path, readonly=True)
+        conn = pool.acquire()
+        try:
+            row = conn.execute(OPEN_SESSION_SQL, (session_id, time.time())).fetchone()
+        finally:
+            pool.release(conn)
+        if row is None:
+            return SQLiteSession()
+        user = None
+        if row["user_id"] is not None:
+            user = {
+                "user_id": row["user_id"],
+                "username": row["username"],
+                "email": row["email"],
+            }
+        return SQLiteSession(
+            self.serializer.loads(row["data"]), session_id, row["expires_at"], user
+        )
+
+    def save_session(self, app, session, response):
+        now = time.time()
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        old_session_id = session.session_id
+        if session.regenerate or not session:
+            session.session_id = None
+
+        # An unchanged session is only written again once half its lifetime
+        # has gone, to push its expiry back.
+        stale = session.expires_at is None or session.expires_at - now < lifetime / 2
+        writing = bool(session) and (
+            session.session_id is None or session.modified or stale
+        )
+        if old_session_id == session.session_id and not writing:
+            return
+
+        if session.session_id is None and session:
+            session.session_id = secrets.token_urlsafe(32)
+        pool = get_pool(self.db_path)
+        conn = pool.acquire()
+        try:
+            if old_session_id and old_session_id != session.session_id:
+                conn.execute(
+                    """DELETE FROM sessions WHERE session_id = ?""", (old_session_id,)
+                )
+            if writing:
+                session.expires_at = now + lifetime
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO sessions (session_id, user_id, data, expires_at)
+                    VALUES (?, ?, ?, ?)
+                """,
+                    (
+                        session.session_id,
+                        session.get("user_id"),
+                        self.serializer.dumps(dict(session)),
+                        session.expires_at,
+                    ),
+                )
+            conn.commit()
+        finally:
+            pool.release(conn)
+
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.session_id is None:
+            response.delete_cookie(name, domain=domain, path=path)
+        elif session.session_id != old_session_id or session.permanent:
+            response.set_cookie(
+                name,
+                session.session_id,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+    def end_user_sessions(self, cursor, user_id, keep_session_id=None):
+        """Logs the user out everywhere else, e.g. after a password change."""
+        cursor.execute(
+            """DELETE FROM sessions WHERE user_id = ? AND session_id IS NOT ?""",
+            (user_id, keep_session_id),
+        )
+
+
+def sweep_sessions(conn):
+    """Deletes every expired session. Returns how many there were."""
+    cursor = conn.execute(SWEEP_SESSIONS_SQL, (time.time(),))
+    conn.commit()
+    return cursor.rowcount
+
+
+class SessionSweeper(threading.Thread):
+    """Background thread that deletes expired sessions every `interval` seconds."""
+
+    def __init__(self, db_path=DATABASE, interval=SWEEP_INTERVAL_SECONDS):
+        super().__init__(name="session-sweeper", daemon=True)
+        self.db_path = db_path
+        self.interval = interval
+        self._stopping = threading.Event()
+
+    def stop(self):
+        self._stopping.set()
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                conn = connect(self.db_path)
+                try:
+                    sweep_sessions(conn)
+                finally:
+                    conn.close()
+            except Exception:
+                traceback.print_exc()
+            self._stopping.wait(self.interval)
@@ -5,6 +5,10 @@ document.addEventListener('DOMContentLoaded', function() {
     // =========================================================================
     let newItemIdCounter = 0;
     const deletedItemIds = new Set();
+    // Ids of the cards that were added, edited or moved since the last save.
+    const dirtyItemIds = new Set();
+    // Saved cards moved next to or under unsaved ones, placed by the next save.
+    const placedItemIds = new Set();
     const MAX_SUBTASK_LEVEL = 6;
 
     // =========================================================================
@@ -13,7 +17,7 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // --- Core Event Handlers & Logic ---
 
-    function handleAddSubtask(button) {
+    async function handleAddSubtask(button) {
         const parentId = button.dataset.parentId;
         if (!parentId) {
             console.error("Button is missing a data-parent-id attribute:", button);
@@ -33,6 +37,13 @@ document.addEventListener('DOMContentLoaded', function() {
             return;
         }
         
+        // Open the parent first so the new subtask goes after its loaded siblings.
+        const parentToggleBtn = parentCard.querySelector(':scope > .card-body > .task-header .toggle-subtasks-btn');
+        if (parentToggleBtn && isMinimized(parentCard)) {
+            await handleMinimizeToggle(parentToggleBtn);
+        }
+        await loadChildren(parentCard);
+
         const newId = `new-${++newItemIdCounter}`;
         const newSubtaskHtml = generateTaskHtml(newId, parentId, newLevel);
         
@@ -45,16 +56,12 @@ document.addEventListener('DOMContentLoaded', function() {
         }
 
         subtaskList.insertAdjacentHTML('beforeend', newSubtaskHtml);
+        dirtyItemIds.add(newId);
 
         if (parentLevel > 0) {
             updateParentHours(parentCard);
         }
         updateRemainingHours();
-
-        if (subtaskList.classList.contains('subtask-list-collapsed')) {
-            const toggleBtn = parentCard.querySelector('.toggle-subtasks-btn');
-            if (toggleBtn) handleMinimizeToggle(toggleBtn);
-        }
     }
 
     function handleDeleteTask(button) {
@@ -69,10 +76,14 @@ document.addEventListener('DOMContentLoaded', function() {
             }
             // --- CORRECTED LOGIC ENDS HERE ---
 
-            const itemId = cardToDelete.dataset.itemId;
-            if (!itemId.startsWith('new-')) {
-                deletedItemIds.add(itemId);
-            }
+            // The whole subtree goes with the card, so its subtasks are deleted too.
+            [cardToDelete, ...cardToDelete.querySelectorAll('.card[data-item-id]')].forEach(card => {
+                const itemId = card.dataset.itemId;
+                dirtyItemIds.delete(itemId);
+                if (!itemId.startsWith('new-')) {
+                    deletedItemIds.add(itemId);
+                }
+            });
             
             cardToDelete.remove();
 
@@ -88,6 +99,7 @@ document.addEventListener('DOMContentLoaded', function() {
         if (!taskCard) return;
         const isCompleted = checkbox.checked;
         applyCompletionStyles(taskCard, isCompleted);
+        markDirty(taskCard);
 
         if (isCompleted) {
             propagateCompletionDownwards(taskCard.querySelector('.subtask-list'), true);
@@ -97,24 +109,85 @@ document.addEventListener('DOMContentLoaded', function() {
         updateRemainingHours();
     }
 
-    function handleMinimizeToggle(button) {
+    async function handleMinimizeToggle(button) {
         const taskCard = button.closest('.card');
         const taskOptions = taskCard.querySelector(':scope > .card-body > .task-options');
         const collapseIcon = button.querySelector('.collapse-icon');
         taskOptions.classList.toggle('task-options-minimized');
         const isMinimized = taskOptions.classList.contains('task-options-minimized');
         collapseIcon.innerHTML = isMinimized ? '&#9650;' : '&#9660;';
+        markDirty(taskCard);
+
+        // A minimized task hides its subtasks, which are only fetched once it is opened.
+        const subtaskList = taskCard.querySelector(':scope > .card-body > .subtask-list');
+        if (subtaskList) subtaskList.classList.toggle('subtask-list-collapsed', isMinimized);
+        if (!isMinimized) {
+            await loadChildren(taskCard);
+        }
 
         if (isMinimized) {
             taskCard.querySelectorAll('.subtask-list .card').forEach(subtaskCard => {
                 const subtaskOptions = subtaskCard.querySelector(':scope > .card-body > .task-options');
-                if (subtaskOptions) subtaskOptions.classList.add('task-options-minimized');
+                if (subtaskOptions && !subtaskOptions.classList.contains('task-options-minimized')) {
+                    subtaskOptions.classList.add('task-options-minimized');
+                    markDirty(subtaskCard);
+                }
                 const subtaskCollapseIcon = subtaskCard.querySelector('.toggle-subtasks-btn .collapse-icon');
                 if (subtaskCollapseIcon) subtaskCollapseIcon.innerHTML = '&#9650;';
+                const nestedSubtaskList = subtaskCard.querySelector(':scope > .card-body > .subtask-list');
+                if (nestedSubtaskList) nestedSubtaskList.classList.add('subtask-list-collapsed');
             });
         }
     }
     
+    function isMinimized(card) {
+        const taskOptions = card.querySelector(':scope > .card-body > .task-options');
+        return taskOptions.classList.contains('task-options-minimized');
+    }
+
+    // --- Lazy Loading ---
+
+    // Fetches a task's subtasks page by page and adds their cards, then does the
+    // same for any of them that are expanded. Does nothing if they're already loaded.
+    async function loadChildren(card) {
+        if (card.dataset.childrenLoaded !== 'false' || card.dataset.loading) return;
+        card.dataset.loading = 'true';
+        try {
+            let subtaskList = card.querySelector(':scope > .card-body > .subtask-list');
+            if (!subtaskList) {
+                subtaskList = document.createElement('div');
+                subtaskList.className = 'subtask-list';
+                card.querySelector('.card-body').appendChild(subtaskList);
+                initSortable(subtaskList);
+            }
+
+            let offset = 0;
+            while (offset !== null) {
+                const response = await fetch(`/api/items/${card.dataset.itemId}/children?offset=${offset}`);
+                const result = await response.json();
+                if (!response.ok) {
+                    showAlert(`Failed to load subtasks: ${result.error || 'Unknown error'}`);
+                    return;
+                }
+                subtaskList.insertAdjacentHTML('beforeend', result.html);
+                offset = result.next_offset;
+            }
+            card.dataset.childrenLoaded = 'true';
+
+            const loadedCards = Array.from(subtaskList.querySelectorAll(':scope > .card'));
+            loadedCards.forEach(subtaskCard => {
+                applyCompletionStyles(subtaskCard, subtaskCard.querySelector('.completed-checkbox').checked);
+            });
+            await Promise.all(loadedCards.filter(c => !isMinimized(c)).map(loadChildren));
+            updateParentHours(card);
+            updateRemainingHours();
+        } catch (error) {
+            showAlert('Error loading subtasks. Please check your connection.');
+        } finally {
+            delete card.dataset.loading;
+        }
+    }
+
     // --- Calculation & Update Functions ---
 
     function updateParentHours(parentCard) {
@@ -127,13 +200,19 @@ document.addEventListener('DOMContentLoaded', function() {
         const subtaskList = parentCard.querySelector(':scope > .card-body > .subtask-list');
         const hasSubtasks = subtaskList && subtaskList.querySelector(':scope > .card');
 
-        if (hasSubtasks) {
+        if (parentCard.dataset.childrenLoaded === 'false') {
+            // Not loaded yet, the server's rolled-up total is already in the input.
+            parentHourInput.readOnly = true;
+        } else if (hasSubtasks) {
             subtaskList.querySelectorAll(':scope > .card').forEach(subtask => {
                 const subtaskHourInput = subtask.querySelector('input[id^="planned_hours_"]');
                 if (subtaskHourInput) {
                     totalSubtaskHours += parseFloat(subtaskHourInput.value) || 0;
                 }
             });
+            if ((parseFloat(parentHourInput.value) || 0) !== parseFloat(totalSubtaskHours.toFixed(1))) {
+                markDirty(parentCard);
+            }
             parentHourInput.value = totalSubtaskHours.toFixed(1);
             parentHourInput.readOnly = true;
         } else {
@@ -167,7 +246,13 @@ document.addEventListener('DOMContentLoaded', function() {
             // in this calculation to prevent double-counting.
             const hasSubtasks = card.querySelector('.subtask-list .card');
 
-            if (!hasSubtasks) {
+            if (card.dataset.childrenLoaded === 'false') {
+                // Its subtasks aren't on the page, so use the server's totals for them.
+                totalHours += parseFloat(card.dataset.rolledUpHours) || 0;
+                if (!card.classList.contains('completed-task')) {
+                    remainingHours += parseFloat(card.dataset.remainingHours) || 0;
+                }
+            } else if (!hasSubtasks) {
                 const hourInput = card.querySelector('input[id^="planned_hours_"]');
                 if (hourInput) {
                     const value = parseFloat(hourInput.value);
@@ -196,30 +281,86 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
-    // --- Data Collection & Submission ---
+    // --- Change Tracking, Data Collection & Submission ---
+
+    function markDirty(card) {
+        if (card && parseInt(card.dataset.level, 10) > 0) {
+            dirtyItemIds.add(card.dataset.itemId);
+        }
+    }
 
-    function collectTaskData(container) {
+    function isNewId(itemId) {
+        return String(itemId).startsWith('new-');
+    }
+
+    function collectTaskFields(card) {
+        const fields = {
+            item_id: card.dataset.itemId,
+            parent_item_id: card.dataset.parentItemId || null,
+            version: parseInt(card.dataset.version, 10) || 0,
+            name: card.querySelector(`input[id^="name_"]`).value,
+            description: card.querySelector(`textarea[id^="description_"]`).value,
+            due_date: card.querySelector(`input[id^="due_date_"]`).value || null,
+            is_completed: card.querySelector(`input[id^="is_completed_"]`).checked,
+            is_minimized: card.querySelector('.task-options').classList.contains('task-options-minimized'),
+            planned_hours: card.querySelector(`input[id^="planned_hours_"]`).value || null
+        };
+        // New and placed cards say which card they go in front of, null for the last one.
+        if (isNewId(card.dataset.itemId) || placedItemIds.has(card.dataset.itemId)) {
+            const next = card.nextElementSibling;
+            fields.before_item_id = next && next.matches('.card') ? next.dataset.itemId : null;
+        }
+        return fields;
+    }
+
+    function collectChangedTasks() {
+        // Walk the cards in document order so parents are sent before their subtasks.
         const items = [];
-        container.querySelectorAll(':scope > .card').forEach((card, index) => {
-            if (parseInt(card.dataset.level, 10) > 0) {
-                const subtaskListContainer = card.querySelector('.subtask-list');
-                items.push({
-                    item_id: card.dataset.itemId,
-                    parent_item_id: card.dataset.parentItemId || null,
-                    name: card.querySelector(`input[id^="name_"]`).value,
-                    description: card.querySelector(`textarea[id^="description_"]`).value,
-                    due_date: card.querySelector(`input[id^="due_date_"]`).value || null,
-                    is_completed: card.querySelector(`input[id^="is_completed_"]`).checked,
-                    is_minimized: card.querySelector('.task-options').classList.contains('task-options-minimized'),
-                    planned_hours: card.querySelector(`input[id^="planned_hours_"]`).value || null,
-                    display_order: index,
-                    subtasks: subtaskListContainer ? collectTaskData(subtaskListContainer) : []
-                });
+        document.querySelectorAll('.card[data-item-id]').forEach(card => {
+            if (dirtyItemIds.has(card.dataset.itemId)) {
+                items.push(collectTaskFields(card));
             }
         });
         return items;
     }
 
+    // Updates the page with what the server saved instead of reloading it.
+    function applySaveResult(result) {
+        Object.entries(result.new_ids_map).forEach(([clientId, itemId]) => {
+            const card = document.querySelector(`.card[data-item-id="${clientId}"]`);
+            if (!card) return;
+            const oldHtmlId = clientId.replace(/[.-]/g, '_');
+            card.dataset.itemId = itemId;
+            card.querySelectorAll(`[id$="_${oldHtmlId}"], [for$="_${oldHtmlId}"]`).forEach(el => {
+                ['id', 'name', 'for'].forEach(attr => {
+                    const value = el.getAttribute(attr);
+                    if (value && value.endsWith(`_${oldHtmlId}`)) {
+                        el.setAttribute(attr, value.slice(0, -oldHtmlId.length) + itemId);
+                    }
+                });
+            });
+            document.querySelectorAll(`[data-parent-item-id="${clientId}"]`).forEach(el => {
+                el.dataset.parentItemId = itemId;
+            });
+            document.querySelectorAll(`[data-parent-id="${clientId}"]`).forEach(el => {
+                el.dataset.parentId = itemId;
+            });
+        });
+
+        result.items.forEach(item => {
+            const card = document.querySelector(`.card[data-item-id="${item.item_id}"]`);
+            if (!card) return;
+            card.dataset.version = item.version;
+            card.dataset.childCount = item.child_count;
+            card.dataset.rolledUpHours = item.rolled_up_hours;
+            card.dataset.remainingHours = item.remaining_hours;
+        });
+
+        dirtyItemIds.clear();
+        deletedItemIds.clear();
+        placedItemIds.clear();
+    }
+
     // Made use of Gemini for this function, helped me debug an error where the parent task was misidentified.
     async function handleFormSubmit(event) {
         event.preventDefault();
@@ -245,10 +386,9 @@ document.addEventListener('DOMContentLoaded', function() {
 
         if (!isDataValid) return;   
 
-        const startContainer = document.querySelector('.card[data-level="0"] .subtask-list');
         const payload = {
             project_id: document.getElementById('project_id').value,
-            tasks: startContainer ? collectTaskData(startContainer) : [],
+            changes: collectChangedTasks(),
             deleted_item_ids: Array.from(deletedItemIds)
         };
 
@@ -262,7 +402,14 @@ document.addEventListener('DOMContentLoaded', function() {
             });
             const result = await response.json();
             if (response.ok) {
-                window.location.reload();
+                applySaveResult(result);
+                showAlert(result.message);
+            } else if (result.conflicts) {
+                const names = result.conflicts.map(c => `"${c.name}"`);
+                showAlert(`Not saved: ${names.join(', ')} changed elsewhere since this page was loaded. Reload to see the latest version.`);
+            } else if (result.violations) {
+                const problems = result.violations.map(v => `"${v.name}": ${v.message}`);
+                showAlert(`Failed to save tasks. ${problems.join(' ')}`);
             } else {
                 showAlert(`Failed to save tasks: ${result.error || 'Unknown error'}`);
             }
@@ -285,6 +432,7 @@ document.addEventListener('DOMContentLoaded', function() {
         });
 
         container.addEventListener('change', function(event) {
+            markDirty(event.target.closest('.card'));
             if (event.target.matches('.completed-checkbox')) {
                 handleCompletionChange(event.target);
             }
@@ -294,6 +442,7 @@ document.addEventListener('DOMContentLoaded', function() {
         });
 
         container.addEventListener('input', function(event) {
+            markDirty(event.target.closest('.card'));
             if (event.target.matches('input[id^="planned_hours_"]')) {
                 const parentCard = event.target.closest('.subtask-list')?.closest('.card');
                 if (parentCard && parseInt(parentCard.dataset.level, 10) > 0) {
@@ -308,7 +457,7 @@ document.addEventListener('DOMContentLoaded', function() {
         const htmlId = itemId.replace(/[.-]/g, '_');
         const addBtn = level < MAX_SUBTASK_LEVEL ? `<button type="button" class="btn btn-sm btn-outline-primary add-subtask-btn" data-parent-id="${itemId}"><i class="fa-solid fa-plus"></i></button>` : '';
         return `
-        <div class="card subtask-level-${level} mb-1" data-item-id="${itemId}" data-parent-item-id="${parentItemId}" data-level="${level}">
+        <div class="card subtask-level-${level} mb-1" data-item-id="${itemId}" data-parent-item-id="${parentItemId}" data-level="${level}" data-version="0" data-child-count="0" data-children-loaded="true">
             <div class="card-body">
                 <div class="task-header">
                     <span class="drag-handle"><i class="fa-solid fa-grip-vertical"></i></span>
@@ -369,10 +518,78 @@ document.addEventListener('DOMContentLoaded', function() {
                 if (newParentCard && newParentCard !== oldParentCard) {
                     updateParentHours(newParentCard);
                 }
+            },
+            onEnd: function (evt) {
+                if (evt.from === evt.to && evt.oldIndex === evt.newIndex) return;
+                const card = evt.item;
+                if (isNewId(card.dataset.itemId) || isNewId(card.dataset.parentItemId)) {
+                    // Not saved yet, so its place goes with the next save.
+                    placedItemIds.add(card.dataset.itemId);
+                    markDirty(card);
+                    return;
+                }
+                moveTask(card, evt);
             }
         });
     }
 
+    // Saves a dragged card's new place straight away, only its own row is written.
+    async function moveTask(card, evt) {
+        const siblings = Array.from(card.parentElement.querySelectorAll(':scope > .card'));
+        const index = siblings.indexOf(card);
+        const isSaved = sibling => !isNewId(sibling.dataset.itemId);
+        const before = siblings.slice(index + 1).find(isSaved);
+        const after = siblings.slice(0, index).reverse().find(isSaved);
+        const body = {
+            parent_item_id: card.dataset.parentItemId,
+            version: parseInt(card.dataset.version, 10) || 0
+        };
+        if (before) {
+            body.before_item_id = before.dataset.itemId;
+        } else if (after) {
+            body.after_item_id = after.dataset.itemId;
+        }
+
+        try {
+            const response = await fetch(`/api/items/${card.dataset.itemId}/move`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(body)
+            });
+            const result = await response.json();
+            if (response.ok) {
+                card.dataset.version = result.version;
+                placedItemIds.delete(card.dataset.itemId);
+                return;
+            }
+            if (result.conflicts) {
+                showAlert('Not moved: the task changed elsewhere since this page was loaded. Reload to see the latest version.');
+            } else if (result.violations) {
+                const problems = result.violations.map(v => `"${v.name}": ${v.message}`);
+                showAlert(`Not moved. ${problems.join(' ')}`);
+            } else {
+                showAlert(`Not moved: ${result.error || 'Unknown error'}`);
+            }
+        } catch (error) {
+            showAlert('Error moving task. Please check your connection.');
+        }
+        undoMove(card, evt);
+    }
+
+    function undoMove(card, evt) {
+        const newParentCard = evt.to.closest('.card');
+        const oldParentCard = evt.from.closest('.card');
+        card.remove();
+        evt.from.insertBefore(card, evt.from.children[evt.oldIndex] || null);
+        card.dataset.parentItemId = oldParentCard ? oldParentCard.dataset.itemId : '';
+        if (newParentCard && newParentCard !== oldParentCard) {
+            updateParentHours(newParentCard);
+        }
+        if (oldParentCard) {
+            updateParentHours(oldParentCard);
+        }
+    }
+
     function showAlert(message) {
         const alertBox = document.getElementById('alertMessage');
         alertBox.textContent = message;
@@ -393,6 +610,7 @@ document.addEventListener('DOMContentLoaded', function() {
             if (checkbox && checkbox.checked !== isCompleted) {
                 checkbox.checked = isCompleted;
                 applyCompletionStyles(subtaskCard, isCompleted);
+                markDirty(subtaskCard);
             }
             const nestedSubtaskList = subtaskCard.querySelector('.subtask-list');
             if (nestedSubtaskList) {
@@ -413,6 +631,7 @@ document.addEventListener('DOMContentLoaded', function() {
         if (parentCheckbox && parentCheckbox.checked) {
             parentCheckbox.checked = false;
             applyCompletionStyles(parentCard, false);
+            markDirty(parentCard);
             propagateUncompletionUpwards(parentCard);
         }
     }
@@ -0,0 +1,62 @@
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app.py migrates and opens the database LIFEMAP_DATABASE names as soon as it
+# is imported, so the tests point it at a file of their own first.
+os.environ["LIFEMAP_DATABASE"] = os.path.join(tempfile.mkdtemp(), "LifeMap.db")
+
+from calendar_sync import FakeCalendarClient
+from database import connect
+from schema import migrate_database
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """A brand new, fully migrated database file."""
+    path = str(tmp_path / "LifeMap.db")
+    migrate_database(path)
+    return path
+
+
+@pytest.fixture
+def conn(db_path):
+    conn = connect(db_path)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture(scope="session")
+def app():
+    """The Flask app, its calendar worker stopped and given a FakeCalendarClient."""
+    import app as lifemap
+
+    lifemap.calendar_worker.stop()
+    lifemap.calendar_worker.client = FakeCalendarClient()
+    return lifemap.app
+
+
+_usernames = itertools.count(1)
+
+
+@pytest.fixture
+def client(app):
+    """A test client logged in as a user of its own."""
+    username = f"user{next(_usernames)}"
+    client = app.test_client()
+    client.post(
+        "/register",
+        data={
+            "username": username,
+            "email": f"{username}@example.com",
+            "password": "Passw0rdX",
+            "confirmation": "Passw0rdX",
+        },
+    )
+    client.post("/login", data={"username-or-email": username, "password": "Passw0rdX"})
+    return client
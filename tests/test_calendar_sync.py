@@ -0,0 +1,234 @@
+import time
+
+import pytest
+
+from calendar_sync import (
+    MAX_ATTEMPTS,
+    CalendarSyncWorker,
+    FakeCalendarClient,
+    enqueue_event_delete,
+    enqueue_item_sync,
+)
+
+
+class FailingCalendarClient(FakeCalendarClient):
+    """Every call comes back with an error, as when Google answers 5xx."""
+
+    def insert_event(self, event_data):
+        raise ConnectionError("calendar unavailable")
+
+    patch_event = delete_event = insert_event
+
+
+@pytest.fixture
+def task_id(conn):
+    conn.execute(
+        """INSERT INTO users (user_id, username, password_hash) VALUES (1, 'bob', 'x')"""
+    )
+    conn.execute(
+        """INSERT INTO projects (project_id, user_id, name) VALUES (1, 1, 'P')"""
+    )
+    cursor = conn.execute(
+        """
+        INSERT INTO work_items (project_id, name, description, due_date)
+        VALUES (1, 'Task', 'Notes', '2026-03-01')
+    """
+    )
+    conn.commit()
+    return cursor.lastrowid
+
+
+def make_worker(db_path, client=None):
+    return CalendarSyncWorker(client=client or FakeCalendarClient(), db_path=db_path)
+
+
+def enqueue(conn, item_id):
+    enqueue_item_sync(conn.cursor(), item_id)
+    conn.commit()
+
+
+def outbox(conn):
+    return [dict(row) for row in conn.execute("SELECT * FROM calendar_outbox")]
+
+
+def stored_event(conn, item_id):
+    return conn.execute(
+        """SELECT google_calendar_event_id FROM work_items WHERE item_id = ?""",
+        (item_id,),
+    ).fetchone()[0]
+
+
+def test_insert_patch_and_delete(db_path, conn, task_id):
+    worker = make_worker(db_path)
+    enqueue(conn, task_id)
+    assert worker.drain_once() == 1
+    event_id = stored_event(conn, task_id)
+    assert worker.client.events[event_id]["summary"] == "Task"
+    assert outbox(conn) == []
+
+    conn.execute(
+        """UPDATE work_items SET name = 'Renamed' WHERE item_id = ?""", (task_id,)
+    )
+    enqueue(conn, task_id)
+    assert worker.drain_once() == 1
+    assert ("patch", event_id) in worker.client.calls
+    assert worker.client.events[event_id]["summary"] == "Renamed"
+    assert stored_event(conn, task_id) == event_id
+
+    conn.execute(
+        """UPDATE work_items SET due_date = NULL WHERE item_id = ?""", (task_id,)
+    )
+    enqueue(conn, task_id)
+    assert worker.drain_once() == 1
+    assert event_id not in worker.client.events
+    assert stored_event(conn, task_id) is None
+    assert outbox(conn) == []
+
+
+def test_unchanged_task_makes_no_call(db_path, conn, task_id):
+    worker = make_worker(db_path)
+    enqueue(conn, task_id)
+    worker.drain_once()
+    calls = len(worker.client.calls)
+    enqueue(conn, task_id)
+    assert worker.drain_once() == 1
+    assert len(worker.client.calls) == calls
+
+
+def test_event_delete(db_path, conn, task_id):
+    worker = make_worker(db_path)
+    enqueue(conn, task_id)
+    worker.drain_once()
+    event_id = stored_event(conn, task_id)
+    enqueue_event_delete(conn.cursor(), event_id)
+    conn.commit()
+    assert worker.drain_once() == 1
+    assert worker.client.events == {}
+
+
+def test_failure_backs_off_and_counts_attempts(db_path, conn, task_id):
+    worker = make_worker(db_path, FailingCalendarClient())
+    enqueue(conn, task_id)
+    assert worker.drain_once() == 0
+    [row] = outbox(conn)
+    assert row["attempts"] == 1
+    assert row["status"] == "pending"
+    assert row["next_attempt_at"] > time.time()
+    assert row["claimed_until"] is None
+    assert "calendar unavailable" in row["last_error"]
+
+    # Not due again until the backoff has passed.
+    assert worker.drain_once() == 0
+    assert outbox(conn)[0]["attempts"] == 1
+
+    conn.execute("""UPDATE calendar_outbox SET next_attempt_at = 0""")
+    conn.commit()
+    worker.drain_once()
+    [row] = outbox(conn)
+    assert row["attempts"] == 2
+    assert row["next_attempt_at"] > time.time()
+
+
+def test_gives_up_after_max_attempts(db_path, conn, task_id):
+    worker = make_worker(db_path, FailingCalendarClient())
+    enqueue(conn, task_id)
+    conn.execute("""UPDATE calendar_outbox SET attempts = ?""", (MAX_ATTEMPTS - 1,))
+    conn.commit()
+    worker.drain_once()
+    [row] = outbox(conn)
+    assert row["attempts"] == MAX_ATTEMPTS
+    assert row["status"] == "failed"
+
+    conn.execute("""UPDATE calendar_outbox SET next_attempt_at = 0""")
+    conn.commit()
+    calls = len(worker.client.calls)
+    assert worker.drain_once() == 0
+    assert len(worker.client.calls) == calls
+
+
+def test_expired_lease_is_reclaimed(db_path, conn, task_id):
+    enqueue(conn, task_id)
+    # Another worker claimed the row and then died before finishing it.
+    other = make_worker(db_path)
+    assert len(other._claim_due_rows(conn, 50)) == 1
+
+    worker = make_worker(db_path)
+    assert worker.drain_once() == 0
+    assert worker.client.calls == []
+
+    conn.execute("""UPDATE calendar_outbox SET claimed_until = ?""", (time.time() - 1,))
+    conn.commit()
+    assert worker.drain_once() == 1
+    assert stored_event(conn, task_id) is not None
+    assert outbox(conn) == []
+
+
+class UnreachableCalendarClient(FakeCalendarClient):
+    """The batch request itself fails, as when the network is down."""
+
+    def execute_batch(self, operations):
+        raise ConnectionError("network is unreachable")
+
+
+class ShortBatchCalendarClient(FakeCalendarClient):
+    """Answers a batch with fewer results than it was sent calls."""
+
+    def execute_batch(self, operations):
+        return super().execute_batch(operations)[:-1]
+
+
+class UnansweredCallCalendarClient(FakeCalendarClient):
+    """Leaves None for the first call, as a batch does for a call with no callback."""
+
+    def execute_batch(self, operations):
+        return [None] + super().execute_batch(operations[1:])
+
+
+def add_task(conn, name):
+    cursor = conn.execute(
+        """INSERT INTO work_items (project_id, name, due_date) VALUES (1, ?, '2026-04-01')""",
+        (name,),
+    )
+    conn.commit()
+    return cursor.lastrowid
+
+
+def test_failed_batch_request_counts_as_a_failure_of_every_call(db_path, conn, task_id):
+    worker = make_worker(db_path, UnreachableCalendarClient())
+    other_id = add_task(conn, "Other")
+    enqueue(conn, task_id)
+    enqueue(conn, other_id)
+    assert worker.drain_once() == 0
+    rows = outbox(conn)
+    assert len(rows) == 2
+    for row in rows:
+        assert row["attempts"] == 1
+        assert row["status"] == "pending"
+        assert row["claimed_until"] is None
+        assert "network is unreachable" in row["last_error"]
+
+
+def test_missing_batch_results_count_as_failures(db_path, conn, task_id):
+    worker = make_worker(db_path, ShortBatchCalendarClient())
+    other_id = add_task(conn, "Other")
+    enqueue(conn, task_id)
+    enqueue(conn, other_id)
+    assert worker.drain_once() == 1
+    [row] = outbox(conn)
+    assert row["item_id"] == other_id
+    assert row["attempts"] == 1
+    assert "no result" in row["last_error"]
+
+
+def test_unanswered_batch_calls_count_as_failures(db_path, conn, task_id):
+    worker = make_worker(db_path, UnansweredCallCalendarClient())
+    other_id = add_task(conn, "Other")
+    enqueue(conn, task_id)
+    enqueue(conn, other_id)
+    assert worker.drain_once() == 1
+    [row] = outbox(conn)
+    assert row["item_id"] == task_id
+    assert row["attempts"] == 1
+    assert row["claimed_until"] is None
+    assert "no result" in row["last_error"]
+    assert stored_event(conn, other_id) is not None
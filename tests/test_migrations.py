@@ -0,0 +1,79 @@
+import pytest
+
+from database import connect
+from schema import MIGRATIONS, _create_base_tables, migrate_database
+
+
+def old_database(path, applied):
+    """A database made by an older version, with the first `applied` migrations and some tasks."""
+    conn = connect(path, isolation_level=None)
+    cursor = conn.cursor()
+    _create_base_tables(cursor)
+    cursor.execute(
+        """INSERT INTO users (user_id, username, password_hash) VALUES (1, 'bob', 'x')"""
+    )
+    cursor.execute(
+        """INSERT INTO projects (project_id, user_id, name) VALUES (1, 1, 'P')"""
+    )
+    cursor.executemany(
+        """
+        INSERT INTO work_items (item_id, project_id, parent_item_id, name, planned_hours, is_completed)
+        VALUES (?, 1, ?, ?, ?, ?)
+    """,
+        [(1, None, "P", None, 0), (2, 1, "A", 3, 0), (3, 1, "B", 2, 1)],
+    )
+    for migration in MIGRATIONS[:applied]:
+        migration(cursor)
+    cursor.execute(f"PRAGMA user_version = {applied}")
+    conn.close()
+
+
+def schema_of(path):
+    conn = connect(path)
+    try:
+        tables = [
+            row[0]
+            for row in conn.execute(
+                """SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name"""
+            )
+        ]
+        return {
+            "tables": {
+                table: sorted(
+                    row[1] for row in conn.execute(f"PRAGMA table_info({table})")
+                )
+                for table in tables
+            },
+            "indexes_and_triggers": sorted(
+                row[0]
+                for row in conn.execute(
+                    """SELECT name FROM sqlite_master WHERE type IN ('index', 'trigger')"""
+                )
+            ),
+        }
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("applied", range(1, len(MIGRATIONS)))
+def test_upgrading_ends_with_the_same_schema(tmp_path, db_path, applied):
+    path = str(tmp_path / "old.db")
+    old_database(path, applied)
+    migrate_database(path)
+    assert schema_of(path) == schema_of(db_path)
+
+
+@pytest.mark.parametrize("applied", [1, 2])
+def test_remaining_hours_are_filled_in_on_upgrade(tmp_path, applied):
+    # remaining_hours came with migration 3, after databases had migrations 1 and 2.
+    path = str(tmp_path / "old.db")
+    old_database(path, applied)
+    migrate_database(path)
+    conn = connect(path)
+    try:
+        root = conn.execute(
+            """SELECT rolled_up_hours, remaining_hours FROM work_items WHERE item_id = 1"""
+        ).fetchone()
+    finally:
+        conn.close()
+    assert tuple(root) == (5, 3)
@@ -0,0 +1,44 @@
+import random
+
+import pytest
+
+from ordering import (
+    DIGITS,
+    ORDINAL_KEY_WIDTH,
+    key_between,
+    keys_between,
+    ordinal_key,
+)
+
+
+def test_keys_between_are_in_order_and_between_the_bounds():
+    rng = random.Random(0)
+    keys = keys_between(None, None, 50)
+    for _ in range(500):
+        position = rng.randrange(len(keys) + 1)
+        before = keys[position - 1] if position else None
+        after = keys[position] if position < len(keys) else None
+        key = key_between(before, after)
+        assert (before is None or before < key) and (after is None or key < after)
+        assert not key.endswith("0")
+        keys.insert(position, key)
+    assert keys == sorted(keys)
+
+
+def test_empty_key_sorts_first():
+    assert "" < key_between("", None)
+    assert "" < key_between("", "V") < "V"
+    with pytest.raises(ValueError):
+        key_between(None, "")
+    with pytest.raises(ValueError):
+        key_between("V", "V")
+
+
+def test_ordinal_keys_keep_their_order_up_to_the_last_one():
+    last = len(DIGITS) ** ORDINAL_KEY_WIDTH - 2
+    indexes = [0, 1, 60, 61, 62, 3843, 3844, last - 1, last]
+    keys = [ordinal_key(index) for index in indexes]
+    assert keys == sorted(keys)
+    assert len(set(keys)) == len(keys)
+    with pytest.raises(ValueError):
+        ordinal_key(last + 1)
@@ -0,0 +1,14 @@
+from schema import HOT_QUERIES, check_query_plans
+
+
+def test_no_hot_query_scans_a_table(db_path):
+    assert check_query_plans(db_path) == []
+
+
+def test_a_scan_is_caught(db_path, monkeypatch):
+    monkeypatch.setitem(
+        HOT_QUERIES,
+        "unindexed",
+        ("""SELECT * FROM work_items WHERE name = ?""", ("x",)),
+    )
+    assert [name for name, _ in check_query_plans(db_path)] == ["unindexed"]
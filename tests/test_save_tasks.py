@@ -0,0 +1,93 @@
+import pytest
+
+from database import DATABASE, connect
+
+
+@pytest.fixture
+def project(client):
+    """A new project of the client's user, as (project_id, root item_id)."""
+    client.post(
+        "/newProject",
+        data={
+            "title": "P",
+            "description": "D",
+            "start_date": "2026-01-01",
+            "end_date": "2026-12-01",
+        },
+    )
+    with client.session_transaction() as session:
+        user_id = session["user_id"]
+    db = connect(DATABASE)
+    try:
+        return tuple(
+            db.execute(
+                """
+                SELECT p.project_id, w.item_id FROM projects p
+                JOIN work_items w ON w.project_id = p.project_id AND w.parent_item_id IS NULL
+                WHERE p.user_id = ?
+            """,
+                (user_id,),
+            ).fetchone()
+        )
+    finally:
+        db.close()
+
+
+def save(client, project_id, changes, deleted_item_ids=()):
+    return client.post(
+        "/save-tasks",
+        json={
+            "project_id": project_id,
+            "changes": changes,
+            "deleted_item_ids": list(deleted_item_ids),
+        },
+    )
+
+
+def task_count(project_id):
+    db = connect(DATABASE)
+    try:
+        return db.execute(
+            """SELECT COUNT(*) FROM work_items WHERE project_id = ?""", (project_id,)
+        ).fetchone()[0]
+    finally:
+        db.close()
+
+
+def test_deleting_the_root_is_refused(client, project):
+    project_id, root_id = project
+    new_task = {"item_id": "new-1", "parent_item_id": str(root_id), "name": "A"}
+    assert save(client, project_id, [new_task]).status_code == 200
+    count = task_count(project_id)
+
+    response = save(client, project_id, [], [str(root_id)])
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "The project's root task can't be deleted."
+    assert task_count(project_id) == count == 2
+
+
+def test_cached_trees_leave_out_what_the_calendar_worker_writes(client, project):
+    project_id, root_id = project
+    new_task = {
+        "item_id": "new-1",
+        "parent_item_id": str(root_id),
+        "name": "A",
+        "due_date": "2026-04-01",
+    }
+    assert save(client, project_id, [new_task]).status_code == 200
+    tree = client.get(f"/api/projects/{project_id}/tree").get_json()
+
+    # The worker stores the event id without bumping the revision, so the
+    # cached tree and its ETag stay as they were.
+    db = connect(DATABASE)
+    try:
+        db.execute(
+            """UPDATE work_items SET google_calendar_event_id = 'event-1' WHERE project_id = ?""",
+            (project_id,),
+        )
+        db.commit()
+    finally:
+        db.close()
+    assert client.get(f"/api/projects/{project_id}/tree").get_json() == tree
+    [task] = tree["tasks"]
+    assert "google_calendar_event_id" not in task
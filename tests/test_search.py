@@ -0,0 +1,25 @@
+import search
+
+
+def test_other_users_matches_do_not_change_the_ranking(conn, monkeypatch):
+    monkeypatch.setattr(search, "SEARCH_RANK_LIMIT", 2)
+    conn.executemany(
+        """INSERT INTO users (user_id, username, password_hash) VALUES (?, ?, 'x')""",
+        [(1, "bob"), (2, "eve")],
+    )
+    conn.executemany(
+        """INSERT INTO projects (project_id, user_id, name) VALUES (?, ?, ?)""",
+        [(1, 1, "P"), (2, 2, "Q")],
+    )
+    conn.executemany(
+        """INSERT INTO work_items (item_id, project_id, parent_item_id, name) VALUES (?, ?, ?, ?)""",
+        [(1, 1, None, "P"), (10, 2, None, "Q")]
+        # Bob's best match is his older task.
+        + [(2, 1, 1, "alpha alpha"), (3, 1, 1, "alpha beta gamma delta epsilon")]
+        + [(11 + n, 2, 10, "alpha") for n in range(5)],
+    )
+    conn.commit()
+
+    hits, has_more = search.search(conn.cursor(), 1, "alpha")
+    assert [hit["item_id"] for hit in hits] == [2, 3]
+    assert not has_more
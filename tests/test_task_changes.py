@@ -0,0 +1,149 @@
+import pytest
+
+from help import apply_task_changes
+from work_items import rebuild_rollups
+
+ROLLUPS = """
+    SELECT item_id, rolled_up_hours, remaining_hours, descendant_count, completed_descendant_count
+    FROM work_items ORDER BY item_id
+"""
+
+
+@pytest.fixture
+def project(conn):
+    """A project with a root, two tasks under it and a subtask under the first."""
+    conn.execute(
+        """INSERT INTO users (user_id, username, password_hash) VALUES (1, 'bob', 'x')"""
+    )
+    conn.execute(
+        """INSERT INTO projects (project_id, user_id, name) VALUES (1, 1, 'P')"""
+    )
+    conn.execute(
+        """INSERT INTO work_items (item_id, project_id, name) VALUES (1, 1, 'P')"""
+    )
+    conn.executemany(
+        """
+        INSERT INTO work_items (item_id, project_id, parent_item_id, name, planned_hours, sort_key)
+        VALUES (?, 1, ?, ?, ?, ?)
+    """,
+        [(2, 1, "A", None, "V"), (3, 1, "B", 4, "k"), (4, 2, "A1", 2, "V")],
+    )
+    rebuild_rollups(conn.cursor())
+    conn.commit()
+    return 1
+
+
+def task(item_id, parent_item_id, name, planned_hours=None, is_completed=False):
+    return {
+        "item_id": str(item_id),
+        "parent_item_id": str(parent_item_id),
+        "name": name,
+        "description": "",
+        "planned_hours": planned_hours,
+        "is_completed": is_completed,
+    }
+
+
+def save(conn, changes):
+    return apply_task_changes(changes, conn.cursor(), 1)
+
+
+def assert_rollups_match_rebuild(conn):
+    stored = [tuple(row) for row in conn.execute(ROLLUPS)]
+    rebuild_rollups(conn.cursor())
+    assert [tuple(row) for row in conn.execute(ROLLUPS)] == stored
+
+
+def revision(conn):
+    return conn.execute("""SELECT revision FROM projects""").fetchone()[0]
+
+
+def test_rename_leaves_the_rollups_alone(conn, project):
+    before = revision(conn)
+    statements = []
+    conn.set_trace_callback(statements.append)
+    save(conn, [task(4, 2, "Renamed", 2)])
+    conn.set_trace_callback(None)
+    assert not [sql for sql in statements if "rolled_up_hours =" in sql]
+    # The tree still changed, so cached copies of it have to go.
+    assert revision(conn) == before + 1
+
+
+@pytest.mark.parametrize(
+    "changes",
+    [
+        [task(4, 2, "A1", 5)],
+        [task(4, 2, "A1", "2")],
+        [task(4, 2, "A1", 2, is_completed=True)],
+        [task(4, 3, "A1", 2)],
+        [task(3, 2, "B", 4)],
+        [task("new-1", 3, "B1", 1), task("new-2", "new-1", "B11", 6)],
+    ],
+)
+def test_rollups_match_a_rebuild(conn, project, changes):
+    save(conn, changes)
+    assert_rollups_match_rebuild(conn)
+
+
+def test_uncompleting_refreshes_the_rollups(conn, project):
+    save(conn, [task(4, 2, "A1", 2, is_completed=True)])
+    save(conn, [task(4, 2, "A1", 2)])
+    assert_rollups_match_rebuild(conn)
+    assert (
+        conn.execute(
+            """SELECT remaining_hours FROM work_items WHERE item_id = 1"""
+        ).fetchone()[0]
+        == 6
+    )
+
+
+def test_versions_are_read_after_completing_subtrees(conn, project):
+    # A1 is sent as not completed, then completed along with A.
+    id_map, versions = save(
+        conn,
+        [
+            task(2, 1, "A", is_completed=True),
+            task(4, 2, "A1", 2),
+            task("new-1", 2, "A2"),
+        ],
+    )
+    stored = dict(conn.execute("""SELECT item_id, version FROM work_items"""))
+    assert versions == {item_id: stored[item_id] for item_id in [2, 4, id_map["new-1"]]}
+    assert versions[4] == 2
+
+
+def test_new_tasks_are_inserted_a_level_at_a_time(conn, project):
+    # Sent children first, to be inserted after their parents all the same.
+    id_map, versions = save(
+        conn,
+        [
+            task("new-3", "new-1", "C1"),
+            dict(task("new-1", 1, "C"), before_item_id="3"),
+            task("new-5", "new-3", "C11"),
+            task("new-2", 1, "D"),
+            task("new-4", "new-1", "C2"),
+        ],
+    )
+    # One executemany per level, each level in the order it was sent.
+    assert id_map == {"new-1": 5, "new-2": 6, "new-3": 7, "new-4": 8, "new-5": 9}
+    assert versions == {item_id: 0 for item_id in id_map.values()}
+
+    def children(parent_item_id):
+        return [
+            row[0]
+            for row in conn.execute(
+                """SELECT item_id FROM work_items WHERE parent_item_id = ? ORDER BY sort_key""",
+                (parent_item_id,),
+            )
+        ]
+
+    # C went in front of B, D at the end.
+    assert children(1) == [2, 5, 3, 6]
+    assert children(5) == [7, 8]
+    assert children(7) == [9]
+    assert children(6) == []
+    keys = dict(conn.execute("""SELECT item_id, sort_key FROM work_items"""))
+    # No two siblings share a key, so the order above is the only one.
+    assert keys[2] < keys[5] < keys[3] < keys[6]
+    assert keys[7] < keys[8]
+    assert_rollups_match_rebuild(conn)
@@ -0,0 +1,127 @@
+import pytest
+
+from validation import validate_task_changes
+from work_items import MAX_TASK_LEVEL
+
+
+@pytest.fixture
+def cursor(conn):
+    """
+    Project 1 with a root (1), a task (2) due 2026-06-01 and its subtask (3),
+    and project 2 with a root (10) and a task (11).
+    """
+    conn.execute(
+        """INSERT INTO users (user_id, username, password_hash) VALUES (1, 'bob', 'x')"""
+    )
+    conn.executemany(
+        """INSERT INTO projects (project_id, user_id, name) VALUES (?, 1, ?)""",
+        [(1, "P"), (2, "Q")],
+    )
+    conn.executemany(
+        """
+        INSERT INTO work_items (item_id, project_id, parent_item_id, name, due_date)
+        VALUES (?, ?, ?, ?, ?)
+    """,
+        [
+            (1, 1, None, "P", None),
+            (2, 1, 1, "A", "2026-06-01"),
+            (3, 1, 2, "A1", None),
+            (10, 2, None, "Q", None),
+            (11, 2, 10, "B", None),
+        ],
+    )
+    conn.commit()
+    return conn.cursor()
+
+
+def task(item_id, parent_item_id, name="T", due_date=None):
+    return {
+        "item_id": str(item_id),
+        "parent_item_id": str(parent_item_id),
+        "name": name,
+        "due_date": due_date,
+    }
+
+
+def messages(cursor, changes, deleted_item_ids=()):
+    violations = validate_task_changes(cursor, 1, changes, deleted_item_ids)
+    return [(v["item_id"], v["message"]) for v in violations]
+
+
+def test_a_valid_change_set_passes(cursor):
+    changes = [task(2, 1, "A"), task("new-1", 2, "A2", "2026-05-01")]
+    assert messages(cursor, changes) == []
+
+
+def test_deleting_the_root(cursor):
+    assert messages(cursor, [], ["1"]) == [
+        ("1", "The project's root task can't be deleted.")
+    ]
+    assert messages(cursor, [], ["3"]) == []
+
+
+def test_moving_a_task_under_its_own_subtask(cursor):
+    assert messages(cursor, [task(2, 3, "A")]) == [
+        ("2", "A task cannot be moved under one of its own subtasks.")
+    ]
+
+
+def chain(parent_item_id, length):
+    """`length` new tasks, each the subtask of the one before, "new-1" at the top."""
+    return [task("new-1", parent_item_id)] + [
+        task(f"new-{n}", f"new-{n - 1}") for n in range(2, length + 1)
+    ]
+
+
+def test_nesting_too_deep(cursor):
+    # Task 3 is at level 2.
+    changes = chain(3, MAX_TASK_LEVEL - 2)
+    assert messages(cursor, changes) == []
+
+    changes = chain(3, MAX_TASK_LEVEL)
+    assert messages(cursor, changes) == [
+        (
+            f"new-{MAX_TASK_LEVEL - 1}",
+            f"Tasks can only be nested {MAX_TASK_LEVEL} levels deep.",
+        )
+    ]
+
+
+def test_moving_a_subtree_too_deep(cursor):
+    # Task 2 brings its subtask along, one level further down.
+    changes = chain(1, MAX_TASK_LEVEL - 2) + [task(2, f"new-{MAX_TASK_LEVEL - 2}", "A")]
+    assert messages(cursor, changes) == []
+
+    changes = chain(1, MAX_TASK_LEVEL - 1) + [task(2, f"new-{MAX_TASK_LEVEL - 1}", "A")]
+    assert messages(cursor, changes) == [
+        ("2", f"Its subtasks would be more than {MAX_TASK_LEVEL} levels deep here.")
+    ]
+
+
+def test_parents_from_another_project(cursor):
+    assert messages(cursor, [task(11, 1, "B"), task("new-1", 11)]) == [
+        ("11", "This task isn't part of the project."),
+        ("new-1", "Its parent task isn't part of the project."),
+    ]
+
+
+def test_a_parent_that_is_being_deleted(cursor):
+    assert messages(cursor, [task("new-1", 3)], ["2"]) == [
+        ("new-1", "Its parent task isn't part of the project.")
+    ]
+
+
+def test_a_subtask_due_after_its_parent(cursor):
+    assert messages(cursor, [task(3, 2, "A1", "2026-07-01")]) == [
+        ("3", "A task cannot be due after its parent.")
+    ]
+    assert messages(cursor, [task(3, 2, "A1", "2026-06-01")]) == []
+
+
+def test_a_parent_due_before_its_stored_subtasks(cursor):
+    cursor.execute(
+        """UPDATE work_items SET due_date = '2026-05-01' WHERE item_id = 3"""
+    )
+    assert messages(cursor, [task(2, 1, "A", "2026-04-01")]) == [
+        ("2", "A task cannot be due before its subtasks.")
+    ]
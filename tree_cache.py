@@ -0,0 +1,84 @@
+import sys
+import threading
+from collections import OrderedDict
+
+# Built task trees are kept per (project_id, revision). A project's revision
+# goes up with every change, so an entry can never be served once it is stale;
+# invalidate() only frees the memory of old revisions early.
+
+CACHE_MAX_TREES = 64
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+def _tree_size(tasks):
+    """Rough number of bytes a built tree takes up."""
+    size = sys.getsizeof(tasks)
+    for task in tasks:
+        size += sys.getsizeof(task)
+        size += sum(sys.getsizeof(value) for value in task.values())
+        size += _tree_size(task["subtasks"])
+    return size
+
+
+class TreeCache:
+    """A least recently used cache of built task trees, bounded by count and by size."""
+
+    def __init__(self, max_trees=CACHE_MAX_TREES, max_bytes=CACHE_MAX_BYTES):
+        self.max_trees = max_trees
+        self.max_bytes = max_bytes
+        self._trees = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_or_build(self, project_id, revision, build, view="full"):
+        """
+        Returns the tree for this revision of the project, calling build() to
+        make it if it isn't cached. `view` tells apart the trees built
+        differently for the same project, e.g. the task page's visible branches.
+        """
+        key = (project_id, revision, view)
+        with self._lock:
+            entry = self._trees.get(key)
+            if entry is not None:
+                self._trees.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Built outside the lock, two requests may both build it, which is harmless.
+        tree = build()
+        size = _tree_size(tree)
+        if size > self.max_bytes:
+            return tree
+
+        with self._lock:
+            if key not in self._trees:
+                self._trees[key] = (tree, size)
+                self.bytes += size
+            while len(self._trees) > self.max_trees or self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._trees.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+        return tree
+
+    def invalidate(self, project_id):
+        """Drops every cached tree of a project, e.g. after it is saved or deleted."""
+        with self._lock:
+            for key in [key for key in self._trees if key[0] == project_id]:
+                self.bytes -= self._trees.pop(key)[1]
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "trees": len(self._trees),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
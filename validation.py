@@ -0,0 +1,234 @@
+from datetime import date
+
+from help import _is_new_id
+from work_items import MAX_TASK_LEVEL
+
+# The rules of a project's task tree, checked on the server before a save
+# writes anything: every task hangs off the project's root through parents in
+# the same project without going round in a circle, no deeper than
+# MAX_TASK_LEVEL, and no task is due after its parent. tasks.js checks the same
+# rules as the user edits, but only for the tasks on the page.
+#
+# Only the part of the stored tree a change-set can affect is read: the tasks
+# above each changed task, the subtasks of those given a due date, and the
+# subtrees of those that end up at a new level. Rules the stored tree already
+# broke before the save are left alone.
+
+
+def _item_key(item_id):
+    """Database ids as ints and "new-N" client ids as they are, None for anything else."""
+    if _is_new_id(item_id):
+        return item_id
+    if str(item_id).isdigit():
+        return int(item_id)
+    return None
+
+
+def _valid_due_date(due_date):
+    try:
+        date.fromisoformat(due_date)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def _stored_chains(cursor, project_id, item_ids):
+    """The given items of the project and every item above them, by id."""
+    placeholders = ",".join(["?"] * len(item_ids))
+    cursor.execute(
+        f"""
+        WITH RECURSIVE chain(item_id) AS (
+            SELECT item_id FROM work_items WHERE project_id = ? AND item_id IN ({placeholders})
+            UNION
+            SELECT w.parent_item_id FROM work_items w JOIN chain c ON w.item_id = c.item_id
+            WHERE w.parent_item_id IS NOT NULL
+        )
+        SELECT item_id, parent_item_id, name, due_date FROM work_items
+        WHERE item_id IN (SELECT item_id FROM chain)
+    """,
+        [project_id] + list(item_ids),
+    )
+    return {row["item_id"]: dict(row) for row in cursor.fetchall()}
+
+
+def _latest_child_due_dates(cursor, item_ids, skipped_ids):
+    """item id -> the latest due date among its stored subtasks, not counting `skipped_ids`."""
+    placeholders = ",".join(["?"] * len(item_ids))
+    skipped = ",".join(["?"] * len(skipped_ids)) or "NULL"
+    cursor.execute(
+        f"""
+        SELECT parent_item_id, MAX(due_date) FROM work_items
+        WHERE parent_item_id IN ({placeholders}) AND item_id NOT IN ({skipped})
+        AND due_date IS NOT NULL AND due_date != ''
+        GROUP BY parent_item_id
+    """,
+        list(item_ids) + list(skipped_ids),
+    )
+    return dict(cursor.fetchall())
+
+
+def _subtree_heights(cursor, item_ids, skipped_ids):
+    """
+    item id -> how many levels of stored subtasks it has, leaving out the
+    subtrees of `skipped_ids`.
+    """
+    placeholders = ",".join(["?"] * len(item_ids))
+    skipped = ",".join(["?"] * len(skipped_ids)) or "NULL"
+    cursor.execute(
+        f"""
+        WITH RECURSIVE below(top_id, item_id, height) AS (
+            SELECT item_id, item_id, 0 FROM work_items WHERE item_id IN ({placeholders})
+            UNION ALL
+            SELECT b.top_id, w.item_id, b.height + 1
+            FROM work_items w JOIN below b ON w.parent_item_id = b.item_id
+            WHERE w.item_id NOT IN ({skipped})
+        )
+        SELECT top_id, MAX(height) FROM below GROUP BY top_id
+    """,
+        list(item_ids) + list(skipped_ids),
+    )
+    return dict(cursor.fetchall())
+
+
+def validate_task_changes(cursor, project_id, changes, deleted_item_ids=()):
+    """
+    Checks a change-set from the task page against the project's tree as it
+    will be once saved, the stored tasks less the deleted subtrees with the
+    changes applied. Returns every rule that would be broken, as a list of
+    {"item_id", "name", "message"}, empty if the save can go ahead.
+    """
+    violations = []
+
+    def violation(key, message):
+        name = (incoming.get(key) or stored.get(key) or {}).get("name")
+        violations.append(
+            {"item_id": str(key), "name": name or "Untitled Task", "message": message}
+        )
+
+    incoming = {}
+    for task in changes:
+        key = _item_key(task.get("item_id"))
+        if key is not None:
+            incoming[key] = {
+                "parent_item_id": _item_key(task.get("parent_item_id")),
+                "name": task.get("name"),
+                "due_date": task.get("due_date") or None,
+            }
+    deleted = {int(i) for i in deleted_item_ids if str(i).isdigit()}
+
+    existing = [key for key in incoming if isinstance(key, int)]
+    parents = [
+        node["parent_item_id"]
+        for node in incoming.values()
+        if isinstance(node["parent_item_id"], int)
+    ]
+    stored = {}
+    if existing or parents or deleted:
+        stored = _stored_chains(cursor, project_id, set(existing + parents) | deleted)
+
+    for key in sorted(deleted):
+        if key in stored and stored[key]["parent_item_id"] is None:
+            violation(key, "The project's root task can't be deleted.")
+            # The rest is checked as if it stays.
+            deleted.discard(key)
+
+    # A stored item goes with a deleted subtree if it or any item above it
+    # was deleted, since delete_subtrees runs before the changes are applied.
+    gone = {}
+
+    def is_gone(key):
+        if key not in gone:
+            parent = stored[key]["parent_item_id"]
+            gone[key] = key in deleted or (parent in stored and is_gone(parent))
+        return gone[key]
+
+    for key, node in incoming.items():
+        if isinstance(key, int) and (key not in stored or is_gone(key)):
+            violation(key, "This task isn't part of the project.")
+            continue
+        if isinstance(key, int) and stored[key]["parent_item_id"] is None:
+            # The project's root item stays where it is.
+            node["parent_item_id"] = None
+            continue
+
+        parent = node["parent_item_id"]
+        if node["due_date"] and not _valid_due_date(node["due_date"]):
+            violation(key, f'"{node["due_date"]}" isn\'t a valid due date.')
+            node["due_date"] = None
+        if parent is None:
+            violation(key, "Every task needs a parent task.")
+        elif isinstance(parent, int) and (parent not in stored or is_gone(parent)):
+            violation(key, "Its parent task isn't part of the project.")
+        elif _is_new_id(parent) and parent not in incoming:
+            violation(key, "Its parent task doesn't exist.")
+    if violations:
+        return violations
+
+    def merged(key):
+        return incoming.get(key) or stored[key]
+
+    # The level of every changed task and the tasks above it in the merged
+    # tree. Walking up from a task moved under one of its own subtasks comes
+    # back round to it.
+    levels = {}
+    for key in incoming:
+        path = []
+        current = key
+        while current is not None and current not in levels and current not in path:
+            path.append(current)
+            current = merged(current)["parent_item_id"]
+        if current in path:
+            if current == key:
+                violation(key, "A task cannot be moved under one of its own subtasks.")
+            continue
+        level = -1 if current is None else levels[current]
+        for item in reversed(path):
+            level += 1
+            levels[item] = level
+    if violations:
+        return violations
+
+    stored_levels = {}
+
+    def stored_level(key):
+        if key not in stored_levels:
+            parent = stored[key]["parent_item_id"]
+            stored_levels[key] = 0 if parent is None else stored_level(parent) + 1
+        return stored_levels[key]
+
+    for key, node in incoming.items():
+        parent = node["parent_item_id"]
+        if parent is None:
+            continue
+        # Only the topmost task that is too deep is reported.
+        if levels[key] > MAX_TASK_LEVEL and levels[parent] <= MAX_TASK_LEVEL:
+            violation(key, f"Tasks can only be nested {MAX_TASK_LEVEL} levels deep.")
+        parent_due_date = merged(parent)["due_date"]
+        if node["due_date"] and parent_due_date and node["due_date"] > parent_due_date:
+            violation(key, "A task cannot be due after its parent.")
+
+    # Stored subtasks that aren't in the change-set keep their due dates and
+    # come along when their parent moves, so a changed task has to allow
+    # for them.
+    skipped = existing + list(deleted)
+    dated = [key for key in existing if incoming[key]["due_date"]]
+    if dated:
+        latest = _latest_child_due_dates(cursor, dated, skipped)
+        for key, child_due_date in latest.items():
+            if child_due_date > incoming[key]["due_date"]:
+                violation(key, "A task cannot be due before its subtasks.")
+
+    moved = [
+        key
+        for key in existing
+        if levels[key] != stored_level(key) and levels[key] <= MAX_TASK_LEVEL
+    ]
+    if moved:
+        heights = _subtree_heights(cursor, moved, skipped)
+        for key, height in heights.items():
+            if levels[key] + height > MAX_TASK_LEVEL:
+                violation(
+                    key,
+                    f"Its subtasks would be more than {MAX_TASK_LEVEL} levels deep here.",
+                )
+    return violations
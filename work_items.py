@@ -0,0 +1,509 @@
+from calendar_sync import enqueue_event_delete
+from ordering import MAX_SORT_KEY_LENGTH, key_between, keys_between
+
+# Subtree and ancestor operations on work_items, each done by SQLite with a
+# WITH RECURSIVE query over parent_item_id instead of walking the tree in Python.
+# The CTEs are used as subqueries so every write still starts with
+# UPDATE/DELETE, which keeps sqlite3's implicit transactions and rowcount working.
+
+
+def _subtree_ids(item_ids):
+    placeholders = ",".join(["?"] * len(item_ids))
+    return f"""
+        WITH RECURSIVE subtree(item_id) AS (
+            SELECT item_id FROM work_items WHERE project_id = ? AND item_id IN ({placeholders})
+            UNION
+            SELECT w.item_id FROM work_items w JOIN subtree s ON w.parent_item_id = s.item_id
+        )
+        SELECT item_id FROM subtree
+    """
+
+
+def _ancestor_ids():
+    """The item and every item above it, except the project's root item."""
+    return """
+        WITH RECURSIVE ancestors(item_id, parent_item_id) AS (
+            SELECT item_id, parent_item_id FROM work_items WHERE project_id = ? AND item_id = ?
+            UNION
+            SELECT w.item_id, w.parent_item_id FROM work_items w JOIN ancestors a ON w.item_id = a.parent_item_id
+        )
+        SELECT item_id FROM ancestors WHERE parent_item_id IS NOT NULL
+    """
+
+
+# Shared with HOT_QUERIES in schema.py, whose query plans are checked.
+PROJECT_TASKS_SQL = """SELECT * FROM work_items WHERE project_id = ?"""
+PROJECT_OWNER_SQL = """SELECT 1 FROM projects WHERE user_id = ? AND project_id = ?"""
+RENAME_PROJECT_ROOT_SQL = """
+    UPDATE work_items SET name = ?, description = ?
+    WHERE project_id = ? AND parent_item_id IS NULL
+"""
+
+
+def get_owned_item(cursor, user_id, item_id):
+    """Returns the work item if it belongs to one of the user's projects, otherwise None."""
+    cursor.execute(
+        """
+        SELECT w.* FROM work_items w JOIN projects p ON p.project_id = w.project_id
+        WHERE w.item_id = ? AND p.user_id = ?
+    """,
+        (item_id, user_id),
+    )
+    return cursor.fetchone()
+
+
+def complete_subtree(cursor, project_id, item_id):
+    """Marks a task and everything below it as completed. Returns the number of rows changed."""
+    cursor.execute(
+        f"""
+        UPDATE work_items SET is_completed = 1, version = version + 1
+        WHERE item_id IN ({_subtree_ids([item_id])}) AND is_completed = 0
+    """,
+        (project_id, item_id),
+    )
+    changed = cursor.rowcount
+    # Everything below the task is now complete.
+    cursor.execute(
+        f"""
+        UPDATE work_items SET completed_descendant_count = descendant_count, remaining_hours = 0
+        WHERE item_id IN ({_subtree_ids([item_id])})
+    """,
+        (project_id, item_id),
+    )
+    refresh_rollups(cursor, [item_id])
+    return changed
+
+
+def uncomplete_with_ancestors(cursor, project_id, item_id):
+    """
+    Marks a task as not completed, along with every task above it, since a
+    parent can't be complete while one of its subtasks is not. The project's
+    root item is left alone. Returns the number of rows changed.
+    """
+    cursor.execute(
+        f"""
+        UPDATE work_items SET is_completed = 0, version = version + 1
+        WHERE item_id IN ({_ancestor_ids()}) AND is_completed = 1
+    """,
+        (project_id, item_id),
+    )
+    changed = cursor.rowcount
+    refresh_rollups(cursor, [item_id])
+    return changed
+
+
+def delete_subtrees(cursor, project_id, item_ids):
+    """
+    Deletes the given tasks together with all of their subtasks, and queues
+    the deletion of their Google Calendar events. Returns the deleted event ids.
+    """
+    if not item_ids:
+        return []
+    params = [project_id] + list(item_ids)
+
+    cursor.execute(
+        f"""
+        SELECT google_calendar_event_id FROM work_items
+        WHERE item_id IN ({_subtree_ids(item_ids)}) AND google_calendar_event_id IS NOT NULL
+    """,
+        params,
+    )
+    event_ids = [row[0] for row in cursor.fetchall()]
+    for event_id in event_ids:
+        enqueue_event_delete(cursor, event_id)
+
+    placeholders = ",".join(["?"] * len(item_ids))
+    cursor.execute(
+        f"""SELECT DISTINCT parent_item_id FROM work_items WHERE project_id = ? AND item_id IN ({placeholders})""",
+        params,
+    )
+    parent_ids = [row[0] for row in cursor.fetchall()]
+
+    cursor.execute(
+        f"""DELETE FROM work_items WHERE item_id IN ({_subtree_ids(item_ids)})""",
+        params,
+    )
+    refresh_rollups(cursor, parent_ids)
+    return event_ids
+
+
+def subtree_hours(cursor, project_id, item_id):
+    """
+    Rolled-up planned hours of a task, summed over the leaf tasks of its
+    subtree the same way the task page does. Returns (total, remaining).
+    """
+    cursor.execute(
+        """SELECT rolled_up_hours, remaining_hours FROM work_items WHERE project_id = ? AND item_id = ?""",
+        (project_id, item_id),
+    )
+    total, remaining = cursor.fetchone()
+    return total, remaining
+
+
+CHILDREN_PAGE_SIZE = 100
+# The same limit as MAX_SUBTASK_LEVEL in tasks.js, the root being level 0.
+MAX_TASK_LEVEL = 6
+
+_CHILD_COUNT = """(SELECT COUNT(*) FROM work_items c WHERE c.parent_item_id = w.item_id) AS child_count"""
+
+
+def visible_task_rows(cursor, project_id):
+    """
+    The project's tasks that the task page shows straight away: the root and
+    every task whose parents are all expanded. Subtasks of a minimized task
+    are left out and loaded with child_task_rows when it is opened.
+    """
+    cursor.execute(
+        f"""
+        WITH RECURSIVE visible(item_id, expanded) AS (
+            SELECT item_id, 1 FROM work_items WHERE project_id = ? AND parent_item_id IS NULL
+            UNION ALL
+            SELECT w.item_id, NOT w.is_minimized FROM work_items w JOIN visible v ON w.parent_item_id = v.item_id
+            WHERE v.expanded
+        )
+        SELECT w.*, {_CHILD_COUNT} FROM work_items w
+        WHERE w.item_id IN (SELECT item_id FROM visible)
+    """,
+        (project_id,),
+    )
+    return cursor.fetchall()
+
+
+CHILD_PAGE_SQL = f"""
+    SELECT w.*, {_CHILD_COUNT} FROM work_items w
+    WHERE w.project_id = ? AND w.parent_item_id = ?
+    ORDER BY w.sort_key, w.item_id
+    LIMIT ? OFFSET ?
+"""
+
+
+def child_task_rows(cursor, project_id, item_id, offset=0, limit=CHILDREN_PAGE_SIZE):
+    """One page of a task's direct subtasks in display order, with their child counts."""
+    cursor.execute(CHILD_PAGE_SQL, (project_id, item_id, limit, offset))
+    return cursor.fetchall()
+
+
+_OUTLINE_COLUMNS = (
+    "item_id",
+    "parent_item_id",
+    "sort_key",
+    "name",
+    "description",
+    "due_date",
+    "is_completed",
+    "is_minimized",
+    "planned_hours",
+)
+
+
+def outline_task_rows(cursor, project_id):
+    """
+    Iterates over the project's tasks depth first, each straight after its
+    parent and siblings in display order, with its level (1 for the tasks
+    under the root). SQLite produces them one at a time as the cursor is read,
+    so a project of any size can be streamed.
+    """
+    # Ordering the recursive CTE's queue by level, deepest first, is what
+    # makes SQLite walk the tree depth first. The columns are carried along
+    # in the CTE since joining its rows to work_items loses that order.
+    cursor.execute(
+        f"""
+        WITH RECURSIVE outline(level, {", ".join(_OUTLINE_COLUMNS)}) AS (
+            SELECT 0, {", ".join(_OUTLINE_COLUMNS)} FROM work_items
+            WHERE project_id = ? AND parent_item_id IS NULL
+            UNION ALL
+            SELECT o.level + 1, {", ".join("w." + column for column in _OUTLINE_COLUMNS)}
+            FROM work_items w JOIN outline o ON w.parent_item_id = o.item_id
+            ORDER BY 1 DESC, 4, 2
+        )
+        SELECT * FROM outline WHERE level > 0
+    """,
+        (project_id,),
+    )
+    return cursor
+
+
+def item_level(cursor, project_id, item_id):
+    """How far below the project's root item a task is, the root being level 0."""
+    cursor.execute(
+        f"""SELECT COUNT(*) FROM ({_ancestor_ids()})""",
+        (project_id, item_id),
+    )
+    return cursor.fetchone()[0]
+
+
+def sort_key_bound_sql(side, skipped_count=0):
+    """
+    The query for the highest sort key under a parent before a sibling's
+    (`side` "before"), the lowest after it ("after") or the highest of all
+    (None), leaving out `skipped_count` subtasks. Takes the project and parent
+    ids, the sibling's key unless `side` is None, then the skipped ids.
+    """
+    aggregate, condition = {
+        "before": ("MAX", "AND sort_key < ?"),
+        "after": ("MIN", "AND sort_key > ?"),
+        None: ("MAX", ""),
+    }[side]
+    skipped = ""
+    if skipped_count:
+        skipped = f"AND item_id NOT IN ({','.join(['?'] * skipped_count)})"
+    return f"""
+        SELECT {aggregate}(sort_key) FROM work_items
+        WHERE project_id = ? AND parent_item_id = ? {condition} {skipped}
+    """
+
+
+def sort_key_bounds(
+    cursor,
+    project_id,
+    parent_item_id,
+    before_item_id=None,
+    after_item_id=None,
+    skipped_ids=(),
+):
+    """
+    The sort keys a task placed under `parent_item_id` has to go between:
+    those of `before_item_id` and the subtask in front of it, of
+    `after_item_id` and the subtask behind it, or of the last subtask and None
+    if neither is given. The subtasks in `skipped_ids` are being moved and
+    don't count. Raises ValueError if the given sibling isn't a subtask of
+    `parent_item_id`.
+    """
+    sibling_id = before_item_id if before_item_id is not None else after_item_id
+    sibling_key = None
+    if sibling_id is not None:
+        cursor.execute(
+            """SELECT sort_key FROM work_items WHERE project_id = ? AND parent_item_id = ? AND item_id = ?""",
+            (project_id, parent_item_id, sibling_id),
+        )
+        row = cursor.fetchone()
+        if row is None or sibling_id in skipped_ids:
+            raise ValueError(
+                "The task to place it next to isn't one of its new siblings."
+            )
+        sibling_key = row[0]
+
+    if before_item_id is not None:
+        sql, params = sort_key_bound_sql("before", len(skipped_ids)), (sibling_key,)
+    elif after_item_id is not None:
+        sql, params = sort_key_bound_sql("after", len(skipped_ids)), (sibling_key,)
+    else:
+        sql, params = sort_key_bound_sql(None, len(skipped_ids)), ()
+    cursor.execute(sql, (project_id, parent_item_id) + params + tuple(skipped_ids))
+    neighbour_key = cursor.fetchone()[0]
+    if before_item_id is None and after_item_id is not None:
+        return sibling_key, neighbour_key
+    return neighbour_key, sibling_key
+
+
+def respace_children(cursor, project_id, parent_item_id):
+    """Gives a task's subtasks short, evenly spread sort keys, keeping their order."""
+    cursor.execute(
+        """SELECT item_id FROM work_items WHERE project_id = ? AND parent_item_id = ? ORDER BY sort_key, item_id""",
+        (project_id, parent_item_id),
+    )
+    item_ids = [row[0] for row in cursor.fetchall()]
+    cursor.executemany(
+        """UPDATE work_items SET sort_key = ? WHERE item_id = ?""",
+        zip(keys_between(None, None, len(item_ids)), item_ids),
+    )
+
+
+def move_task(
+    cursor, project_id, item_id, parent_item_id, before_item_id=None, after_item_id=None
+):
+    """
+    Moves a task under `parent_item_id`, just in front of `before_item_id`,
+    just behind `after_item_id`, or after the last subtask if neither is
+    given. It gets a sort key between its new neighbours, so its own row is
+    the only one written besides the roll-ups of the tasks above it, unless
+    the keys there have grown too long and the siblings are respaced.
+    Returns its new (sort_key, version).
+    """
+    cursor.execute(
+        """SELECT parent_item_id FROM work_items WHERE project_id = ? AND item_id = ?""",
+        (project_id, item_id),
+    )
+    old_parent_id = cursor.fetchone()[0]
+
+    def new_sort_key():
+        return key_between(
+            *sort_key_bounds(
+                cursor,
+                project_id,
+                parent_item_id,
+                before_item_id,
+                after_item_id,
+                skipped_ids=(item_id,),
+            )
+        )
+
+    sort_key = new_sort_key()
+    if len(sort_key) > MAX_SORT_KEY_LENGTH:
+        respace_children(cursor, project_id, parent_item_id)
+        sort_key = new_sort_key()
+    cursor.execute(
+        """
+        UPDATE work_items SET parent_item_id = ?, sort_key = ?, version = version + 1
+        WHERE project_id = ? AND item_id = ?
+    """,
+        (parent_item_id, sort_key, project_id, item_id),
+    )
+    if old_parent_id != parent_item_id:
+        refresh_rollups(cursor, [old_parent_id, parent_item_id])
+    else:
+        bump_project_revision(cursor, project_id)
+    cursor.execute("""SELECT version FROM work_items WHERE item_id = ?""", (item_id,))
+    return sort_key, cursor.fetchone()[0]
+
+
+_REFRESH_ROLLUP = """
+    UPDATE work_items SET
+        rolled_up_hours = COALESCE(
+            (SELECT SUM(c.rolled_up_hours) FROM work_items c WHERE c.parent_item_id = work_items.item_id),
+            planned_hours,
+            0
+        ),
+        descendant_count = (
+            SELECT COUNT(*) + COALESCE(SUM(c.descendant_count), 0)
+            FROM work_items c WHERE c.parent_item_id = work_items.item_id
+        ),
+        completed_descendant_count = (
+            SELECT COALESCE(SUM((c.is_completed != 0) + c.completed_descendant_count), 0)
+            FROM work_items c WHERE c.parent_item_id = work_items.item_id
+        ),
+        remaining_hours = COALESCE(
+            (SELECT SUM(c.remaining_hours) FROM work_items c WHERE c.parent_item_id = work_items.item_id),
+            CASE WHEN is_completed THEN 0 ELSE planned_hours END,
+            0
+        )
+    WHERE item_id = ?
+"""
+
+_REFRESH_PROJECT_TOTALS = """
+    UPDATE projects SET
+        planned_hours = COALESCE((SELECT rolled_up_hours FROM work_items
+            WHERE project_id = projects.project_id AND parent_item_id IS NULL), 0),
+        task_count = COALESCE((SELECT descendant_count FROM work_items
+            WHERE project_id = projects.project_id AND parent_item_id IS NULL), 0),
+        completed_task_count = COALESCE((SELECT completed_descendant_count FROM work_items
+            WHERE project_id = projects.project_id AND parent_item_id IS NULL), 0),
+        progress = COALESCE((SELECT CAST(completed_descendant_count AS REAL) / descendant_count
+            FROM work_items WHERE project_id = projects.project_id AND parent_item_id IS NULL
+            AND descendant_count > 0), 0),
+        revision = revision + 1,
+        modified_at = CURRENT_TIMESTAMP
+    WHERE project_id = ?
+"""
+
+
+def refresh_rollups(cursor, item_ids):
+    """
+    Recomputes the stored roll-up columns (rolled_up_hours, remaining_hours,
+    descendant_count, completed_descendant_count) of the given items and every
+    item above them, children before parents, then copies the root's totals
+    and the share of tasks completed onto the project and bumps its revision.
+    Only the ancestor path is touched, not the rest of the project.
+    """
+    item_ids = [int(i) for i in set(item_ids) if i is not None]
+    if not item_ids:
+        return
+    placeholders = ",".join(["?"] * len(item_ids))
+    cursor.execute(
+        f"""
+        WITH RECURSIVE path(item_id, parent_item_id, project_id, height) AS (
+            SELECT item_id, parent_item_id, project_id, 0 FROM work_items WHERE item_id IN ({placeholders})
+            UNION
+            SELECT w.item_id, w.parent_item_id, w.project_id, p.height + 1
+            FROM work_items w JOIN path p ON w.item_id = p.parent_item_id
+        )
+        SELECT item_id, project_id, MAX(height) AS height FROM path
+        GROUP BY item_id ORDER BY height
+    """,
+        item_ids,
+    )
+    path = cursor.fetchall()
+    cursor.executemany(_REFRESH_ROLLUP, [(row[0],) for row in path])
+    project_ids = {row[1] for row in path}
+    cursor.executemany(_REFRESH_PROJECT_TOTALS, [(p,) for p in project_ids])
+
+
+CALENDAR_EVENT_LIMIT = 500
+
+
+def dated_items_between(
+    cursor, user_id, start, end, project_id=None, limit=CALENDAR_EVENT_LIMIT
+):
+    """
+    The user's tasks due on or after `start` and before `end` (ISO dates),
+    optionally from one project only, at most `limit` of them in date order.
+    """
+    params = [user_id, start, end]
+    if project_id is not None:
+        params.append(project_id)
+    cursor.execute(dated_items_sql(project_id is not None), params + [limit])
+    return cursor.fetchall()
+
+
+def dated_items_sql(one_project=False):
+    """The query behind dated_items_between, with or without a project_id to narrow it to."""
+    project_filter = "AND p.project_id = ?" if one_project else ""
+    return f"""
+        SELECT w.item_id, w.project_id, w.name, w.description, w.due_date, w.is_completed, w.google_calendar_event_id
+        FROM projects p JOIN work_items w ON w.project_id = p.project_id
+        WHERE p.user_id = ? AND w.due_date >= ? AND w.due_date < ? {project_filter}
+        ORDER BY w.due_date, w.item_id
+        LIMIT ?
+    """
+
+
+def bump_project_revision(cursor, project_id):
+    """For project changes that don't go through refresh_rollups, e.g. a rename."""
+    cursor.execute(
+        """UPDATE projects SET revision = revision + 1, modified_at = CURRENT_TIMESTAMP WHERE project_id = ?""",
+        (project_id,),
+    )
+
+
+def project_revision(cursor, user_id, project_id):
+    """(revision, modified_at) of one of the user's projects, or None if it isn't theirs."""
+    cursor.execute(
+        """SELECT revision, modified_at FROM projects WHERE user_id = ? AND project_id = ?""",
+        (user_id, project_id),
+    )
+    return cursor.fetchone()
+
+
+def task_rows(cursor, project_id, item_ids):
+    """The given tasks of a project, with their child counts."""
+    placeholders = ",".join(["?"] * len(item_ids))
+    cursor.execute(
+        f"""SELECT w.*, {_CHILD_COUNT} FROM work_items w WHERE w.project_id = ? AND w.item_id IN ({placeholders})""",
+        [project_id] + list(item_ids),
+    )
+    return cursor.fetchall()
+
+
+def rebuild_rollups(cursor, project_id=None):
+    """
+    Recomputes every stored roll-up from scratch, deepest items first, of one
+    project or of all of them.
+    """
+    only_project = "" if project_id is None else "AND project_id = ?"
+    params = () if project_id is None else (project_id,)
+    cursor.execute(
+        f"""
+        WITH RECURSIVE tree(item_id, depth) AS (
+            SELECT item_id, 0 FROM work_items WHERE parent_item_id IS NULL {only_project}
+            UNION ALL
+            SELECT w.item_id, t.depth + 1 FROM work_items w JOIN tree t ON w.parent_item_id = t.item_id
+        )
+        SELECT item_id FROM tree ORDER BY depth DESC
+    """,
+        params,
+    )
+    cursor.executemany(_REFRESH_ROLLUP, [(row[0],) for row in cursor.fetchall()])
+    cursor.execute(f"SELECT project_id FROM projects WHERE 1 {only_project}", params)
+    cursor.executemany(
+        _REFRESH_PROJECT_TOTALS, [(row[0],) for row in cursor.fetchall()]
+    )